@@ -3,71 +3,330 @@
 
 import os
 import json
-from typing import List, Dict, Any, Optional
+import functools
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 from datetime import datetime
 import asyncio
+import threading
 from concurrent.futures import ThreadPoolExecutor
 
-# LangChain Core
+import numpy as np
+
+# LangChain Core (heavy modules - memory, agents, loaders, embeddings, vector
+# stores - are resolved on first use below to keep module import/cold-start cheap)
 from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import BaseOutputParser
+from langchain_core.exceptions import OutputParserException
+from langchain.chains import LLMChain, SequentialChain
+
+# orjson (C/Rust) decodes LLM JSON output several times faster than stdlib json
 try:
-    from langchain_core.prompts import ChatPromptTemplate
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+    ORJSON_AVAILABLE = False
 
-# LangChain Memory
-from langchain.memory import ConversationBufferMemory, ConversationSummaryMemory
-from langchain_community.chat_message_histories import RedisChatMessageHistory
+if TYPE_CHECKING:
+    from langchain.agents import AgentExecutor
 
-# LangChain Tools and Agents
-from langchain.tools import Tool, tool
-from langchain.agents import AgentExecutor, create_openai_tools_agent
+class FastJsonOutputParser(BaseOutputParser):
+    """Parse JSON from LLM output with orjson, tolerating surrounding prose/code fences"""
+    
+    # When False, unparseable output is returned as the raw text instead of raising
+    strict: bool = False
+    
+    def parse(self, text: str) -> Any:
+        starts = [pos for pos in (text.find('{'), text.find('[')) if pos != -1]
+        if starts:
+            start = min(starts)
+            end = text.rfind('}' if text[start] == '{' else ']') + 1
+            if end > start:
+                try:
+                    if ORJSON_AVAILABLE:
+                        return orjson.loads(text[start:end])
+                    return json.loads(text[start:end])
+                except ValueError:
+                    pass
+        
+        if self.strict:
+            raise OutputParserException(f"Could not parse JSON from LLM output: {text[:200]}")
+        return text.strip()
+    
+    @property
+    def _type(self) -> str:
+        return "fast_json"
 
-# Handle import differences between LangChain versions
-try:
-    from langchain.agents.format_scratchpad import format_log_to_messages
-except ImportError:
+@functools.lru_cache(maxsize=1)
+def _get_token_text_splitter_class():
+    """Resolve the tokenizer-backed splitter across LangChain versions"""
     try:
-        from langchain.agents.format_scratchpad import format_to_openai_tool_messages as format_log_to_messages
+        from langchain_text_splitters import SentenceTransformersTokenTextSplitter
     except ImportError:
-        format_log_to_messages = None
-
-try:
-    from langchain.agents.output_parsers import OpenAIToolsAgentOutputParser
-except ImportError:
-    OpenAIToolsAgentOutputParser = None
-
-# LangChain Document Processing
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Qdrant
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import LLMChainExtractor
+        try:
+            from langchain.text_splitter import SentenceTransformersTokenTextSplitter
+        except ImportError:
+            return None
+    return SentenceTransformersTokenTextSplitter
 
-# LangChain Chains
-from langchain.chains import LLMChain, SequentialChain, ConversationChain
-try:
-    from langchain.chains.question_answering import load_qa_chain
-except ImportError:
-    from langchain_community.chains.question_answering import load_qa_chain
+@functools.lru_cache(maxsize=1)
+def _get_load_qa_chain():
+    try:
+        from langchain.chains.question_answering import load_qa_chain
+    except ImportError:
+        from langchain_community.chains.question_answering import load_qa_chain
+    return load_qa_chain
 
-try:
-    from langchain.chains.summarize import load_summarize_chain
-except ImportError:
-    from langchain_community.chains.summarize import load_summarize_chain
+@functools.lru_cache(maxsize=1)
+def _get_load_summarize_chain():
+    try:
+        from langchain.chains.summarize import load_summarize_chain
+    except ImportError:
+        from langchain_community.chains.summarize import load_summarize_chain
+    return load_summarize_chain
 
-# LangChain Callbacks
-from langchain.callbacks import StreamingStdOutCallbackHandler
-from langchain.callbacks.manager import CallbackManager
+@functools.lru_cache(maxsize=1)
+def _get_tools_agent_helpers():
+    """Resolve (format_log_to_messages, OpenAIToolsAgentOutputParser) across LangChain versions"""
+    try:
+        from langchain.agents.format_scratchpad import format_log_to_messages
+    except ImportError:
+        try:
+            from langchain.agents.format_scratchpad import format_to_openai_tool_messages as format_log_to_messages
+        except ImportError:
+            format_log_to_messages = None
+    
+    try:
+        from langchain.agents.output_parsers import OpenAIToolsAgentOutputParser
+    except ImportError:
+        OpenAIToolsAgentOutputParser = None
+    
+    return format_log_to_messages, OpenAIToolsAgentOutputParser
 
 # Custom imports
-from database import get_db, Document, Analysis, qdrant_client, embedding_model
+from database import get_db, Document, Analysis, qdrant_client, embedding_model, VECTOR_SIZE
 from config import GEMINI_API_KEY
 
+# Process-wide worker pool for CPU/IO fan-out (document splitting)
+_EXECUTOR = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4))
+
+# Bound the chat history injected into every prompt: older turns are summarized,
+# recent ones stay verbatim. Tune to the provider context budget minus template size.
+MEMORY_MAX_TOKEN_LIMIT = 1500
+# Fallback window (in exchanges) when no LLM is available to write summaries
+MEMORY_WINDOW_SIZE = 6
+
+# Documents whose chunks fit comfortably in one prompt are summarized with a single
+# "stuff" call; larger ones fall back to map_reduce (map step is one batched generate)
+SUMMARY_CONTEXT_TOKENS = 32000
+SUMMARY_STUFF_MAX_CHARS = int(SUMMARY_CONTEXT_TOKENS * 0.7 * 4)
+
+# Token-based splitting runs in the Rust HF tokenizer (releases the GIL)
+SPLITTER_MODEL_NAME = "all-MiniLM-L6-v2"
+SPLITTER_TOKENS_PER_CHUNK = 256
+SPLITTER_CHUNK_OVERLAP = 50
+
+# Qdrant collection backing the LangChain vector store
+LANGCHAIN_COLLECTION_NAME = "langchain_documents"
+QDRANT_HNSW_EF = 64
+
+def _qdrant_search_params():
+    """Search-time HNSW/quantization params (int8 scan with full-precision rescore)"""
+    from qdrant_client.models import SearchParams, QuantizationSearchParams
+    return SearchParams(
+        hnsw_ef=QDRANT_HNSW_EF,
+        quantization=QuantizationSearchParams(rescore=True)
+    )
+
+def _ensure_langchain_collection():
+    """Create the LangChain collection with int8 scalar quantization if missing"""
+    from qdrant_client.models import (
+        Distance, VectorParams, HnswConfigDiff,
+        ScalarQuantization, ScalarQuantizationConfig, ScalarType
+    )
+    try:
+        qdrant_client.get_collection(LANGCHAIN_COLLECTION_NAME)
+    except Exception:
+        qdrant_client.create_collection(
+            collection_name=LANGCHAIN_COLLECTION_NAME,
+            vectors_config=VectorParams(size=VECTOR_SIZE, distance=Distance.COSINE),
+            hnsw_config=HnswConfigDiff(m=16, ef_construct=128),
+            quantization_config=ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=True)
+            )
+        )
+        print(f"Collection '{LANGCHAIN_COLLECTION_NAME}' created with int8 quantization")
+
+# Document generation prompts, bound once at import; each document type gets its
+# own LLMChain subclass so there is no per-call branching over document_type
+_DOC_PROMPT_TEMPLATES = {
+    "TRD": """
+    You are an expert Technical Requirements Document writer with 20+ years of experience.
+    
+    Previous conversation context:
+    {chat_history}
+    
+    Create a comprehensive Technical Requirements Document based on the following requirements:
+    
+    Requirements: {requirements}
+    Additional Context: {context}
+    
+    Structure the document with:
+    1. Executive Summary
+    2. System Overview
+    3. Functional Requirements
+    4. Non-Functional Requirements
+    5. Technical Specifications
+    6. Security Considerations
+    7. Deployment & Operations
+    8. Testing Strategy
+    
+    Make it comprehensive, technical, and actionable for development teams.
+    """,
+    "HLD": """
+    You are a Senior Solution Architect specializing in High-Level Design.
+    
+    Previous conversation context:
+    {chat_history}
+    
+    Create a High-Level Design document based on:
+    
+    Requirements: {requirements}
+    Additional Context: {context}
+    
+    Include:
+    1. System Architecture Overview
+    2. Component Diagram (Mermaid format)
+    3. Technology Stack
+    4. Integration Points
+    5. Data Flow
+    6. Security Architecture
+    7. Scalability Considerations
+    
+    Focus on architectural decisions and system-level design.
+    """,
+    "LLD": """
+    You are a Senior Software Architect specializing in Low-Level Design.
+    
+    Previous conversation context:
+    {chat_history}
+    
+    Create a detailed Low-Level Design document based on:
+    
+    Requirements: {requirements}
+    Additional Context: {context}
+    
+    Include:
+    1. Detailed Component Design
+    2. Database Schema
+    3. API Specifications
+    4. Class Diagrams (Mermaid format)
+    5. Sequence Diagrams
+    6. Error Handling
+    7. Performance Optimizations
+    
+    Focus on implementation details and technical specifications.
+    """,
+}
+
+_DOC_PROMPTS = {
+    doc_type: PromptTemplate(
+        input_variables=["requirements", "context", "chat_history"],
+        template=template
+    )
+    for doc_type, template in _DOC_PROMPT_TEMPLATES.items()
+}
+
+def _make_document_chain_class(doc_type: str, bound_prompt: PromptTemplate) -> type:
+    """Specialize LLMChain for one document type with its prompt bound as the default"""
+    class DocumentChain(LLMChain):
+        prompt: PromptTemplate = bound_prompt
+    
+    DocumentChain.__name__ = DocumentChain.__qualname__ = f"{doc_type}Chain"
+    return DocumentChain
+
+DOCUMENT_CHAIN_CLASSES = {
+    doc_type: _make_document_chain_class(doc_type, prompt)
+    for doc_type, prompt in _DOC_PROMPTS.items()
+}
+TRDChain = DOCUMENT_CHAIN_CLASSES["TRD"]
+HLDChain = DOCUMENT_CHAIN_CLASSES["HLD"]
+LLDChain = DOCUMENT_CHAIN_CLASSES["LLD"]
+
+# Maximal marginal relevance reranking for search_documents
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+MMR_FETCH_K = 20
+MMR_LAMBDA = 0.5
+
+def _mmr_numpy(query, docs, k, lambda_):
+    """Select k row indices of docs by maximal marginal relevance to query (vectorized)"""
+    n = docs.shape[0]
+    k = min(k, n)
+    doc_norms = np.linalg.norm(docs, axis=1) + 1e-10
+    unit_docs = docs / doc_norms[:, None]
+    relevance = unit_docs @ (query / (np.linalg.norm(query) + 1e-10))
+    similarity = unit_docs @ unit_docs.T
+    
+    selected = np.empty(k, dtype=np.int64)
+    used = np.zeros(n, dtype=np.bool_)
+    redundancy = np.zeros(n, dtype=np.float32)
+    for step in range(k):
+        scores = lambda_ * relevance - (1.0 - lambda_) * redundancy
+        scores[used] = -np.inf
+        best = int(np.argmax(scores))
+        selected[step] = best
+        used[best] = True
+        # Track each candidate's highest similarity to anything already selected
+        redundancy = similarity[best] if step == 0 else np.maximum(redundancy, similarity[best])
+    return selected
+
+def _mmr_kernel(query, docs, k, lambda_):
+    """Loop form of _mmr_numpy for numba to compile"""
+    n = docs.shape[0]
+    k = min(k, n)
+    query_norm = np.sqrt(np.sum(query * query)) + 1e-10
+    doc_norms = np.empty(n, dtype=np.float32)
+    relevance = np.empty(n, dtype=np.float32)
+    for i in range(n):
+        doc_norms[i] = np.sqrt(np.sum(docs[i] * docs[i])) + 1e-10
+        relevance[i] = np.sum(docs[i] * query) / (doc_norms[i] * query_norm)
+    
+    selected = np.empty(k, dtype=np.int64)
+    used = np.zeros(n, dtype=np.bool_)
+    redundancy = np.zeros(n, dtype=np.float32)
+    for step in range(k):
+        # Seed with the first unused candidate rather than an infinite sentinel
+        best = 0
+        while used[best]:
+            best += 1
+        best_score = lambda_ * relevance[best] - (1.0 - lambda_) * redundancy[best]
+        for i in range(best + 1, n):
+            if used[i]:
+                continue
+            score = lambda_ * relevance[i] - (1.0 - lambda_) * redundancy[i]
+            if score > best_score:
+                best_score = score
+                best = i
+        selected[step] = best
+        used[best] = True
+        # Track each candidate's highest similarity to anything already selected
+        for i in range(n):
+            if not used[i]:
+                similarity = np.sum(docs[i] * docs[best]) / (doc_norms[i] * doc_norms[best])
+                if step == 0 or similarity > redundancy[i]:
+                    redundancy[i] = similarity
+    return selected
+
+@functools.lru_cache(maxsize=1)
+def _get_mmr():
+    """Resolve the MMR kernel, JIT-compiling it with numba when installed"""
+    try:
+        import numba
+    except ImportError:
+        return _mmr_numpy
+    # cache=True persists the compiled kernel so later processes skip the JIT. Serial and
+    # without fastmath: MMR_FETCH_K rows are too few for a thread pool to pay off
+    return numba.njit(cache=True)(_mmr_kernel)
+
 class LangChainIntegration:
     """Advanced LangChain integration for enhanced AI capabilities"""
     
@@ -76,125 +335,93 @@ class LangChainIntegration:
         self.memory = None
         self.vector_store = None
         self.text_splitter = None
+        # Chains are built once and reused across requests/agent turns
+        self._chains = {}
+        self._chain_lock = threading.Lock()
+        # Query embeddings are memoized per instance; agent loops often repeat queries
+        self._embed_query = functools.lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(self._compute_query_embedding)
         self.setup_components()
     
     def setup_components(self):
         """Initialize LangChain components"""
         try:
             # Initialize text splitter for document processing
-            self.text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
-                separators=["\n\n", "\n", " ", ""]
-            )
+            self.text_splitter = self._create_text_splitter()
             
             # Initialize embeddings
             if embedding_model:
+                from langchain_community.embeddings import HuggingFaceEmbeddings
                 self.embeddings = HuggingFaceEmbeddings(
                     model_name="all-MiniLM-L6-v2",
                     model_kwargs={'device': 'cpu'}
                 )
             
-            # Initialize memory
-            self.memory = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True
-            )
+            # Initialize memory (bounded so prompt size stays flat over a session)
+            self.memory = self._create_memory()
             
             print("✅ LangChain components initialized successfully")
             
         except Exception as e:
             print(f"⚠️ LangChain initialization warning: {e}")
     
-    def create_document_chain(self, document_type: str) -> LLMChain:
-        """Create specialized document generation chains"""
+    def _create_text_splitter(self):
+        """Create a tokenizer-backed splitter, falling back to the pure-Python one"""
+        SentenceTransformersTokenTextSplitter = _get_token_text_splitter_class()
+        if SentenceTransformersTokenTextSplitter is not None:
+            try:
+                return SentenceTransformersTokenTextSplitter(
+                    model_name=SPLITTER_MODEL_NAME,
+                    tokens_per_chunk=SPLITTER_TOKENS_PER_CHUNK,
+                    chunk_overlap=SPLITTER_CHUNK_OVERLAP
+                )
+            except Exception as e:
+                print(f"⚠️ Token text splitter unavailable, using character splitter: {e}")
         
-        if document_type == "TRD":
-            prompt = PromptTemplate(
-                input_variables=["requirements", "context", "chat_history"],
-                template="""
-                You are an expert Technical Requirements Document writer with 20+ years of experience.
-                
-                Previous conversation context:
-                {chat_history}
-                
-                Create a comprehensive Technical Requirements Document based on the following requirements:
-                
-                Requirements: {requirements}
-                Additional Context: {context}
-                
-                Structure the document with:
-                1. Executive Summary
-                2. System Overview
-                3. Functional Requirements
-                4. Non-Functional Requirements
-                5. Technical Specifications
-                6. Security Considerations
-                7. Deployment & Operations
-                8. Testing Strategy
-                
-                Make it comprehensive, technical, and actionable for development teams.
-                """
-            )
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        return RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200,
+            length_function=len,
+            separators=["\n\n", "\n", " ", ""]
+        )
+    
+    def split_documents(self, documents: List[Dict]) -> List[List[str]]:
+        """Split each document's content into chunks, in parallel across documents"""
+        contents = [doc.get('content', '') for doc in documents]
+        if len(contents) <= 1:
+            return [self.text_splitter.split_text(content) for content in contents]
         
-        elif document_type == "HLD":
-            prompt = PromptTemplate(
-                input_variables=["requirements", "context", "chat_history"],
-                template="""
-                You are a Senior Solution Architect specializing in High-Level Design.
-                
-                Previous conversation context:
-                {chat_history}
-                
-                Create a High-Level Design document based on:
-                
-                Requirements: {requirements}
-                Additional Context: {context}
-                
-                Include:
-                1. System Architecture Overview
-                2. Component Diagram (Mermaid format)
-                3. Technology Stack
-                4. Integration Points
-                5. Data Flow
-                6. Security Architecture
-                7. Scalability Considerations
-                
-                Focus on architectural decisions and system-level design.
-                """
+        # The HF tokenizer releases the GIL, so threads split documents concurrently
+        return list(_EXECUTOR.map(self.text_splitter.split_text, contents))
+    
+    def _create_memory(self):
+        """Create a sliding-window + summary memory for chat history"""
+        llm = self._get_llm()
+        if llm is not None:
+            from langchain.memory import ConversationSummaryBufferMemory
+            return ConversationSummaryBufferMemory(
+                llm=llm,
+                max_token_limit=MEMORY_MAX_TOKEN_LIMIT,
+                memory_key="chat_history",
+                return_messages=True
             )
         
-        elif document_type == "LLD":
-            prompt = PromptTemplate(
-                input_variables=["requirements", "context", "chat_history"],
-                template="""
-                You are a Senior Software Architect specializing in Low-Level Design.
-                
-                Previous conversation context:
-                {chat_history}
-                
-                Create a detailed Low-Level Design document based on:
-                
-                Requirements: {requirements}
-                Additional Context: {context}
-                
-                Include:
-                1. Detailed Component Design
-                2. Database Schema
-                3. API Specifications
-                4. Class Diagrams (Mermaid format)
-                5. Sequence Diagrams
-                6. Error Handling
-                7. Performance Optimizations
-                
-                Focus on implementation details and technical specifications.
-                """
-            )
+        # Summaries need an LLM; keep a plain sliding window until one is wired up
+        from langchain.memory import ConversationBufferWindowMemory
+        return ConversationBufferWindowMemory(
+            k=MEMORY_WINDOW_SIZE,
+            memory_key="chat_history",
+            return_messages=True
+        )
+    
+    def create_document_chain(self, document_type: str) -> LLMChain:
+        """Create specialized document generation chains"""
+        chain_class = DOCUMENT_CHAIN_CLASSES.get(document_type)
+        if chain_class is None:
+            raise ValueError(f"Unsupported document type: {document_type}")
         
-        return LLMChain(
+        return chain_class(
             llm=self._get_llm(),
-            prompt=prompt,
             memory=self.memory,
             verbose=True
         )
@@ -295,11 +522,11 @@ class LangChainIntegration:
         if self.vector_store:
             retriever = self.vector_store.as_retriever(
                 search_type="similarity",
-                search_kwargs={"k": 5}
+                search_kwargs={"k": 5, "search_params": _qdrant_search_params()}
             )
             
             # Create QA chain
-            qa_chain = load_qa_chain(
+            qa_chain = _get_load_qa_chain()(
                 llm=self._get_llm(),
                 chain_type="stuff",
                 verbose=True
@@ -309,15 +536,92 @@ class LangChainIntegration:
         
         return None, None
     
-    def create_summarization_chain(self) -> Any:
+    def create_summarization_chain(self, chain_type: str = "map_reduce") -> Any:
         """Create a document summarization chain"""
         
-        return load_summarize_chain(
+        return _get_load_summarize_chain()(
             llm=self._get_llm(),
-            chain_type="map_reduce",
+            chain_type=chain_type,
             verbose=True
         )
     
+    def create_key_points_chain(self) -> LLMChain:
+        """Create a key point extraction chain"""
+        
+        key_points_prompt = PromptTemplate(
+            input_variables=["text"],
+            template="""
+            Extract the key points from the following text:
+            
+            {text}
+            
+            Provide a list of key points in JSON format.
+            """
+        )
+        
+        return LLMChain(
+            llm=self._get_llm(),
+            prompt=key_points_prompt,
+            output_parser=FastJsonOutputParser()
+        )
+    
+    def create_backlog_chain(self) -> LLMChain:
+        """Create a backlog generation chain"""
+        
+        backlog_prompt = PromptTemplate(
+            input_variables=["requirements"],
+            template="""
+            Create a comprehensive project backlog from the following requirements:
+            
+            {requirements}
+            
+            Structure as:
+            1. Epics
+            2. Features
+            3. User Stories
+            4. Acceptance Criteria
+            
+            Provide in JSON format.
+            """
+        )
+        
+        return LLMChain(
+            llm=self._get_llm(),
+            prompt=backlog_prompt
+        )
+    
+    def _get_or_create_chain(self, key: str, factory, *args):
+        """Return a pooled chain, building it once on first use (thread-safe)"""
+        chain = self._chains.get(key)
+        if chain is None:
+            with self._chain_lock:
+                chain = self._chains.get(key)
+                if chain is None:
+                    chain = factory(*args)
+                    self._chains[key] = chain
+        return chain
+    
+    @property
+    def analysis_chain(self) -> SequentialChain:
+        return self._get_or_create_chain("analysis", self.create_analysis_chain)
+    
+    def get_summarization_chain(self, chunks: List[str]) -> Any:
+        """Return a pooled summarization chain sized to the document"""
+        chain_type = "stuff" if sum(len(chunk) for chunk in chunks) < SUMMARY_STUFF_MAX_CHARS else "map_reduce"
+        return self._get_or_create_chain(f"summarization:{chain_type}", self.create_summarization_chain, chain_type)
+    
+    @property
+    def key_points_chain(self) -> LLMChain:
+        return self._get_or_create_chain("key_points", self.create_key_points_chain)
+    
+    @property
+    def backlog_chain(self) -> LLMChain:
+        return self._get_or_create_chain("backlog", self.create_backlog_chain)
+    
+    def get_document_chain(self, document_type: str) -> LLMChain:
+        """Return the pooled document generation chain for a document type"""
+        return self._get_or_create_chain(f"document:{document_type}", self.create_document_chain, document_type)
+    
     def process_documents_with_langchain(self, documents: List[Dict]) -> Dict[str, Any]:
         """Process documents using LangChain for enhanced analysis"""
         
@@ -328,60 +632,47 @@ class LangChainIntegration:
             "recommendations": []
         }
         
-        for doc in documents:
-            # Split document into chunks
-            chunks = self.text_splitter.split_text(doc.get('content', ''))
-            
-            # Create summarization chain
-            summarize_chain = self.create_summarization_chain()
-            
+        for doc, chunks in zip(documents, self.split_documents(documents)):
             # Generate summary
             if chunks:
-                summary = summarize_chain.run(chunks)
+                summary = self.get_summarization_chain(chunks).run(chunks)
                 results["summaries"].append({
                     "document_id": doc.get('id'),
                     "summary": summary
                 })
-            
-            # Extract key points
-            key_points_prompt = PromptTemplate(
-                input_variables=["text"],
-                template="""
-                Extract the key points from the following text:
-                
-                {text}
-                
-                Provide a list of key points in JSON format.
-                """
-            )
-            
-            key_points_chain = LLMChain(
-                llm=self._get_llm(),
-                prompt=key_points_prompt
+        
+        # Extract key points for all documents in one batched LLM generate call
+        if documents:
+            key_points_outputs = self.key_points_chain.apply(
+                [{"text": doc.get('content', '')} for doc in documents]
             )
-            
-            key_points = key_points_chain.run(doc.get('content', ''))
-            results["key_points"].append({
-                "document_id": doc.get('id'),
-                "key_points": key_points
-            })
+            for doc, output in zip(documents, key_points_outputs):
+                results["key_points"].append({
+                    "document_id": doc.get('id'),
+                    "key_points": output["text"]
+                })
         
         return results
     
-    def create_agent_with_tools(self) -> AgentExecutor:
+    def create_agent_with_tools(self) -> "AgentExecutor":
         """Create an agent with custom tools for business analysis"""
+        from langchain.tools import tool
+        from langchain.agents import AgentExecutor, create_openai_tools_agent
+        try:
+            from langchain_core.prompts import ChatPromptTemplate
+        except ImportError:
+            from langchain.prompts import ChatPromptTemplate
+        format_log_to_messages, OpenAIToolsAgentOutputParser = _get_tools_agent_helpers()
         
         @tool
         def analyze_requirements(text: str) -> str:
             """Analyze business requirements and extract key information"""
-            analysis_chain = self.create_analysis_chain()
-            return analysis_chain.run({"input_text": text})
+            return self.analysis_chain.run({"input_text": text})
         
         @tool
         def generate_document(doc_type: str, requirements: str) -> str:
             """Generate technical documents (TRD, HLD, LLD)"""
-            doc_chain = self.create_document_chain(doc_type)
-            return doc_chain.run({
+            return self.get_document_chain(doc_type).run({
                 "requirements": requirements,
                 "context": "",
                 "chat_history": ""
@@ -391,36 +682,13 @@ class LangChainIntegration:
         def search_documents(query: str) -> str:
             """Search through stored documents for relevant information"""
             if self.vector_store:
-                docs = self.vector_store.similarity_search(query, k=3)
-                return "\n\n".join([doc.page_content for doc in docs])
+                return "\n\n".join(self.search_with_mmr(query, k=3))
             return "Vector store not available"
         
         @tool
         def create_backlog(requirements: str) -> str:
             """Create a project backlog from requirements"""
-            backlog_prompt = PromptTemplate(
-                input_variables=["requirements"],
-                template="""
-                Create a comprehensive project backlog from the following requirements:
-                
-                {requirements}
-                
-                Structure as:
-                1. Epics
-                2. Features
-                3. User Stories
-                4. Acceptance Criteria
-                
-                Provide in JSON format.
-                """
-            )
-            
-            backlog_chain = LLMChain(
-                llm=self._get_llm(),
-                prompt=backlog_prompt
-            )
-            
-            return backlog_chain.run({"requirements": requirements})
+            return self.backlog_chain.run({"requirements": requirements})
         
         # Create tools list
         tools = [
@@ -489,10 +757,7 @@ class LangChainIntegration:
             texts = []
             metadatas = []
             
-            for doc in documents:
-                # Split document into chunks
-                chunks = self.text_splitter.split_text(doc.get('content', ''))
-                
+            for doc, chunks in zip(documents, self.split_documents(documents)):
                 for i, chunk in enumerate(chunks):
                     texts.append(chunk)
                     metadatas.append({
@@ -502,20 +767,53 @@ class LangChainIntegration:
                         "source": "langchain_processing"
                     })
             
-            # Create vector store
+            # Create vector store (on a quantized, HNSW-tuned collection)
+            _ensure_langchain_collection()
+            from langchain_community.vectorstores import Qdrant
             self.vector_store = Qdrant.from_texts(
                 texts=texts,
                 embedding=self.embeddings,
                 metadatas=metadatas,
                 client=qdrant_client,
-                collection_name="langchain_documents"
+                collection_name=LANGCHAIN_COLLECTION_NAME
             )
             
             print(f"✅ Vector store created with {len(texts)} chunks")
             
+            # Compile (or load the cached) MMR kernel now rather than on the first search
+            _get_mmr()(np.zeros(2, dtype=np.float32), np.ones((2, 2), dtype=np.float32), 1, MMR_LAMBDA)
+            
         except Exception as e:
             print(f"⚠️ Vector store setup failed: {e}")
     
+    def _compute_query_embedding(self, query: str) -> tuple:
+        """Embed a search query (tuple so the LRU cache entry is immutable)"""
+        return tuple(self.embeddings.embed_query(query))
+    
+    def search_with_mmr(self, query: str, k: int = 3) -> List[str]:
+        """Similarity search reranked with maximal marginal relevance"""
+        try:
+            query_vector = list(self._embed_query(query))
+            points = self.vector_store.client.search(
+                collection_name=self.vector_store.collection_name,
+                query_vector=query_vector,
+                limit=MMR_FETCH_K,
+                search_params=_qdrant_search_params(),
+                with_payload=True,
+                with_vectors=True
+            )
+            if not points:
+                return []
+            
+            doc_vectors = np.asarray([point.vector for point in points], dtype=np.float32)
+            selected = _get_mmr()(np.asarray(query_vector, dtype=np.float32), doc_vectors, k, MMR_LAMBDA)
+            content_key = self.vector_store.content_payload_key
+            return [(points[i].payload or {}).get(content_key, "") for i in selected]
+        except Exception as e:
+            print(f"⚠️ MMR search failed, using plain similarity search: {e}")
+            docs = self.vector_store.similarity_search(query, k=k, search_params=_qdrant_search_params())
+            return [doc.page_content for doc in docs]
+    
     def get_conversation_history(self) -> List[Dict]:
         """Get conversation history from memory"""
         if self.memory:
@@ -1,20 +1,39 @@
 # main.py
 # Agentic Framework Backend for the AI Business Analyst - FINAL
 
-from flask import Flask, request, jsonify, redirect, send_file, send_from_directory
+from flask import Flask, Response, request, jsonify, redirect, send_file, send_from_directory, stream_with_context
 from flask_cors import CORS
 import os
 # Ensure Flask does not auto-load .env with default UTF-8 decoding
 os.environ.setdefault("FLASK_SKIP_DOTENV", "1")
 from io import BytesIO
 import requests
+from urllib3.util.retry import Retry
 import json
 import uuid
 import base64
+import binascii
+import copy
 import io
+import logging
+import logging.handlers
+import math
+import queue
+import sys
+import atexit
+import functools
+import hashlib
+import heapq
+import importlib.util
+import itertools
 import re
+import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime, timezone
+from concurrent.futures import Future, ThreadPoolExecutor
 from werkzeug.utils import secure_filename
+from urllib.parse import quote
 from sqlalchemy import text
 
 # --- File Parsing Libraries ---
@@ -25,16 +44,66 @@ from docx.enum.text import WD_ALIGN_PARAGRAPH
 import PyPDF2
 import docx
 
+# PDFium (C++) text extraction is much faster than PyPDF2's pure-Python parser
+try:
+    import pypdfium2
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+
+# orjson (Rust) serializes large JSON responses several times faster than stdlib json
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+def json_dumps_bytes(obj, sort_keys=False):
+    """Serialize obj to UTF-8 JSON bytes, with orjson when it is installed"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+    return json.dumps(obj, sort_keys=sort_keys).encode('utf-8')
+
+def json_loads(data):
+    """Parse JSON from str or bytes, with orjson when it is installed"""
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+# Image conversion backends, all optional; imported once at startup so the first WMF/BMP
+# request doesn't pay library (ImageMagick/OpenCV) load time
+try:
+    from PIL import Image, ImageDraw
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    from wand.image import Image as WandImage
+    WAND_AVAILABLE = True
+except ImportError:
+    WAND_AVAILABLE = False
+
+try:
+    import cv2
+    import numpy as np
+    OPENCV_AVAILABLE = True
+except ImportError:
+    OPENCV_AVAILABLE = False
+
+# pdf2image is only reported by setup_enhanced_image_processing, so probe without importing it
+PDF2IMAGE_AVAILABLE = importlib.util.find_spec("pdf2image") is not None
+
 # --- Azure SDKs ---
 from azure.communication.email import EmailClient
 
 # --- Database imports ---
 from database import (
-    init_db, get_db, save_document_to_db, save_document_to_db_direct, save_analysis_to_db,
-    add_to_vector_db, search_vector_db, Document, Analysis,
+    init_db, get_db, db_session, save_document_to_db, save_document_to_db_direct, save_analysis_to_db,
+    embedding_batcher, embedding_model, search_vector_db, Document, Analysis,
     save_approval_to_db, get_approval_from_db, update_approval_in_db, update_approval_in_db_with_data,
-    get_all_documents_from_db, get_all_documents_from_db_direct, get_all_analyses_from_db, get_analysis_details_from_db,
+    get_all_documents_from_db_direct, get_all_analyses_from_db, get_analysis_details_from_db,
     check_document_exists_by_name, check_document_exists_by_name_direct, get_document_by_id, get_analysis_by_id_from_db,
+    get_document_by_content_hash,
     delete_from_vector_db
 )
 
@@ -66,9 +135,55 @@ from config import (
     LUCID_ENABLED
 )
 
+# Application logger; messages are %-formatted lazily, so disabled levels cost nothing.
+# Request threads only enqueue records; one listener thread writes them, so agents
+# never contend on the stdout lock or wait on its flush
+logger = logging.getLogger('ba_agent')
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+if not logger.handlers:
+    _log_handler = logging.StreamHandler(sys.stdout)
+    _log_handler.setFormatter(logging.Formatter('%(message)s'))
+    _log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+    logger.propagate = False
+
 # Initialize the Flask application
 app = Flask(__name__)
 
+if ORJSON_AVAILABLE:
+    class ORJSONProvider(DefaultJSONProvider):
+        """Flask JSON provider backed by orjson; unknown types fall back to Flask's default()"""
+
+        # Dates pass through to Flask's default() so they keep the RFC 822 http_date
+        # wire format the API has always sent (orjson would emit ISO-8601 natively)
+        _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+
+        def _options(self):
+            # Keep DefaultJSONProvider's sorted keys unless sort_keys is turned off
+            return self._OPTIONS | orjson.OPT_SORT_KEYS if self.sort_keys else self._OPTIONS
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            """jsonify() body straight from orjson's bytes, skipping the str decode/re-encode"""
+            obj = self._prepare_response_obj(args, kwargs)
+            option = self._options() | orjson.OPT_APPEND_NEWLINE
+            if self.compact is False or (self.compact is None and self._app.debug):
+                option |= orjson.OPT_INDENT_2
+            return self._app.response_class(
+                orjson.dumps(obj, default=self.default, option=option),
+                mimetype=self.mimetype
+            )
+
+    app.json = ORJSONProvider(app)
+
 # Initialize database
 init_db()
 
@@ -84,8 +199,112 @@ enhanced_doc_generator = EnhancedDocumentGenerator(None)  # Will be set with LLM
 # --- In-memory storage for approvals (fallback only) ---
 approval_statuses = {}
 
+# --- Background work (vector indexing, log persistence) off the request thread ---
+background_executor = ThreadPoolExecutor(max_workers=4)
+
+# Uploads are copied from the request stream to disk in chunks of this size
+UPLOAD_COPY_CHUNK_SIZE = 64 * 1024
+
 # --- Token Consumption Tracking ---
-token_consumption_logs = []
+TOKEN_LOG_MEMORY_LIMIT = 10000  # recent entries kept in memory; older ones live in TOKEN_LOG_FILE
+token_consumption_logs = deque(maxlen=TOKEN_LOG_MEMORY_LIMIT)
+_total_tokens = 0  # running total, survives entries falling out of the deque
+TOKEN_LOG_FILE = "token_logs.jsonl"  # append-only, one compact JSON entry per line
+TOKEN_LOG_FLUSH_DELAY = 2.0  # seconds; bursts of log entries share one file write
+_token_log_lock = threading.Lock()
+_token_log_flush_timer = None
+_pending_token_logs = []  # entries not yet appended to TOKEN_LOG_FILE
+LEGACY_TOKEN_LOG_FILE = "token_logs.json"  # pre-JSONL format: one JSON array rewritten on every save
+
+def _migrate_legacy_token_logs():
+    """Import the legacy JSON-array token log into TOKEN_LOG_FILE once, then retire it"""
+    if not os.path.exists(LEGACY_TOKEN_LOG_FILE):
+        return
+    try:
+        with open(LEGACY_TOKEN_LOG_FILE, "r") as f:
+            entries = json.load(f)
+        if not isinstance(entries, list):
+            raise ValueError("expected a JSON array of log entries")
+        # Legacy entries predate anything in the JSONL file, so they go first
+        existing = ""
+        if os.path.exists(TOKEN_LOG_FILE):
+            with open(TOKEN_LOG_FILE, "r") as f:
+                existing = f.read()
+        with open(TOKEN_LOG_FILE + ".tmp", "w") as f:
+            f.write("".join(json.dumps(entry, separators=(',', ':')) + "\n" for entry in entries))
+            f.write(existing)
+        os.replace(TOKEN_LOG_FILE + ".tmp", TOKEN_LOG_FILE)
+        os.replace(LEGACY_TOKEN_LOG_FILE, LEGACY_TOKEN_LOG_FILE + ".migrated")
+        print(f"📦 Migrated {len(entries)} token log entries from {LEGACY_TOKEN_LOG_FILE} to {TOKEN_LOG_FILE}")
+    except Exception as e:
+        print(f"Warning: Could not migrate legacy token logs: {e}")
+
+_migrate_legacy_token_logs()
+# Entries written by earlier processes end at this offset; later bytes are ours
+_token_log_history_end = os.path.getsize(TOKEN_LOG_FILE) if os.path.exists(TOKEN_LOG_FILE) else 0
+
+def _flush_token_logs():
+    """Append pending token log entries to disk"""
+    with _token_log_lock:
+        batch = list(_pending_token_logs)
+        _pending_token_logs.clear()
+    if not batch:
+        return
+    try:
+        with open(TOKEN_LOG_FILE, "a") as f:
+            f.write("".join(json.dumps(entry, separators=(',', ':')) + "\n" for entry in batch))
+    except Exception as e:
+        print(f"Warning: Could not save token logs: {e}")
+        with _token_log_lock:
+            _pending_token_logs[:0] = batch
+
+@functools.lru_cache(maxsize=1)
+def _load_token_log_history():
+    """Read token log entries persisted by previous runs (once, on first request)"""
+    history = []
+    if not _token_log_history_end:
+        return history
+    try:
+        with open(TOKEN_LOG_FILE, "rb") as f:
+            for line in f.read(_token_log_history_end).decode("utf-8").splitlines():
+                if line.strip():
+                    history.append(json.loads(line))
+    except Exception as e:
+        print(f"Warning: Could not load token logs: {e}")
+    return history
+
+def _schedule_token_log_flush():
+    """Debounce token log writes onto the background executor"""
+    global _token_log_flush_timer
+    with _token_log_lock:
+        if _token_log_flush_timer is not None:
+            return
+        _token_log_flush_timer = threading.Timer(TOKEN_LOG_FLUSH_DELAY, _run_token_log_flush)
+        _token_log_flush_timer.daemon = True
+        _token_log_flush_timer.start()
+
+def _run_token_log_flush():
+    global _token_log_flush_timer
+    with _token_log_lock:
+        _token_log_flush_timer = None
+    background_executor.submit(_flush_token_logs)
+
+def _shutdown_background_work():
+    """Flush pending token logs and drain background tasks on process exit"""
+    with _token_log_lock:
+        pending = _token_log_flush_timer
+    if pending is not None:
+        pending.cancel()
+    background_executor.shutdown(wait=True)
+    _flush_token_logs()
+
+atexit.register(_shutdown_background_work)
+
+def _approx_tokens(text):
+    """Rough token estimate (~1.3 tokens per word) counted with C-level str.count, no word list"""
+    if not text:
+        return 0
+    return (text.count(' ') + text.count('\n') + 1) * 1.3
 
 def log_token_consumption(stage, tokens_used, model_used="gemini-pro", details=None):
     """Log token consumption for each stage with detailed information"""
@@ -96,14 +315,15 @@ def log_token_consumption(stage, tokens_used, model_used="gemini-pro", details=N
         "model_used": model_used,
         "details": details or {}
     }
-    token_consumption_logs.append(log_entry)
+    global _total_tokens
+    with _token_log_lock:
+        token_consumption_logs.append(log_entry)
+        _pending_token_logs.append(log_entry)
+        _total_tokens += tokens_used
+        total_so_far = _total_tokens
     
-    # Save to file for persistence
-    try:
-        with open("token_logs.json", "w") as f:
-            json.dump(token_consumption_logs, f, indent=2)
-    except Exception as e:
-        print(f"Warning: Could not save token logs: {e}")
+    # Save to file for persistence (debounced, off the request thread)
+    _schedule_token_log_flush()
     
     # Print detailed log to console
     print(f"🔍 TOKEN LOG: {stage.upper()}")
@@ -112,12 +332,73 @@ def log_token_consumption(stage, tokens_used, model_used="gemini-pro", details=N
     print(f"   ⏰ Timestamp: {log_entry['timestamp']}")
     if details:
         print(f"   📝 Details: {details}")
-    print(f"   📈 Total Tokens So Far: {sum(log['tokens_used'] for log in token_consumption_logs):,}")
+    print(f"   📈 Total Tokens So Far: {total_so_far:,}")
     print("─" * 50)
 
 # ----------------------------------------------------------------------------
 # Line of Business (LOB) classification
 # ----------------------------------------------------------------------------
+LOB_INSURANCE_TERMS = [
+    "insurance", "insurer", "policy", "premium", "claim", "underwriting",
+    "broker", "reinsurance", "adjuster", "loss ratio", "actuarial", "coverage",
+    "deductible", "endorsement", "exposure", "policyholder"
+]
+LOB_PNC_TERMS = [
+    "property", "casualty", "auto", "motor", "homeowners", "commercial lines",
+    "workers' compensation", "general liability", "umbrella", "marine", "aviation",
+    "bond", "surety", "acord", "iso form"
+]
+LOB_US_MARKERS = [
+    "naic", "acord", "state farm", "progressive", "geico", "usaa", "hipaa", "pci-dss"
+]
+LOB_EU_MARKERS = [
+    "gdpr", "eiopa", "solvency ii", "lloyd's", "fca", "prudential regulation"
+]
+
+# Sub-line of business (LoB) categories within P&C
+LOB_PNC_CATEGORIES: dict[str, list[str]] = {
+    "personal_auto": ["personal auto", "auto policy", "motor policy", "bodily injury", "collision", "comprehensive", "vehicle", "driver"],
+    "commercial_auto": ["commercial auto", "fleet", "trucking", "motor carrier", "garage liability"],
+    "homeowners": ["homeowners", "dwelling", "ho-3", "ho3", "renters", "condo", "hazard"],
+    "property": ["property", "fire", "inland marine", "builders risk", "business interruption", "contents"],
+    "general_liability": ["general liability", "cgl", "liability", "premises operations", "products completed operations"],
+    "workers_comp": ["workers' compensation", "work comp", "wc", "experience mod", "ncci"],
+    "environmental": ["environmental", "pollution", "epa", "spill", "remediation"],
+    "professional_liability": ["professional liability", "e&o", "errors and omissions", "malpractice"],
+    "financial_lines": ["d&o", "directors and officers", "crime", "fidelity", "kidnap", "ransom", "fi", "financial institutions"],
+    "marine": ["ocean marine", "cargo", "hull", "inland marine"],
+    "aviation": ["aviation", "aircraft", "hangar"],
+    "cyber": ["cyber", "privacy", "data breach", "ransomware"],
+    "umbrella": ["umbrella", "excess liability", "excess"]
+}
+
+LOB_ALL_TERMS = frozenset(
+    LOB_INSURANCE_TERMS + LOB_PNC_TERMS + LOB_US_MARKERS + LOB_EU_MARKERS
+    + [kw for keywords in LOB_PNC_CATEGORIES.values() for kw in keywords]
+)
+
+# Aho-Corasick automaton over every LOB keyword, built once per process, so the
+# document text is scanned a single time instead of once per keyword
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+if AHOCORASICK_AVAILABLE:
+    _lob_automaton = ahocorasick.Automaton()
+    for _term in LOB_ALL_TERMS:
+        _lob_automaton.add_word(_term, _term)
+    _lob_automaton.make_automaton()
+else:
+    _lob_automaton = None
+
+def _find_lob_terms(lowered: str) -> set:
+    """Return the set of LOB keywords occurring (as substrings) in lowered text"""
+    if _lob_automaton is not None:
+        return {term for _, term in _lob_automaton.iter(lowered)}
+    return {term for term in LOB_ALL_TERMS if term in lowered}
+
 def classify_line_of_business(text: str) -> dict:
     """Classify the uploaded document's line of business and region.
 
@@ -133,63 +414,29 @@ def classify_line_of_business(text: str) -> dict:
             "matched_terms": []
         }
 
-    lowered = text.lower()
-
-    insurance_terms = [
-        "insurance", "insurer", "policy", "premium", "claim", "underwriting",
-        "broker", "reinsurance", "adjuster", "loss ratio", "actuarial", "coverage",
-        "deductible", "endorsement", "exposure", "policyholder"
-    ]
-    pnc_terms = [
-        "property", "casualty", "auto", "motor", "homeowners", "commercial lines",
-        "workers' compensation", "general liability", "umbrella", "marine", "aviation",
-        "bond", "surety", "acord", "iso form"
-    ]
-    us_markers = [
-        "naic", "acord", "state farm", "progressive", "geico", "usaa", "hipaa", "pci-dss"
-    ]
-    eu_markers = [
-        "gdpr", "eiopa", "solvency ii", "lloyd's", "fca", "prudential regulation"
-    ]
-
-    # Sub-line of business (LoB) categories within P&C
-    pnc_categories: dict[str, list[str]] = {
-        "personal_auto": ["personal auto", "auto policy", "motor policy", "bodily injury", "collision", "comprehensive", "vehicle", "driver"],
-        "commercial_auto": ["commercial auto", "fleet", "trucking", "motor carrier", "garage liability"],
-        "homeowners": ["homeowners", "dwelling", "ho-3", "ho3", "renters", "condo", "hazard"],
-        "property": ["property", "fire", "inland marine", "builders risk", "business interruption", "contents"],
-        "general_liability": ["general liability", "cgl", "liability", "premises operations", "products completed operations"],
-        "workers_comp": ["workers' compensation", "work comp", "wc", "experience mod", "ncci"],
-        "environmental": ["environmental", "pollution", "epa", "spill", "remediation"],
-        "professional_liability": ["professional liability", "e&o", "errors and omissions", "malpractice"],
-        "financial_lines": ["d&o", "directors and officers", "crime", "fidelity", "kidnap", "ransom", "fi", "financial institutions"],
-        "marine": ["ocean marine", "cargo", "hull", "inland marine"],
-        "aviation": ["aviation", "aircraft", "hangar"],
-        "cyber": ["cyber", "privacy", "data breach", "ransomware"],
-        "umbrella": ["umbrella", "excess liability", "excess"]
-    }
+    hits = _find_lob_terms(text.lower())
 
     matched = []
     score = 0
-    for term in insurance_terms:
-        if term in lowered:
+    for term in LOB_INSURANCE_TERMS:
+        if term in hits:
             matched.append(term)
             score += 1
-    for term in pnc_terms:
-        if term in lowered:
+    for term in LOB_PNC_TERMS:
+        if term in hits:
             matched.append(term)
             score += 2
 
     region = "unknown"
-    if any(m in lowered for m in us_markers):
+    if any(m in hits for m in LOB_US_MARKERS):
         region = "US"
         score += 1
-    if any(m in lowered for m in eu_markers):
+    if any(m in hits for m in LOB_EU_MARKERS):
         region = "Europe" if region == "unknown" else region
         score += 1
 
     industry = "Insurance" if score > 0 else "unknown"
-    segment = "P&C" if any(t in lowered for t in pnc_terms) else ("Insurance" if industry == "Insurance" else "unknown")
+    segment = "P&C" if any(t in hits for t in LOB_PNC_TERMS) else ("Insurance" if industry == "Insurance" else "unknown")
 
     # Normalize region for insurance context
     if industry == "Insurance" and segment == "P&C" and region == "unknown":
@@ -198,24 +445,20 @@ def classify_line_of_business(text: str) -> dict:
 
     # Detect sub-LoB categories and assign scores
     category_hits = []
-    for category, keywords in pnc_categories.items():
-        cat_terms = []
-        cat_score = 0
-        for kw in keywords:
-            if kw in lowered:
-                cat_terms.append(kw)
-                cat_score += 1
+    for category, keywords in LOB_PNC_CATEGORIES.items():
+        cat_terms = [kw for kw in keywords if kw in hits]
         if cat_terms:
             category_hits.append({
                 "name": category,
-                "score": cat_score,
+                "score": len(cat_terms),
                 "matched_terms": cat_terms
             })
 
-    # Normalize confidences for categories
-    max_cat = max((c["score"] for c in category_hits), default=0)
-    for c in category_hits:
-        c["confidence"] = round(min(1.0, (c["score"] / max(1, max_cat)) * 0.9 + 0.1), 2)
+    # Keep the top categories, then normalize confidences only for those
+    top_categories = heapq.nlargest(6, category_hits, key=lambda x: x["score"])
+    max_cat = max(1, top_categories[0]["score"]) if top_categories else 1
+    for c in top_categories:
+        c["confidence"] = round(min(1.0, (c["score"] / max_cat) * 0.9 + 0.1), 2)
 
     confidence = min(1.0, score / 12.0)
 
@@ -225,15 +468,59 @@ def classify_line_of_business(text: str) -> dict:
         "region": region,
         "confidence": round(confidence, 2),
         "matched_terms": matched[:20],
-        "lob_categories": sorted(category_hits, key=lambda x: x["score"], reverse=True)[:6]
+        "lob_categories": top_categories
     }
 
 @app.route("/api/token_logs", methods=['GET'])
 def get_token_logs():
     """Get token consumption logs"""
-    return jsonify(token_consumption_logs)
+    return jsonify(_load_token_log_history() + list(token_consumption_logs))
 
 # --- Document Management ---
+# Short-lived cache of document-name existence checks so repeated/duplicate uploads
+# skip the direct PostgreSQL round trip; the DB stays the source of truth
+DOCUMENT_NAME_CACHE_TTL = 60
+DOCUMENT_NAME_CACHE_MAX = 10000
+_document_name_cache = {}
+_document_name_cache_lock = threading.Lock()
+
+def document_name_exists(filename):
+    """Check whether a document name is taken, via a TTL cache in front of the DB"""
+    now = time.monotonic()
+    with _document_name_cache_lock:
+        cached = _document_name_cache.get(filename)
+        if cached and cached[1] > now:
+            return cached[0]
+
+    exists = check_document_exists_by_name_direct(filename)
+    remember_document_name(filename, exists)
+    return exists
+
+def remember_document_name(filename, exists=True):
+    """Record a known existence result (e.g. right after inserting the document)"""
+    with _document_name_cache_lock:
+        if len(_document_name_cache) >= DOCUMENT_NAME_CACHE_MAX:
+            _document_name_cache.clear()
+        _document_name_cache[filename] = (exists, time.monotonic() + DOCUMENT_NAME_CACHE_TTL)
+
+# Cached /api/documents/files listing; uploads invalidate it
+UPLOADS_LISTING_CACHE_TTL = 5
+_uploads_listing_cache = {"payload": None, "expires": 0.0}
+_uploads_listing_lock = threading.Lock()
+
+def invalidate_uploads_listing():
+    """Drop the cached uploads listing so the next request rescans the directory"""
+    with _uploads_listing_lock:
+        _uploads_listing_cache["payload"] = None
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """SHA-256 of a file on disk, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 # --- Document Management ---
 @app.route("/api/upload_document", methods=['POST'])
 def upload_document():
@@ -255,7 +542,7 @@ def upload_document():
 
         # Check if document with same name already exists
         print(f"🔍 [Upload] Checking if file '{file.filename}' already exists...")
-        if check_document_exists_by_name_direct(file.filename):
+        if document_name_exists(file.filename):
             print(f"⚠️ [Upload] File already exists: {file.filename}")
             print(f"DEBUG: Document with name '{file.filename}' already exists, skipping upload")
             return jsonify({
@@ -263,193 +550,121 @@ def upload_document():
                 "duplicate": True
             }), 409  # Conflict status code
 
-        # Read file content once and store it
-        file_content_bytes = file.read()
-        file_size = len(file_content_bytes)
-        print(f"DEBUG: File size: {file_size} bytes")
-        
         # Create uploads directory if it doesn't exist
         uploads_dir = "uploads"
         if not os.path.exists(uploads_dir):
             os.makedirs(uploads_dir)
             print(f"📁 Created uploads directory: {uploads_dir}")
         
-        # Extract content from file
-        file_content, images, error = agent_extract_content(io.BytesIO(file_content_bytes), file.filename)
-        if error:
-            print(f"DEBUG: Content extraction failed: {error}")
-            return jsonify({"error": f"Failed to extract content: {error}"}), 500
-
-        print(f"DEBUG: Content extracted successfully, length: {len(file_content)} characters")
-
-        # Create document record
-        doc_id = str(uuid.uuid4())
-        # Now persist original upload to disk under generated ID
+        # Create document record and stream the upload straight to disk under its ID
+        doc_id = uuid.uuid4().hex
         file_path = f"{uploads_dir}/{doc_id}_{file.filename}"
-        with open(file_path, 'wb') as f:
-            f.write(file_content_bytes)
+        file.save(file_path, buffer_size=UPLOAD_COPY_CHUNK_SIZE)
+        invalidate_uploads_listing()
+        file_size = os.path.getsize(file_path)
+        content_hash = file_sha256(file_path)
         print(f"💾 [File] Saved file to disk: {file_path}")
+        print(f"DEBUG: File size: {file_size} bytes")
         
-        # Classify LOB for the document
-        lob_info = classify_line_of_business(file_content)
-
-        document_data = {
-            "id": doc_id,
-            "name": file.filename,
-            "uploadDate": datetime.now().isoformat(),
-            "fileType": file.filename.split('.')[-1].lower(),
-            "size": file_size,
-            "status": "uploaded",
-            "lob": lob_info
-        }
-        
-        print(f"DEBUG: Document data created with ID: {doc_id}")
-        
-        # Save to database using SQLAlchemy, add to vector DB with LOB metadata
-        db = next(get_db())
-        try:
-            print(f"💾 [DB] Saving document to database using SQLAlchemy: {file.filename}")
-            # The line below is the one you need to check.
-            saved_doc = save_document_to_db(db, user_email="guest", file_name=file.filename, file_type=document_data["fileType"], file_path=file_path, file_content=file_content, meta=document_data, status="uploaded")
-            
-            # --- START OF THE REQUIRED CHANGE ---
-            if saved_doc is None:
-                # If the database save failed, return an error.
-                return jsonify({
-                    "status": "error",
-                    "message": "Failed to save document to database."
-                }), 500
-            # --- END OF THE REQUIRED CHANGE ---
-
-            print(f"✅ [DB] Document stored with ID: {doc_id}")
-
-            # Add to vector database
-            print(f"📡 [VectorDB] Adding to vector DB...")
-            add_to_vector_db(
-                content=file_content,
-                meta={
-                    "id": doc_id,
-                    "name": file.filename,
-                    "type": "document",
-                    "upload_date": document_data["uploadDate"],
-                    "lob": lob_info
-                },
-                collection_name="documents"
-            )
-            print(f"✅ [VectorDB] Added to vector DB")
-
-        except Exception as db_error:
-            print(f"❌ [DB] Failed to save document: {db_error}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({
-                "status": "error",
-                "message": f"Failed to save document to the database: {str(db_error)}"
-            }), 500
-        finally:
+        # Byte-identical re-upload: hand back the stored document instead of extracting,
+        # saving and embedding the same content again
+        with db_session() as db:
+            existing = get_document_by_content_hash(db, content_hash)
+        if existing:
+            print(f"♻️ [Upload] Identical content already stored as {existing['id']}, skipping re-ingest")
             try:
-                db.close()
-            except Exception:
+                os.remove(file_path)
+            except OSError:
                 pass
+            invalidate_uploads_listing()
+            existing_meta = existing.get('meta') or {}
+            return jsonify({
+                "success": True,
+                "message": "Identical document already uploaded",
+                "duplicate_content": True,
+                "id": existing['id'],
+                "name": existing['name'],
+                "uploadDate": existing_meta.get("uploadDate", existing['upload_date']),
+                "fileType": existing['file_type'],
+                "status": existing['status'],
+                "file_path": existing['file_path'],
+                "size": existing_meta.get("size", file_size),
+                "lob": existing_meta.get("lob")
+            }), 200
         
-        print(f"DEBUG: Document upload completed successfully for {file.filename}")
-        return jsonify({
-            "success": True,
-            "message": "Document uploaded successfully",
-            # Shape aligned with frontend DocumentsSection expectations
-            "id": doc_id,
-            "name": file.filename,
-            "uploadDate": document_data.get("uploadDate"),
-            "fileType": document_data.get("fileType"),
-            "status": document_data.get("status"),
-            # Additional fields
-            "file_path": file_path,
-            "size": file_size,
-            "content_length": len(file_content) if file_content else 0,
-            "lob": lob_info
-        }), 201
-        
-    except Exception as e:
-        print(f"❌ Error uploading document: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": f"Failed to upload document: {str(e)}"}), 500
-
-        # Read file content once and store it
-        file_content_bytes = file.read()
-        file_size = len(file_content_bytes)
-        print(f"DEBUG: File size: {file_size} bytes")
-        
-        # Create uploads directory if it doesn't exist
-        uploads_dir = "uploads"
-        if not os.path.exists(uploads_dir):
-            os.makedirs(uploads_dir)
-            print(f"📁 Created uploads directory: {uploads_dir}")
-        
-        # Extract content from file
-        file_content, images, error = agent_extract_content(io.BytesIO(file_content_bytes), file.filename)
+        # Extract content straight from the saved file (no in-RAM copy); a buffered file
+        # handle rather than an mmap, since PDFium's stream loader needs readinto()
+        with open(file_path, 'rb') as fh:
+            file_content, images, error = agent_extract_content(fh, file.filename)
         if error:
             print(f"DEBUG: Content extraction failed: {error}")
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            invalidate_uploads_listing()
             return jsonify({"error": f"Failed to extract content: {error}"}), 500
 
         print(f"DEBUG: Content extracted successfully, length: {len(file_content)} characters")
-
-        # Create document record
-        doc_id = str(uuid.uuid4())
-        # Now persist original upload to disk under generated ID
-        file_path = f"{uploads_dir}/{doc_id}_{file.filename}"
-        with open(file_path, 'wb') as f:
-            f.write(file_content_bytes)
-        print(f"💾 [File] Saved file to disk: {file_path}")
+        
         # Classify LOB for the document
         lob_info = classify_line_of_business(file_content)
 
         document_data = {
             "id": doc_id,
             "name": file.filename,
-            "uploadDate": datetime.now().isoformat(),
+            "uploadDate": datetime.now(timezone.utc).isoformat(),
             "fileType": file.filename.split('.')[-1].lower(),
             "size": file_size,
             "status": "uploaded",
-            "lob": lob_info
+            "lob": lob_info,
+            "content_hash": content_hash
         }
         
         print(f"DEBUG: Document data created with ID: {doc_id}")
         
         # Save to database using SQLAlchemy, add to vector DB with LOB metadata
-        db = next(get_db())
         try:
-            print(f"💾 [DB] Saving document to database using SQLAlchemy: {file.filename}")
-            save_document_to_db(db, document_data, file_path, file_content)
-            print(f"✅ [DB] Document stored with ID: {doc_id}")
-
-            # Add to vector database
-            print(f"📡 [VectorDB] Adding to vector DB...")
-            add_to_vector_db(
-                content=file_content,
-                meta={
-                    "id": doc_id,
-                    "name": file.filename,
-                    "type": "document",
-                    "upload_date": document_data["uploadDate"],
-                    "lob": lob_info
-                },
-                collection_name="documents"
-            )
-            print(f"✅ [VectorDB] Added to vector DB")
+            with db_session() as db:
+                print(f"💾 [DB] Saving document to database using SQLAlchemy: {file.filename}")
+                # The line below is the one you need to check.
+                saved_doc = save_document_to_db(db, user_email="guest", file_name=file.filename, file_type=document_data["fileType"], file_path=file_path, file_content=file_content, meta=document_data, status="uploaded")
+            
+                # --- START OF THE REQUIRED CHANGE ---
+                if saved_doc is None:
+                    # If the database save failed, return an error.
+                    return jsonify({
+                        "status": "error",
+                        "message": "Failed to save document to database."
+                    }), 500
+                # --- END OF THE REQUIRED CHANGE ---
+
+                print(f"✅ [DB] Document stored with ID: {doc_id}")
+                remember_document_name(file.filename, True)
+
+                # Add to vector database in the background (micro-batched with concurrent
+                # uploads into one embedding call); the response only needs the DB row
+                print("📡 [VectorDB] Queueing vector DB insert...")
+                embedding_batcher.submit(
+                    content=file_content,
+                    meta={
+                        "id": doc_id,
+                        "name": file.filename,
+                        "type": "document",
+                        "upload_date": document_data["uploadDate"],
+                        "lob": lob_info
+                    },
+                    collection_name="documents"
+                )
 
         except Exception as db_error:
             print(f"❌ [DB] Failed to save document: {db_error}")
             import traceback
             traceback.print_exc()
-            raise db_error
-        finally:
-            try:
-                db.close()
-            except Exception:
-                pass
-
-
+            return jsonify({
+                "status": "error",
+                "message": f"Failed to save document to the database: {str(db_error)}"
+            }), 500
         
         print(f"DEBUG: Document upload completed successfully for {file.filename}")
         return jsonify({
@@ -478,8 +693,7 @@ def upload_document():
 def test_database():
     """Test database connectivity and document count"""
     try:
-        db = next(get_db())
-        try:
+        with db_session() as db:
             # Test document count
             doc_count = db.query(Document).count()
             analysis_count = db.query(Analysis).count()
@@ -491,8 +705,6 @@ def test_database():
                 "analysis_count": analysis_count,
                 "database_url": DATABASE_URL.split('@')[0] + "@[HIDDEN]"  # Hide credentials
             })
-        finally:
-            db.close()
     except Exception as e:
         return jsonify({
             "success": False,
@@ -508,11 +720,11 @@ def test_create_document():
         test_content = data.get('content', 'Test document content')
         test_filename = data.get('filename', 'test_document.txt')
         
-        doc_id = str(uuid.uuid4())
+        doc_id = uuid.uuid4().hex
         document_data = {
             "id": doc_id,
             "name": test_filename,
-            "uploadDate": datetime.now().isoformat(),
+            "uploadDate": datetime.now(timezone.utc).isoformat(),
             "fileType": "txt",
             "size": len(test_content),
             "status": "uploaded"
@@ -520,8 +732,7 @@ def test_create_document():
         
         print(f"DEBUG: Testing document creation with ID: {doc_id}")
         
-        db = next(get_db())
-        try:
+        with db_session() as db:
             save_document_to_db(db, document_data, f"test_uploads/{doc_id}_{test_filename}", test_content)
             
             return jsonify({
@@ -530,8 +741,6 @@ def test_create_document():
                 "document_id": doc_id,
                 "document_data": document_data
             })
-        finally:
-            db.close()
             
     except Exception as e:
         print(f"Error in test document creation: {e}")
@@ -539,13 +748,35 @@ def test_create_document():
         traceback.print_exc()
         return jsonify({"error": f"Failed to create test document: {str(e)}"}), 500
 
+# /api/documents paging: default and largest page size
+DOCUMENTS_PAGE_SIZE = 50
+DOCUMENTS_PAGE_MAX = 200
+
 @app.route("/api/documents", methods=['GET'])
 def get_documents():
-    """Get all documents from database using direct psycopg2"""
+    """Get documents from database using direct psycopg2 with pagination"""
+    # Get pagination and filter parameters from query string
+    try:
+        limit = int(request.args.get('limit', DOCUMENTS_PAGE_SIZE))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    if limit < 1 or offset < 0:
+        return jsonify({"error": "limit must be at least 1 and offset must not be negative"}), 400
+    limit = min(limit, DOCUMENTS_PAGE_MAX)
+    
     try:
-        documents = get_all_documents_from_db_direct()
-        print(f"DEBUG: Retrieved {len(documents)} documents from database using direct psycopg2")
-        return jsonify(documents)
+        q = request.args.get('q')
+        status = request.args.get('status')
+        
+        documents, total = get_all_documents_from_db_direct(limit=limit, offset=offset, q=q, status=status)
+        print(f"DEBUG: Retrieved {len(documents)} of {total} documents from database using direct psycopg2 (limit={limit}, offset={offset})")
+        return jsonify({
+            "items": documents,
+            "total": total,
+            "limit": limit,
+            "offset": offset
+        })
     except Exception as e:
         print(f"❌ Error retrieving documents: {e}")
         return jsonify({"error": f"Failed to retrieve documents: {str(e)}"}), 500
@@ -558,23 +789,34 @@ def list_uploaded_files():
         if not os.path.exists(uploads_dir):
             return jsonify({"files": [], "message": "Uploads directory does not exist"})
         
+        # Rapid polling reuses the listing for a few seconds
+        now = time.monotonic()
+        with _uploads_listing_lock:
+            if _uploads_listing_cache["payload"] is not None and _uploads_listing_cache["expires"] > now:
+                return jsonify(_uploads_listing_cache["payload"])
+        
+        # scandir returns type/stat info with the directory read instead of per-file calls
         files = []
-        for filename in os.listdir(uploads_dir):
-            file_path = os.path.join(uploads_dir, filename)
-            if os.path.isfile(file_path):
-                file_size = os.path.getsize(file_path)
-                files.append({
-                    "name": filename,
-                    "size": file_size,
-                    "path": file_path,
-                    "modified": datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
-                })
+        with os.scandir(uploads_dir) as it:
+            for entry in it:
+                if entry.is_file():
+                    st = entry.stat()
+                    files.append({
+                        "name": entry.name,
+                        "size": st.st_size,
+                        "path": entry.path,
+                        "modified": datetime.fromtimestamp(st.st_mtime).isoformat()
+                    })
         
-        return jsonify({
+        payload = {
             "files": files,
             "count": len(files),
             "directory": uploads_dir
-        })
+        }
+        with _uploads_listing_lock:
+            _uploads_listing_cache["payload"] = payload
+            _uploads_listing_cache["expires"] = now + UPLOADS_LISTING_CACHE_TTL
+        return jsonify(payload)
     except Exception as e:
         return jsonify({"error": f"Failed to list files: {str(e)}"}), 500
 
@@ -582,15 +824,12 @@ def list_uploaded_files():
 def get_document(doc_id):
     """Get a specific document by ID"""
     try:
-        db = next(get_db())
-        try:
+        with db_session() as db:
             doc = get_document_by_id(db, doc_id)
             if doc:
                 return jsonify(doc)
             else:
                 return jsonify({"error": "Document not found"}), 404
-        finally:
-            db.close()
     except Exception as e:
         return jsonify({"error": f"Failed to retrieve document: {str(e)}"}), 500
 
@@ -598,15 +837,24 @@ def get_document(doc_id):
 def download_document(doc_id):
     """Download the actual file for a document"""
     try:
-        db = next(get_db())
-        try:
+        with db_session() as db:
             doc = get_document_by_id(db, doc_id)
             if doc and os.path.exists(doc['file_path']):
-                return send_file(doc['file_path'], as_attachment=True, download_name=doc['name'])
+                # Conditional response: ETag/Last-Modified let repeat downloads get a 304,
+                # and Range requests resume partial downloads
+                dirpath, fname = os.path.split(doc['file_path'])
+                return send_from_directory(
+                    dirpath or ".",
+                    fname,
+                    as_attachment=True,
+                    download_name=doc['name'],
+                    conditional=True,
+                    etag=True,
+                    last_modified=os.path.getmtime(doc['file_path']),
+                    max_age=3600
+                )
             else:
                 return jsonify({"error": "Document file not found"}), 404
-        finally:
-            db.close()
     except Exception as e:
         return jsonify({"error": f"Failed to download document: {str(e)}"}), 500
 
@@ -615,8 +863,7 @@ def download_document(doc_id):
 def get_past_analyses():
     """Get past analyses from database with pagination"""
     try:
-        db = next(get_db())
-        try:
+        with db_session() as db:
             # Get pagination parameters from query string
             limit = int(request.args.get('limit', 50))
             offset = int(request.args.get('offset', 0))
@@ -624,8 +871,6 @@ def get_past_analyses():
             analyses = get_all_analyses_from_db(db, limit=limit, offset=offset)
             print(f"DEBUG: Retrieved {len(analyses)} analyses from database (limit={limit}, offset={offset})")
             return jsonify(analyses)
-        finally:
-            db.close()
     except Exception as e:
         print(f"❌ Error retrieving analyses: {e}")
         return jsonify({"error": f"Failed to retrieve analyses: {str(e)}"}), 500
@@ -634,8 +879,7 @@ def get_past_analyses():
 def get_analysis(analysis_id):
     """Get a specific analysis by ID from database"""
     try:
-        db = next(get_db())
-        try:
+        with db_session() as db:
             analysis = get_analysis_by_id_from_db(db, analysis_id)
             if analysis:
                 print(f"DEBUG: Retrieved analysis '{analysis['title']}' from database")
@@ -643,8 +887,6 @@ def get_analysis(analysis_id):
             else:
                 print(f"DEBUG: Analysis with ID '{analysis_id}' not found")
                 return jsonify({"error": "Analysis not found"}), 404
-        finally:
-            db.close()
     except Exception as e:
         print(f"❌ Error retrieving analysis: {e}")
         return jsonify({"error": f"Failed to retrieve analysis: {str(e)}"}), 500
@@ -653,8 +895,7 @@ def get_analysis(analysis_id):
 def get_analysis_details(analysis_id):
     """Get full analysis details including original_text and results"""
     try:
-        db = next(get_db())
-        try:
+        with db_session() as db:
             analysis = get_analysis_details_from_db(db, analysis_id)
             if analysis:
                 print(f"DEBUG: Retrieved full analysis details for '{analysis['title']}'")
@@ -662,8 +903,6 @@ def get_analysis_details(analysis_id):
             else:
                 print(f"DEBUG: Analysis with ID '{analysis_id}' not found")
                 return jsonify({"error": "Analysis not found"}), 404
-        finally:
-            db.close()
     except Exception as e:
         print(f"❌ Error retrieving analysis details: {e}")
         return jsonify({"error": f"Failed to retrieve analysis details: {str(e)}"}), 500
@@ -671,12 +910,9 @@ def get_analysis_details(analysis_id):
 def get_analysis_by_id(analysis_id):
     """Get analysis by ID from database"""
     try:
-        db = next(get_db())
-        try:
+        with db_session() as db:
             analysis = get_analysis_by_id_from_db(db, analysis_id)
             return analysis
-        finally:
-            db.close()
     except Exception as e:
         print(f"❌ Error getting analysis by ID: {e}")
         return None
@@ -684,7 +920,7 @@ def get_analysis_by_id(analysis_id):
 def save_analysis_results(results, original_text, filename, user_email=None, document_id=None):
     """Save analysis results to database"""
     try:
-        analysis_id = str(uuid.uuid4())
+        analysis_id = uuid.uuid4().hex
         analysis_data = {
             "id": analysis_id,
             "title": f"Analysis of {filename}",
@@ -694,213 +930,276 @@ def save_analysis_results(results, original_text, filename, user_email=None, doc
             "document_id": document_id
         }
         
-        db = next(get_db())
-        try:
+        with db_session() as db:
             save_analysis_to_db(db, analysis_data)
             print(f"✅ Analysis saved to database: {analysis_id}")
             return analysis_id
-        finally:
-            db.close()
             
     except Exception as e:
         print(f"❌ Error saving analysis results: {e}")
         return None
 
 # --- Helper function to convert markdown to DOCX ---
-def markdown_to_docx(markdown_content):
-    """Convert markdown content to DOCX format with enhanced table support"""
-    doc = DocxDocument()
+# Markdown patterns used by markdown_to_docx (applied to stripped lines).
+# _MD_BLOCK_RE classifies a line in one match; lastgroup names the block kind
+_MD_BLOCK_RE = re.compile(
+    r'(?P<level>#+)\s*(?P<header>.*)'
+    r'|\|(?P<row>.*?)\|?$'
+    r'|(?P<fence>```)'
+    r'|(?P<bullet>[-*] )'
+    r'|(?P<numbered>1\. )'
+)
+_MD_TABLE_ROW_RE = re.compile(r'^\|(.*?)\|?$')
+
+# Table cell formatting, built once instead of per paragraph/run
+_ALIGN_LEFT = WD_ALIGN_PARAGRAPH.LEFT
+_FONT_SIZE_10 = Pt(10)
+
+# Parsed markdown render plans, keyed by a BLAKE2b digest of the source so repeated
+# plan/summary exports replay the plan instead of re-parsing the markdown
+MARKDOWN_PLAN_CACHE_SIZE = 128  # entries are whole parsed documents (TRDs), so keep the count small
+_markdown_plan_cache = OrderedDict()
+_markdown_plan_cache_lock = threading.Lock()
+
+def _parse_markdown_plan(markdown_content):
+    """Parse markdown into a tuple of render ops for _render_markdown_plan.
+
+    Ops: ("blank",), ("heading", text, level), ("table", rows, num_cols),
+    ("runs", ((text, bold), ...)), ("para", text, style), ("code", text).
+    """
+    plan = []
     
-    # Split content into lines
-    lines = markdown_content.split('\n')
-    i = 0
+    # Walk the lines with an iterator; raw holds the next unconsumed line (None at end)
+    lines = iter(markdown_content.splitlines())
+    raw = next(lines, None)
     
-    while i < len(lines):
-        line = lines[i].strip()
+    while raw is not None:
+        line = raw.strip()
+        raw = next(lines, None)
         
         if not line:
-            doc.add_paragraph()
-            i += 1
+            plan.append(("blank",))
             continue
+        
+        block = _MD_BLOCK_RE.match(line)
+        kind = block.lastgroup if block else None
             
         # Handle headers
-        if line.startswith('#'):
-            level = len(line) - len(line.lstrip('#'))
-            text = line.lstrip('#').strip()
-            if level == 1:
-                doc.add_heading(text, 0)
-            elif level == 2:
-                doc.add_heading(text, 1)
-            elif level == 3:
-                doc.add_heading(text, 2)
-            elif level == 4:
-                doc.add_heading(text, 3)
-            else:
-                doc.add_heading(text, 4)
-            i += 1
+        if kind == 'header':
+            level = len(block.group('level'))
+            plan.append(("heading", block.group('header').strip(), min(level - 1, 4)))
             
         # Handle tables
-        elif line.startswith('|'):
-            # Start of a table
-            table_lines = []
-            while i < len(lines) and lines[i].strip().startswith('|'):
-                table_lines.append(lines[i].strip())
-                i += 1
+        elif kind == 'row':
+            # Collect consecutive table rows (without leading/trailing pipes)
+            row_bodies = [block.group('row')]
+            while raw is not None:
+                table_match = _MD_TABLE_ROW_RE.match(raw.strip())
+                if not table_match:
+                    break
+                row_bodies.append(table_match.group(1))
+                raw = next(lines, None)
             
-            if len(table_lines) >= 2:  # Need at least header and separator
-                # Parse table
-                table_data = []
-                for table_line in table_lines:
-                    # Handle both |text| and text|text formats
-                    if table_line.startswith('|'):
-                        # Remove leading pipe if present
-                        clean_line = table_line[1:] if table_line.startswith('|') else table_line
-                        # Remove trailing pipe if present
-                        clean_line = clean_line[:-1] if clean_line.endswith('|') else clean_line
-                        # Split by pipes and clean up each cell
-                        cells = clean_line.split('|')
-                        cells = [cell.strip() for cell in cells]
-                        table_data.append(cells)
-                
-                if table_data:
-                    # Create table
-                    num_rows = len(table_data)
-                    num_cols = max(len(row) for row in table_data) if table_data else 0
-                    
-                    if num_rows > 0 and num_cols > 0:
-                        table = doc.add_table(rows=num_rows, cols=num_cols)
-                        table.style = 'Table Grid'
-                        
-                        # Fill table data
-                        for row_idx, row_data in enumerate(table_data):
-                            for col_idx, cell_text in enumerate(row_data):
-                                if col_idx < num_cols:
-                                    cell = table.cell(row_idx, col_idx)
-                                    cell.text = cell_text
-                                    
-                                    # Make header row bold
-                                    if row_idx == 0:
-                                        for paragraph in cell.paragraphs:
-                                            for run in paragraph.runs:
-                                                run.bold = True
-                                    
-                                    # Apply cell formatting for better readability
-                                    for paragraph in cell.paragraphs:
-                                        paragraph.alignment = WD_ALIGN_PARAGRAPH.LEFT
-                                        for run in paragraph.runs:
-                                            run.font.size = Pt(10)
+            if len(row_bodies) >= 2:  # Need at least header and separator
+                # Parse table: split by pipes and clean up each cell
+                table_data = tuple(tuple(cell.strip() for cell in body.split('|')) for body in row_bodies)
+                num_cols = max(map(len, table_data))
+                if num_cols > 0:
+                    plan.append(("table", table_data, num_cols))
         
         # Handle bold text
         elif '**' in line:
-            # Simple bold handling - replace **text** with bold
-            p = doc.add_paragraph()
-            parts = line.split('**')
-            for j, part in enumerate(parts):
-                if j % 2 == 1:  # Bold text
-                    p.add_run(part).bold = True
-                else:  # Regular text
-                    p.add_run(part)
-            i += 1
+            # Simple bold handling - odd-numbered parts between ** are bold
+            plan.append(("runs", tuple((part, j % 2 == 1) for j, part in enumerate(line.split('**')))))
             
         # Handle lists
-        elif line.startswith('- ') or line.startswith('* '):
-            doc.add_paragraph(line[2:], style='List Bullet')
-            i += 1
-        elif line.startswith('1. '):
-            doc.add_paragraph(line[3:], style='List Number')
-            i += 1
+        elif kind == 'bullet':
+            plan.append(("para", line[2:], 'List Bullet'))
+        elif kind == 'numbered':
+            plan.append(("para", line[3:], 'List Number'))
             
         # Handle code blocks
-        elif line.startswith('```'):
-            # Skip code block markers
-            i += 1
-            # Add code block content as preformatted text
-            while i < len(lines) and not lines[i].strip().startswith('```'):
-                code_line = lines[i]
-                p = doc.add_paragraph(code_line)
-                # Apply monospace font to code
-                for run in p.runs:
-                    run.font.name = 'Courier New'
-                i += 1
-            if i < len(lines) and lines[i].strip().startswith('```'):
-                i += 1  # Skip closing ```
+        elif kind == 'fence':
+            # Gather the block body up to the closing ``` (consumed by takewhile)
+            code_lines = []
+            if raw is not None and not raw.strip().startswith('```'):
+                code_lines.append(raw)
+                code_lines.extend(itertools.takewhile(lambda l: not l.strip().startswith('```'), lines))
+            # One preformatted paragraph; newlines become soft line breaks
+            if code_lines:
+                plan.append(("code", '\n'.join(code_lines)))
+            raw = next(lines, None)
                 
         # Handle regular paragraphs
         else:
-            doc.add_paragraph(line)
-            i += 1
+            plan.append(("para", line, None))
     
+    return tuple(plan)
+
+def _get_markdown_plan(markdown_content):
+    """Return the cached render plan for this markdown, parsing it on a miss"""
+    key = hashlib.blake2b(markdown_content.encode('utf-8'), digest_size=16).digest()
+    with _markdown_plan_cache_lock:
+        plan = _markdown_plan_cache.get(key)
+        if plan is not None:
+            _markdown_plan_cache.move_to_end(key)
+            return plan
+    
+    plan = _parse_markdown_plan(markdown_content)
+    with _markdown_plan_cache_lock:
+        _markdown_plan_cache[key] = plan
+        if len(_markdown_plan_cache) > MARKDOWN_PLAN_CACHE_SIZE:
+            _markdown_plan_cache.popitem(last=False)
+    return plan
+
+def _render_markdown_plan(doc, plan):
+    """Replay parsed markdown ops into a python-docx Document"""
+    for op in plan:
+        kind = op[0]
+        if kind == "blank":
+            doc.add_paragraph()
+        elif kind == "heading":
+            doc.add_heading(op[1], op[2])
+        elif kind == "table":
+            table_data, num_cols = op[1], op[2]
+            table = doc.add_table(rows=len(table_data), cols=num_cols)
+            table.style = 'Table Grid'
+            # Flat row-major cell list, built once; table.cell(r, c) rebuilds it per call
+            cells = table._cells
+            
+            # Fill table data
+            for row_idx, row_data in enumerate(table_data):
+                base = row_idx * num_cols
+                for col_idx, cell_text in enumerate(row_data):
+                    cell = cells[base + col_idx]
+                    cell.text = cell_text
+                    
+                    # Make header row bold
+                    if row_idx == 0:
+                        for paragraph in cell.paragraphs:
+                            for run in paragraph.runs:
+                                run.bold = True
+                    
+                    # Apply cell formatting for better readability
+                    for paragraph in cell.paragraphs:
+                        paragraph.alignment = _ALIGN_LEFT
+                        for run in paragraph.runs:
+                            run.font.size = _FONT_SIZE_10
+        elif kind == "runs":
+            p = doc.add_paragraph()
+            for run_text, bold in op[1]:
+                if bold:
+                    p.add_run(run_text).bold = True
+                else:
+                    p.add_run(run_text)
+        elif kind == "para":
+            if op[2]:
+                doc.add_paragraph(op[1], style=op[2])
+            else:
+                doc.add_paragraph(op[1])
+        elif kind == "code":
+            p = doc.add_paragraph(op[1])
+            # Apply monospace font to code
+            for run in p.runs:
+                run.font.name = 'Courier New'
+
+def markdown_to_docx(markdown_content):
+    """Convert markdown content to DOCX format with enhanced table support"""
+    doc = DocxDocument()
+    _render_markdown_plan(doc, _get_markdown_plan(markdown_content))
     return doc
 
+# Image MIME types the Gemini API accepts as-is
+GEMINI_SUPPORTED_IMAGE_TYPES = frozenset({'image/jpeg', 'image/png', 'image/webp', 'image/heic', 'image/heif'})
+
+@functools.lru_cache(maxsize=1)
+def _wmf_placeholder_png():
+    """PNG bytes of the "WMF Image / Format not supported" placeholder, built on first use"""
+    if not PIL_AVAILABLE:
+        return None
+    try:
+        # Create a simple placeholder image
+        placeholder = Image.new('RGB', (300, 200), color='lightgray')
+        draw = ImageDraw.Draw(placeholder)
+        draw.text((10, 10), "WMF Image", fill='black')
+        draw.text((10, 30), "Format not supported", fill='red')
+        
+        output_buffer = io.BytesIO()
+        placeholder.save(output_buffer, format='PNG')
+        logger.debug("Created placeholder image for WMF")
+        return output_buffer.getvalue()
+    except Exception as placeholder_error:
+        logger.debug("Failed to create placeholder: %s", placeholder_error)
+        return None
+
+def _convert_to_png_opencv(image_data):
+    """Decode with OpenCV and re-encode as fast (level 1) PNG; None if OpenCV can't decode it"""
+    try:
+        arr = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+        if arr is None:
+            return None
+        ok, buf = cv2.imencode('.png', arr, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        return buf.tobytes() if ok else None
+    except Exception as e:
+        logger.debug("OpenCV conversion failed, falling back to PIL: %s", e)
+        return None
+
 def convert_image_format(image_data, from_mime_type, to_mime_type='image/png'):
     """Convert image from one format to another (enhanced implementation)"""
+    # Already in a supported target format: skip the decode/re-encode round trip
+    if from_mime_type.lower() == to_mime_type and to_mime_type in GEMINI_SUPPORTED_IMAGE_TYPES:
+        return image_data, to_mime_type
+    
+    if not PIL_AVAILABLE:
+        logger.debug("PIL not available, skipping image conversion")
+        return None, None
+    
     try:
-        # Try to import PIL for image conversion
         try:
-            from PIL import Image, ImageDraw
-            import io
-            
             # For WMF files, we need special handling
             if from_mime_type.lower() in ['image/x-wmf', 'image/wmf']:
-                print(f"DEBUG: WMF format detected - attempting enhanced handling...")
+                logger.debug("WMF format detected - attempting enhanced handling...")
                 
                 # Method 1: Try direct PIL opening (rarely works for WMF)
                 try:
                     image = Image.open(io.BytesIO(image_data))
-                    print(f"DEBUG: Successfully opened WMF with PIL")
+                    logger.debug("Successfully opened WMF with PIL")
                 except Exception as wmf_error:
-                    print(f"DEBUG: PIL cannot handle WMF directly: {wmf_error}")
+                    logger.debug("PIL cannot handle WMF directly: %s", wmf_error)
                     
-                    # Method 2: Try to install and use wand (ImageMagick wrapper)
-                    try:
-                        from wand.image import Image as WandImage
-                        print(f"DEBUG: Attempting WMF conversion with ImageMagick...")
-                        
-                        with WandImage(blob=image_data) as wand_img:
-                            # Convert to PNG format
-                            wand_img.format = 'png'
-                            converted_data = wand_img.make_blob()
-                            print(f"DEBUG: Successfully converted WMF to PNG using ImageMagick")
-                            return converted_data, 'image/png'
+                    # Method 2: Try wand (ImageMagick wrapper)
+                    if WAND_AVAILABLE:
+                        try:
+                            logger.debug("Attempting WMF conversion with ImageMagick...")
                             
-                    except ImportError:
-                        print(f"DEBUG: ImageMagick (wand) not available for WMF conversion")
-                    except Exception as magick_error:
-                        print(f"DEBUG: ImageMagick conversion failed: {magick_error}")
-                    
-                    # Method 3: Try using Windows-specific libraries (if available)
-                    try:
-                        import win32com.client
-                        print(f"DEBUG: Attempting WMF conversion using Windows COM...")
-                        # This would require Windows-specific code
-                        print(f"DEBUG: Windows COM conversion not implemented yet")
-                    except ImportError:
-                        print(f"DEBUG: Windows COM libraries not available")
-                    except Exception as com_error:
-                        print(f"DEBUG: Windows COM conversion failed: {com_error}")
+                            with WandImage(blob=image_data) as wand_img:
+                                # Convert to PNG format
+                                wand_img.format = 'png'
+                                converted_data = wand_img.make_blob()
+                                logger.debug("Successfully converted WMF to PNG using ImageMagick")
+                                return converted_data, 'image/png'
+                        except Exception as magick_error:
+                            logger.debug("ImageMagick conversion failed: %s", magick_error)
+                    else:
+                        logger.debug("ImageMagick (wand) not available for WMF conversion")
                     
-                    # Method 4: Create a placeholder image
-                    print(f"DEBUG: Creating placeholder image for WMF...")
-                    try:
-                        # Create a simple placeholder image
-                        placeholder = Image.new('RGB', (300, 200), color='lightgray')
-                        draw = ImageDraw.Draw(placeholder)
-                        draw.text((10, 10), "WMF Image", fill='black')
-                        draw.text((10, 30), "Format not supported", fill='red')
-                        
-                        output_buffer = io.BytesIO()
-                        placeholder.save(output_buffer, format='PNG')
-                        converted_data = output_buffer.getvalue()
-                        print(f"DEBUG: Created placeholder image for WMF")
-                        return converted_data, 'image/png'
-                        
-                    except Exception as placeholder_error:
-                        print(f"DEBUG: Failed to create placeholder: {placeholder_error}")
+                    # Method 3: Use the (constant) placeholder image, rendered once
+                    placeholder_png = _wmf_placeholder_png()
+                    if placeholder_png is not None:
+                        logger.debug("Using placeholder image for WMF")
+                        return placeholder_png, 'image/png'
                     
-                    print(f"DEBUG: All WMF conversion methods failed. Skipping image.")
+                    logger.debug("All WMF conversion methods failed. Skipping image.")
                     return None, None
             
-            # For other formats, use standard PIL conversion
+            # For other formats, prefer OpenCV's C++ decode/encode when producing PNG
+            if to_mime_type == 'image/png' and OPENCV_AVAILABLE:
+                converted_data = _convert_to_png_opencv(image_data)
+                if converted_data is not None:
+                    logger.debug("Converted %s to PNG with OpenCV", from_mime_type)
+                    return converted_data, 'image/png'
+            
+            # Standard PIL conversion
             # Convert bytes to PIL Image
             image = Image.open(io.BytesIO(image_data))
             
@@ -918,71 +1217,178 @@ def convert_image_format(image_data, from_mime_type, to_mime_type='image/png'):
                 image.save(output_buffer, format='PNG')  # Default to PNG
             
             converted_data = output_buffer.getvalue()
-            print(f"DEBUG: Successfully converted {from_mime_type} to {to_mime_type}")
+            logger.debug("Successfully converted %s to %s", from_mime_type, to_mime_type)
             return converted_data, to_mime_type
             
-        except ImportError:
-            print("DEBUG: PIL not available, skipping image conversion")
-            return None, None
         except Exception as e:
-            print(f"DEBUG: Image conversion failed: {e}")
+            logger.debug("Image conversion failed: %s", e)
             return None, None
             
     except Exception as e:
-        print(f"DEBUG: Error in image conversion: {e}")
+        logger.debug("Error in image conversion: %s", e)
         return None, None
 
+# Conversion results (valid, converted_data, converted_mime) keyed by content hash; FIFO-capped
+IMAGE_VERDICT_CACHE_SIZE = 256
+_image_verdict_cache = OrderedDict()
+_image_verdict_cache_lock = threading.Lock()
+
+def _image_cache_key(mime_type, image_data):
+    if isinstance(image_data, str):
+        image_data = image_data.encode('utf-8')
+    digest = hashlib.blake2b(image_data, digest_size=16)
+    digest.update(mime_type.lower().encode('utf-8'))
+    return digest.digest()
+
 def is_valid_image_for_gemini(mime_type, image_data):
-    """Check if image is valid for Gemini API and convert if needed"""
+    """Check if image is valid for Gemini API and convert if needed.
+
+    Returns (valid, data, mime_type): the original payload for supported types, the
+    converted PNG for convertible ones, and (False, None, None) otherwise.
+    """
     # Gemini supports: image/jpeg, image/png, image/webp, image/heic, image/heif
-    supported_types = ['image/jpeg', 'image/png', 'image/webp', 'image/heic', 'image/heif']
-    is_supported = mime_type.lower() in supported_types
+    is_supported = mime_type.lower() in GEMINI_SUPPORTED_IMAGE_TYPES
+    if is_supported:
+        # Accepted natively, so no conversion is attempted
+        logger.debug("Image accepted - supported MIME type: %s", mime_type)
+        return True, image_data, mime_type
     
-    if not is_supported:
-        print(f"DEBUG: Image rejected - unsupported MIME type: {mime_type}")
-        # Try to convert unsupported formats
-        if mime_type.lower() in ['image/x-wmf', 'image/wmf', 'image/bmp', 'image/tiff']:
-            print(f"DEBUG: Attempting to convert {mime_type} to PNG...")
-            converted_data, converted_mime = convert_image_format(image_data, mime_type, 'image/png')
-            if converted_data:
-                print(f"DEBUG: Successfully converted {mime_type} to PNG")
-                return True  # Return True since we now have a supported format
-            else:
-                print(f"DEBUG: Conversion failed for {mime_type}")
-                return False
-    else:
-        print(f"DEBUG: Image accepted - supported MIME type: {mime_type}")
+    logger.debug("Image rejected - unsupported MIME type: %s", mime_type)
+    # Try to convert unsupported formats
+    if mime_type.lower() in ['image/x-wmf', 'image/wmf', 'image/bmp', 'image/tiff']:
+        # Repeated images (logos, page headers) reuse the first conversion's verdict
+        key = _image_cache_key(mime_type, image_data)
+        with _image_verdict_cache_lock:
+            cached = _image_verdict_cache.get(key)
+        if cached is not None:
+            logger.debug("Reusing cached conversion for %s", mime_type)
+            return cached
+        
+        logger.debug("Attempting to convert %s to PNG...", mime_type)
+        converted_data, converted_mime = convert_image_format(image_data, mime_type, 'image/png')
+        valid = bool(converted_data)
+        if valid:
+            logger.debug("Successfully converted %s to PNG", mime_type)
+        else:
+            logger.debug("Conversion failed for %s", mime_type)
+        
+        result = (True, converted_data, converted_mime) if valid else (False, None, None)
+        with _image_verdict_cache_lock:
+            _image_verdict_cache[key] = result
+            if len(_image_verdict_cache) > IMAGE_VERDICT_CACHE_SIZE:
+                _image_verdict_cache.popitem(last=False)
+        return result
     
-    return is_supported
+    return False, None, None
 
 def process_images_for_gemini(images):
     """Process images to ensure they are compatible with Gemini API using multiple methods"""
-    print(f"🔧 Processing {len(images)} images with enhanced methods...")
+    logger.info("🔧 Processing %s images with enhanced methods...", len(images))
     
     # Use enhanced processing if available
     if sum(ENHANCED_IMAGE_LIBRARIES.values()) > 1:
-        print("DEBUG: Using enhanced image processing with multiple libraries")
+        logger.debug("Using enhanced image processing with multiple libraries")
         return process_images_with_multiple_methods(images)
     else:
-        print("DEBUG: Using basic image processing")
+        logger.debug("Using basic image processing")
         return process_images_for_gemini_basic(images)
 
 def process_images_for_gemini_basic(images):
     """Basic image processing (original method)"""
     valid_images = []
     for i, img in enumerate(images):
-        if is_valid_image_for_gemini(img["mime_type"], img["data"]):
-            valid_images.append(img)
-            print(f"DEBUG: Image {i+1} is valid for Gemini API: {img['mime_type']}")
+        valid, data, mime_type = is_valid_image_for_gemini(img["mime_type"], img["data"])
+        if valid:
+            # Convertible formats (WMF/BMP/TIFF) are sent as the converted PNG
+            valid_images.append({**img, "mime_type": mime_type, "data": data})
+            logger.debug("Image %s is valid for Gemini API: %s", i + 1, mime_type)
         else:
-            print(f"DEBUG: Image {i+1} skipped - unsupported format: {img['mime_type']}")
+            logger.debug("Image %s skipped - unsupported format: %s", i + 1, img['mime_type'])
     return valid_images
 
 # --- File Extraction Agent ---
 
+# Embedded images are validated/converted/encoded concurrently (PIL and base64 release the GIL)
+IMAGE_PREP_MAX_WORKERS = 8
+
+# Pixel budget per image sent to Gemini (~1024 image tokens); larger images are downsampled
+MAX_IMAGE_PIXELS = 802_816
+
+def _downsample_oversized_image(mime_type, image_data):
+    """Shrink an image above MAX_IMAGE_PIXELS to fit the budget; returns (mime_type, data)"""
+    if not PIL_AVAILABLE or mime_type.lower() not in GEMINI_SUPPORTED_IMAGE_TYPES:
+        return mime_type, image_data
+    try:
+        # Image.open only parses the header, so the size check needs no full decode
+        image = Image.open(io.BytesIO(image_data))
+        width, height = image.size
+        if width * height <= MAX_IMAGE_PIXELS:
+            return mime_type, image_data
+        
+        scale = math.sqrt(MAX_IMAGE_PIXELS / (width * height))
+        image.thumbnail((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+        output_buffer = io.BytesIO()
+        if mime_type.lower() == 'image/jpeg':
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.save(output_buffer, format='JPEG', quality=85)
+        else:
+            image.save(output_buffer, format='PNG')
+            mime_type = 'image/png'
+        logger.debug("Downsampled %sx%s image to %sx%s", width, height, image.size[0], image.size[1])
+        return mime_type, output_buffer.getvalue()
+    except Exception as e:
+        logger.debug("Could not check image size, keeping original: %s", e)
+        return mime_type, image_data
+
+def _prepare_extracted_image(mime_type, image_data, source):
+    """Validate (converting if needed) and size-limit one extracted image"""
+    try:
+        valid, image_data, mime_type = is_valid_image_for_gemini(mime_type, image_data)
+        if valid:
+            mime_type, image_data = _downsample_oversized_image(mime_type, image_data)
+            logger.info("AGENT [Extractor]: Extracted image from %s with MIME type: %s", source, mime_type)
+            # Raw bytes; base64 happens once at the API/JSON boundary (encode_image_data)
+            return {
+                'mime_type': mime_type,
+                'data': image_data
+            }
+    except Exception as e:
+        logger.warning("AGENT [Extractor]: Failed to extract image from %s: %s", source, e)
+    return None
+
+def prepare_extracted_images(candidates):
+    """Process collected (mime_type, data, source) images in parallel, keeping document order"""
+    if not candidates:
+        return []
+    if len(candidates) == 1:
+        results = [_prepare_extracted_image(*candidates[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(IMAGE_PREP_MAX_WORKERS, len(candidates))) as pool:
+            results = list(pool.map(lambda c: _prepare_extracted_image(*c), candidates))
+    return [image for image in results if image is not None]
+
+def extract_pdf_text_pdfium(file_stream):
+    """Extract PDF text page by page with PDFium, releasing native handles as we go"""
+    pdf = pypdfium2.PdfDocument(file_stream)
+    try:
+        page_texts = []
+        for page in pdf:
+            textpage = None
+            try:
+                textpage = page.get_textpage()
+                page_texts.append(textpage.get_text_range() + "\n")
+            finally:
+                if textpage is not None:
+                    textpage.close()
+                page.close()
+        return "".join(page_texts)
+    finally:
+        pdf.close()
+
 def agent_extract_content(file_stream, filename):
     """Extract text content and images from uploaded files with enhanced image processing"""
-    print("AGENT [Extractor]: Starting enhanced content extraction...")
+    logger.info("AGENT [Extractor]: Starting enhanced content extraction...")
     
     try:
         file_extension = filename.lower().split('.')[-1]
@@ -991,29 +1397,22 @@ def agent_extract_content(file_stream, filename):
             # Handle DOCX files with image extraction
             try:
                 doc = DocxDocument(file_stream)
-                text_content = '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-                images = []
+                text_content = '\n'.join(paragraph.text for paragraph in doc.paragraphs)
                 
-                # Extract images from DOCX
+                # Extract images from DOCX: collect the blobs, then validate/encode them together
+                candidates = []
                 for rel in doc.part.rels.values():
                     if "image" in rel.target_ref:
                         try:
-                            image_data = rel.target_part.blob
-                            mime_type = rel.target_part.content_type
-                            
-                            if is_valid_image_for_gemini(mime_type, image_data):
-                                images.append({
-                                    'mime_type': mime_type,
-                                    'data': base64.b64encode(image_data).decode('utf-8')
-                                })
-                                print(f"AGENT [Extractor]: Extracted image with MIME type: {mime_type}")
+                            candidates.append((rel.target_part.content_type, rel.target_part.blob, "DOCX"))
                         except Exception as e:
-                            print(f"AGENT [Extractor]: Failed to extract image: {e}")
+                            logger.warning("AGENT [Extractor]: Failed to extract image: %s", e)
+                images = prepare_extracted_images(candidates)
                 
-                print(f"AGENT [Extractor]: Extracted text ({len(text_content)} chars) and {len(images)} images from DOCX.")
+                logger.info("AGENT [Extractor]: Extracted text (%s chars) and %s images from DOCX.", len(text_content), len(images))
                 
                 # Log token consumption for content extraction
-                estimated_tokens = len(text_content.split()) * 1.3
+                estimated_tokens = _approx_tokens(text_content)
                 log_token_consumption("content_extraction", estimated_tokens, "local_processing", {
                     "file_type": "docx",
                     "text_length": len(text_content),
@@ -1029,13 +1428,23 @@ def agent_extract_content(file_stream, filename):
         elif file_extension == 'pdf':
             # Handle PDF files with image extraction
             try:
+                # PDFium (C) extracts the text; PyPDF2 is the text fallback and pulls embedded images
+                pdfium_text = None
+                if PDFIUM_AVAILABLE:
+                    try:
+                        pdfium_text = extract_pdf_text_pdfium(file_stream)
+                    except Exception as e:
+                        logger.warning("AGENT [Extractor]: PDFium text extraction failed, falling back to PyPDF2: %s", e)
+                    file_stream.seek(0)
+                
                 pdf_reader = PyPDF2.PdfReader(file_stream)
-                text_content = ""
-                images = []
+                page_texts = []  # joined once after the loop; += per page is quadratic
+                candidates = []
                 
                 for page_num, page in enumerate(pdf_reader.pages):
-                    text_content += page.extract_text() + "\n"
-                    
+                    if pdfium_text is None:
+                        page_texts.append(page.extract_text() + "\n")
+                
                     # Extract images from PDF (basic implementation)
                     # Note: PyPDF2 has limited image extraction capabilities
                     # For production, consider using pdfplumber or pdf2image
@@ -1053,22 +1462,21 @@ def agent_extract_content(file_stream, filename):
                                             mime_type = 'image/png'
                                         else:
                                             mime_type = 'image/jpeg'  # Default
-                                        
-                                        if is_valid_image_for_gemini(mime_type, image_data):
-                                            images.append({
-                                                'mime_type': mime_type,
-                                                'data': base64.b64encode(image_data).decode('utf-8')
-                                            })
-                                            print(f"AGENT [Extractor]: Extracted image from PDF page {page_num + 1}")
+                
+                                        candidates.append((mime_type, image_data, f"PDF page {page_num + 1}"))
                                     except Exception as e:
-                                        print(f"AGENT [Extractor]: Failed to extract image from PDF: {e}")
+                                        logger.warning("AGENT [Extractor]: Failed to extract image from PDF: %s", e)
                     except Exception as e:
-                        print(f"AGENT [Extractor]: Error processing PDF images: {e}")
+                        logger.warning("AGENT [Extractor]: Error processing PDF images: %s", e)
+                
+                text_content = pdfium_text if pdfium_text is not None else "".join(page_texts)
                 
-                print(f"AGENT [Extractor]: Extracted text ({len(text_content)} chars) and {len(images)} images from PDF.")
+                images = prepare_extracted_images(candidates)
+                
+                logger.info("AGENT [Extractor]: Extracted text (%s chars) and %s images from PDF.", len(text_content), len(images))
                 
                 # Log token consumption for content extraction
-                estimated_tokens = len(text_content.split()) * 1.3
+                estimated_tokens = _approx_tokens(text_content)
                 log_token_consumption("content_extraction", estimated_tokens, "local_processing", {
                     "file_type": "pdf",
                     "text_length": len(text_content),
@@ -1083,18 +1491,280 @@ def agent_extract_content(file_stream, filename):
             return "", [], f"Unsupported file type: {file_extension}"
             
     except Exception as e:
-        print(f"AGENT [Extractor]: Error during extraction: {e}")
+        logger.warning("AGENT [Extractor]: Error during extraction: %s", e)
         return "", [], f"Extraction failed: {str(e)}"
 
 # --- Gemini API Agent Caller ---
 
-def call_generative_agent(prompt_parts, is_json=False, stage_name="generative_agent"):
+# One keep-alive session for all Gemini calls: retries and pipeline stages reuse pooled
+# TCP/TLS connections instead of handshaking per request. Up to 20 pooled connections
+# cover concurrent stages (TRD/backlog alongside HLD/LLD) across several users.
+# The adapter only retries connection failures (e.g. a stale pooled socket); HTTP
+# status retries (429/503 with retryDelay) stay in call_generative_agent.
+gemini_http = requests.Session()
+gemini_http.mount("https://", requests.adapters.HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.3)
+))
+atexit.register(gemini_http.close)
+
+def _b64(data):
+    """Base64 text for bytes in a single C pass (no newline, ascii decode)"""
+    return binascii.b2a_base64(data, newline=False).decode('ascii')
+
+def encode_image_data(data):
+    """Base64 text for raw image bytes; already-encoded strings pass through"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return _b64(data)
+    return data
+
+def encoded_image_length(data):
+    """Length encode_image_data(data) would return, without encoding raw bytes"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return 4 * ((len(data) + 2) // 3)
+    return len(data)
+
+def _encode_inline_data_part(part):
+    """Prompt part with any raw inline_data bytes base64-encoded for the JSON payload"""
+    if isinstance(part, dict) and 'inline_data' in part:
+        inline = part['inline_data']
+        if isinstance(inline.get('data'), (bytes, bytearray, memoryview)):
+            return {"inline_data": {**inline, "data": encode_image_data(inline['data'])}}
+    return part
+
+# Shared decoder for pulling the JSON object out of JSON-mode responses
+_JSON_DECODER = json.JSONDecoder()
+
+# Gemini 429 bodies carry retryDelay as e.g. "40s"
+_RETRY_DELAY_RE = re.compile(r'^(\d+)s$')
+
+def _gemini_retry_delay_seconds(response):
+    """Seconds from a 429 response's retryDelay (default "40s"), or None if unparseable"""
+    try:
+        details = response.json().get('error', {}).get('details') or [{}]
+    except (ValueError, AttributeError):
+        return None
+    retry_delay = next((d['retryDelay'] for d in details if isinstance(d, dict) and 'retryDelay' in d), '40s')
+    match = _RETRY_DELAY_RE.match(str(retry_delay))
+    return int(match.group(1)) if match else None
+
+# --- Generative agent response cache ---
+# Agent prompts are built deterministically from the plan/document, so retries and
+# regenerations of the same stage can reuse the earlier response
+LLM_CACHE_SIZE = 256  # responses kept by the in-process cache
+LLM_CACHE_TTL = 2 * 60 * 60  # seconds; expiry for shared (Redis) caches
+
+class InMemoryLLMCache:
+    """Process-local LRU cache of generative agent responses"""
+
+    def __init__(self, maxsize=LLM_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class RedisLLMCache:
+    """Response cache shared across workers, backed by a redis client (get/setex with TTL)"""
+
+    def __init__(self, client, ttl=LLM_CACHE_TTL, prefix="ba_agent:llm:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json_loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, json_dumps_bytes(value))
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+llm_cache = InMemoryLLMCache()
+
+def set_llm_cache(cache):
+    """Swap the generative agent response cache; None disables caching"""
+    global llm_cache
+    llm_cache = cache
+
+def clear_llm_cache():
+    """Drop all cached generative agent responses"""
+    if llm_cache is not None:
+        llm_cache.clear()
+    if semantic_llm_cache is not None:
+        semantic_llm_cache.clear()
+
+# Near-duplicate prompts (a lightly edited document re-run through the same stage) reuse
+# the earlier response when their embeddings are this similar
+SEMANTIC_CACHE_STAGES = frozenset({"trd_writer", "backlog_creation"})
+SEMANTIC_CACHE_THRESHOLD = 0.97
+SEMANTIC_CACHE_SIZE = 128  # prompts remembered per stage
+SEMANTIC_CACHE_CHUNK_CHARS = 1000  # the embedding model truncates long inputs; embed in chunks
+
+class SemanticLLMCache:
+    """Per-stage store of prompt embeddings, matched by cosine similarity"""
+
+    def __init__(self, model, threshold=SEMANTIC_CACHE_THRESHOLD, maxsize=SEMANTIC_CACHE_SIZE):
+        self.model = model
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._vectors = {}  # stage -> (n, dim) matrix of unit prompt embeddings
+        self._responses = {}  # stage -> responses, row-aligned with _vectors
+        self._lock = threading.Lock()
+
+    def embed(self, text):
+        """Unit-length mean of the chunk embeddings, so every part of a long prompt counts"""
+        import numpy as np
+        chunks = [text[i:i + SEMANTIC_CACHE_CHUNK_CHARS] for i in range(0, len(text), SEMANTIC_CACHE_CHUNK_CHARS)] or [""]
+        vector = self.model.encode(chunks, normalize_embeddings=True).mean(axis=0)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, stage_name, vector):
+        """Most similar earlier response for this stage, if it clears the threshold"""
+        with self._lock:
+            matrix = self._vectors.get(stage_name)
+            if matrix is None:
+                return None
+            scores = matrix @ vector
+            best = int(scores.argmax())
+            if scores[best] >= self.threshold:
+                return self._responses[stage_name][best]
+        return None
+
+    def add(self, stage_name, vector, response):
+        import numpy as np
+        with self._lock:
+            matrix = self._vectors.get(stage_name)
+            responses = self._responses.setdefault(stage_name, [])
+            matrix = vector[np.newaxis, :] if matrix is None else np.vstack((matrix, vector))
+            responses.append(response)
+            if len(responses) > self.maxsize:
+                matrix = matrix[1:]
+                del responses[0]
+            self._vectors[stage_name] = matrix
+
+    def clear(self):
+        with self._lock:
+            self._vectors.clear()
+            self._responses.clear()
+
+# Reuses the vector DB's sentence-transformers model; disabled when it failed to load
+semantic_llm_cache = SemanticLLMCache(embedding_model) if embedding_model is not None else None
+
+# Cache keys with an API call in progress -> Future resolved with its response
+_inflight_llm_calls = {}
+_inflight_llm_lock = threading.Lock()
+
+def _llm_cache_key(stage_name, prompt_parts, is_json, system_instruction=None):
+    """SHA-256 over the stage, the text parts, a digest of each image, the system instruction and the response mode.
+
+    Images are hashed from their raw bytes rather than serialized, so building the key
+    never copies a multi-MB inline payload.
+    """
+    key = hashlib.sha256(json_dumps_bytes({"stage": stage_name, "json": is_json, "system": system_instruction}, sort_keys=True))
+    for part in prompt_parts:
+        if isinstance(part, dict) and 'inline_data' in part:
+            inline = part['inline_data']
+            key.update(b"\x00image\x00" + _image_cache_key(inline.get('mime_type', ''), inline.get('data', b'')))
+        else:
+            key.update(b"\x00part\x00" + json_dumps_bytes(part, sort_keys=True))
+    return key.hexdigest()
+
+def call_generative_agent(prompt_parts, is_json=False, stage_name="generative_agent", system_instruction=None):
+    """Call the generative AI agent; identical prompts reuse a cached or in-flight response.
+
+    system_instruction carries a stage's fixed instructions separately from the variable
+    prompt parts, so Gemini can reuse its cached processing of that stable prefix.
+    """
+    cache = llm_cache
+    if cache is None:
+        # Images travel as raw bytes until here; encode once, outside the retry loop
+        return _call_generative_agent_uncached([_encode_inline_data_part(part) for part in prompt_parts], is_json, stage_name, system_instruction)
+    
+    # Keyed on the raw parts, before the images are base64-encoded
+    key = _llm_cache_key(stage_name, prompt_parts, is_json, system_instruction)
+    cached = cache.get(key)
+    if cached is not None:
+        print(f"⚡ {stage_name.upper()}: Returning cached response")
+        # Callers may edit parsed JSON in place; hand out a copy
+        return copy.deepcopy(cached) if is_json else cached
+    
+    # Identical concurrent requests (several users re-running the same stage) share one API call
+    with _inflight_llm_lock:
+        pending = _inflight_llm_calls.get(key)
+        leader = pending is None
+        if leader:
+            pending = _inflight_llm_calls[key] = Future()
+    
+    if leader:
+        try:
+            # Only the call that actually goes to the API pays for encoding the images
+            prompt_parts = [_encode_inline_data_part(part) for part in prompt_parts]
+            pending.set_result(_generate_and_cache(cache, key, prompt_parts, is_json, stage_name, system_instruction))
+        except Exception as e:
+            pending.set_exception(e)
+        finally:
+            with _inflight_llm_lock:
+                _inflight_llm_calls.pop(key, None)
+    else:
+        print(f"⏳ {stage_name.upper()}: Waiting on identical in-flight request")
+    
+    result = pending.result()
+    return copy.deepcopy(result) if is_json and result is not None else result
+
+def _generate_and_cache(cache, key, prompt_parts, is_json, stage_name, system_instruction=None):
+    """Cache-miss path: semantic lookup, then the API; returns the stored response (or None)"""
+    semantic = semantic_llm_cache if stage_name in SEMANTIC_CACHE_STAGES else None
+    vector = None
+    if semantic is not None:
+        try:
+            vector = semantic.embed("\n".join(part.get("text", "") for part in prompt_parts if isinstance(part, dict)))
+            cached = semantic.lookup(stage_name, vector)
+        except Exception as e:
+            print(f"⚠️ {stage_name.upper()}: Semantic cache lookup failed: {e}")
+            vector = cached = None
+        if cached is not None:
+            print(f"⚡ {stage_name.upper()}: Returning semantically cached response")
+            cache.set(key, cached)
+            return cached
+    
+    result = _call_generative_agent_uncached(prompt_parts, is_json, stage_name, system_instruction)
+    # Failures (None) are not cached so the next call retries the API
+    if result is not None:
+        cache.set(key, result)
+        if vector is not None:
+            semantic.add(stage_name, vector, result)
+    return result
+
+def _call_generative_agent_uncached(prompt_parts, is_json, stage_name, system_instruction=None):
     """Call the generative AI agent with proper error handling, detailed token tracking, and retry logic"""
     import time
     import random
     
     max_retries = 3
     base_delay = 2  # Base delay in seconds
+    backoffs = [base_delay * (1 << i) for i in range(max_retries)]  # exponential backoff per attempt
+    body = None  # serialized request body, reused across retries
     
     for attempt in range(max_retries):
         try:
@@ -1118,7 +1788,7 @@ def call_generative_agent(prompt_parts, is_json=False, stage_name="generative_ag
                     total_input_chars += len(str(part))
             
             total_text = " ".join(text_parts)
-            estimated_input_tokens = len(total_text.split()) * 1.3  # Rough token estimation
+            estimated_input_tokens = _approx_tokens(total_text)  # Rough token estimation
             
             print(f"🔍 {stage_name.upper()}: Starting API call (attempt {attempt + 1}/{max_retries})")
             print(f"   📝 Input characters: {total_input_chars:,}")
@@ -1164,16 +1834,24 @@ def call_generative_agent(prompt_parts, is_json=False, stage_name="generative_ag
                     }
                 }
             
+            if system_instruction:
+                payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+            
             print(f"   📦 Payload structure: {len(payload['contents'])} content items")
             print(f"   📦 First part type: {type(prompt_parts[0]) if prompt_parts else 'None'}")
             
-            response = requests.post(GEMINI_API_URL, headers=headers, json=payload, timeout=120)
+            # Serialize straight to UTF-8 bytes once (orjson is much faster on image-heavy
+            # payloads) and post the bytes, skipping requests' dumps-then-encode copy
+            if body is None:
+                body = json_dumps_bytes(payload)
+            response = gemini_http.post(GEMINI_API_URL, headers=headers, data=body, timeout=120)
             
-            print(f"   📡 Response status: {response.status_code}")
+            status = response.status_code
+            print(f"   📡 Response status: {status}")
             print(f"   📡 Response headers: {dict(response.headers)}")
             
-            if response.status_code == 200:
-                result = response.json()
+            if status == 200:
+                result = json_loads(response.content)
                 print(f"   ✅ API call successful")
                 
                 # Extract detailed token information
@@ -1187,7 +1865,7 @@ def call_generative_agent(prompt_parts, is_json=False, stage_name="generative_ag
                     content = result.get("candidates", [{}])[0].get("content", {})
                     parts = content.get("parts", [])
                     response_text = parts[0].get("text", "") if parts else ""
-                    output_token_count = len(response_text.split()) * 1.3
+                    output_token_count = _approx_tokens(response_text)
                 
                 # Log detailed token consumption
                 details = {
@@ -1216,27 +1894,17 @@ def call_generative_agent(prompt_parts, is_json=False, stage_name="generative_ag
                             # Find JSON in the response - look for the complete JSON structure
                             json_start = text_content.find('{')
                             if json_start != -1:
-                                # Find the matching closing brace by counting braces
-                                brace_count = 0
-                                json_end = json_start
-                                for i in range(json_start, len(text_content)):
-                                    if text_content[i] == '{':
-                                        brace_count += 1
-                                    elif text_content[i] == '}':
-                                        brace_count -= 1
-                                        if brace_count == 0:
-                                            json_end = i + 1
-                                            break
-                                
-                                if json_end > json_start:
-                                    json_str = text_content[json_start:json_end]
-                                    print(f"AGENT [{stage_name}]: Extracted JSON length: {len(json_str)}")
-                                    parsed_json = json.loads(json_str)
-                                    print(f"AGENT [{stage_name}]: JSON parsing successful")
-                                    return parsed_json
-                                else:
-                                    print(f"AGENT [{stage_name}]: Could not find complete JSON structure")
-                                    return None
+                                try:
+                                    # JSON-mode responses are normally exactly one object
+                                    parsed_json = json_loads(text_content[json_start:])
+                                    json_end = len(text_content)
+                                except ValueError:
+                                    # C-level scanner parses the first complete object (string-aware)
+                                    # and ignores any trailing text
+                                    parsed_json, json_end = _JSON_DECODER.raw_decode(text_content, json_start)
+                                print(f"AGENT [{stage_name}]: Extracted JSON length: {json_end - json_start}")
+                                print(f"AGENT [{stage_name}]: JSON parsing successful")
+                                return parsed_json
                             else:
                                 print(f"AGENT [{stage_name}]: No JSON structure found in response")
                                 return None
@@ -1252,19 +1920,11 @@ def call_generative_agent(prompt_parts, is_json=False, stage_name="generative_ag
                     parts = content.get("parts", [])
                     return parts[0].get("text", "") if parts else ""
                     
-            elif response.status_code == 429:
-                # Rate limit exceeded - implement exponential backoff
-                error_data = response.json()
-                retry_delay = error_data.get('error', {}).get('details', [{}])[0].get('retryDelay', '40s')
-                
-                # Parse retry delay (e.g., "40s" -> 40 seconds)
-                if isinstance(retry_delay, str) and retry_delay.endswith('s'):
-                    try:
-                        retry_seconds = int(retry_delay[:-1])
-                    except ValueError:
-                        retry_seconds = base_delay * (2 ** attempt)
-                else:
-                    retry_seconds = base_delay * (2 ** attempt)
+            elif status == 429:
+                # Rate limit exceeded - honor the server's retryDelay, else exponential backoff
+                retry_seconds = _gemini_retry_delay_seconds(response)
+                if retry_seconds is None:
+                    retry_seconds = backoffs[attempt]
                 
                 # Add jitter to prevent thundering herd
                 jitter = random.uniform(0.5, 1.5)
@@ -1284,16 +1944,16 @@ def call_generative_agent(prompt_parts, is_json=False, stage_name="generative_ag
                     log_token_consumption(stage_name, 0, "gemini-1.5-pro", {"error": "Max retries exceeded"})
                     return None
                     
-            elif response.status_code == 503:
+            elif status == 503:
                 # Service unavailable - implement longer backoff
-                print(f"⚠️ Service unavailable (503). Retrying in {base_delay * (2 ** attempt):.1f} seconds...")
+                print(f"⚠️ Service unavailable (503). Retrying in {backoffs[attempt]:.1f} seconds...")
                 log_token_consumption(stage_name, 0, "gemini-1.5-pro", {
                     "error": f"Service unavailable (503) (attempt {attempt + 1})",
-                    "retry_delay": base_delay * (2 ** attempt)
+                    "retry_delay": backoffs[attempt]
                 })
                 
                 if attempt < max_retries - 1:
-                    time.sleep(base_delay * (2 ** attempt))
+                    time.sleep(backoffs[attempt])
                     continue
                 else:
                     print(f"❌ Max retries exceeded for {stage_name} (503 errors)")
@@ -1301,8 +1961,8 @@ def call_generative_agent(prompt_parts, is_json=False, stage_name="generative_ag
                     return None
                     
             else:
-                print(f"❌ API Error: {response.status_code} - {response.text}")
-                log_token_consumption(stage_name, 0, "gemini-1.5-pro", {"error": f"API Error {response.status_code}"})
+                print(f"❌ API Error: {status} - {response.text}")
+                log_token_consumption(stage_name, 0, "gemini-1.5-pro", {"error": f"API Error {status}"})
                 return None
                 
         except Exception as e:
@@ -1312,7 +1972,7 @@ def call_generative_agent(prompt_parts, is_json=False, stage_name="generative_ag
             log_token_consumption(stage_name, 0, "gemini-1.5-pro", {"error": str(e), "attempt": attempt + 1})
             
             if attempt < max_retries - 1:
-                delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
+                delay = backoffs[attempt] + random.uniform(0, 1)
                 print(f"⚠️ Retrying in {delay:.1f} seconds...")
                 time.sleep(delay)
                 continue
@@ -1322,8 +1982,128 @@ def call_generative_agent(prompt_parts, is_json=False, stage_name="generative_ag
     
     return None
 
+# Server-sent-events variant of the generateContent endpoint
+GEMINI_STREAM_URL = GEMINI_API_URL.replace(':generateContent', ':streamGenerateContent') + '?alt=sse'
+
+def call_generative_agent_stream(prompt_parts, stage_name="generative_agent", system_instruction=None):
+    """Yield response text chunks as Gemini generates them (no retries; errors raise)"""
+    prompt_parts = [_encode_inline_data_part(part) for part in prompt_parts]
+    payload = {
+        "contents": [{
+            "role": "user",
+            "parts": prompt_parts
+        }],
+        "generationConfig": {
+            "temperature": 0.7,
+            "topK": 40,
+            "topP": 0.95,
+            "maxOutputTokens": 8192
+        }
+    }
+    if system_instruction:
+        payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+    body = json_dumps_bytes(payload)
+    headers = {
+        "Content-Type": "application/json",
+        "x-goog-api-key": GEMINI_API_KEY
+    }
+    
+    print(f"🔍 {stage_name.upper()}: Starting streaming API call")
+    with gemini_http.post(GEMINI_STREAM_URL, headers=headers, data=body, timeout=120, stream=True) as response:
+        if response.status_code != 200:
+            log_token_consumption(stage_name, 0, "gemini-1.5-pro", {"error": f"API Error {response.status_code}"})
+            raise RuntimeError(f"Streaming API error {response.status_code}: {response.text[:200]}")
+        
+        usage_metadata = {}
+        output_chars = 0
+        for line in response.iter_lines():
+            # Each SSE event is a "data: {...}" line holding one partial GenerateContentResponse
+            if not line.startswith(b'data: '):
+                continue
+            event = json_loads(line[6:])
+            usage_metadata = event.get('usageMetadata', usage_metadata)
+            content = event.get("candidates", [{}])[0].get("content", {})
+            for part in content.get("parts", []):
+                chunk = part.get("text", "")
+                if chunk:
+                    output_chars += len(chunk)
+                    yield chunk
+    
+    log_token_consumption(stage_name, usage_metadata.get('totalTokenCount', 0), "gemini-1.5-pro", {
+        "input_tokens": usage_metadata.get('promptTokenCount', 0),
+        "output_tokens": usage_metadata.get('candidatesTokenCount', 0),
+        "response_length": output_chars,
+        "is_json": False,
+        "streamed": True
+    })
+
+# A TRD section ends where the next "## " heading line begins
+_TRD_SECTION_BREAK_RE = re.compile(r'\n(?=## )')
+
+def _stream_sections(chunks):
+    """Regroup streamed text chunks into whole markdown sections (split before '## ' headings)"""
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        pieces = _TRD_SECTION_BREAK_RE.split(buffer)
+        # The last piece may still be growing; hold it back
+        for piece in pieces[:-1]:
+            yield piece + "\n"
+        buffer = pieces[-1]
+    if buffer:
+        yield buffer
+
 # --- Specialized Generative Agents ---
 
+# Requirements documents shorter than this go to downstream prompts as-is; longer ones are
+# condensed once by agent_summarizer so TRD/backlog prompts don't re-pay for the full text
+SUMMARY_MIN_CHARS = 4000
+SUMMARY_CACHE_SIZE = 256
+_summary_cache = OrderedDict()  # SHA-256 of the source text -> summary
+_summary_cache_lock = threading.Lock()
+
+_SUMMARY_PROMPT_TMPL = """You are an expert Business Analyst. Condense the requirements document below into a structured summary of at most 500 tokens that downstream writers can use instead of the full text.
+
+Use these markdown sections, as terse bullet points:
+## Purpose and Scope
+## Users and Roles
+## Functional Requirements
+## Data and Integrations
+## Constraints and Non-Functional Requirements
+
+Keep every concrete requirement, business rule, system name, number and compliance reference. Do not add anything that is not in the document.
+
+--- REQUIREMENTS DOCUMENT ---
+{original_text}
+"""
+
+def agent_summarizer(original_text):
+    """Compact structured summary of the requirements text, cached by SHA-256 of the text.
+
+    Short documents, and any document whose summary call fails, are returned unchanged.
+    """
+    if not original_text or len(original_text) < SUMMARY_MIN_CHARS:
+        return original_text
+    
+    key = hashlib.sha256(original_text.encode('utf-8')).digest()
+    with _summary_cache_lock:
+        summary = _summary_cache.get(key)
+        if summary is not None:
+            _summary_cache.move_to_end(key)
+            return summary
+    
+    print("AGENT [Summarizer]: Condensing requirements text for downstream agents...")
+    summary = call_generative_agent([{"text": _SUMMARY_PROMPT_TMPL.format(original_text=original_text)}], stage_name="document_summary")
+    if not summary:
+        print("AGENT [Summarizer]: Summary failed, using the full requirements text")
+        return original_text
+    
+    with _summary_cache_lock:
+        _summary_cache[key] = summary
+        if len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+    return summary
+
 def agent_planner(text_content, images):
     print("AGENT [Planner]: Starting enhanced analysis to create a comprehensive plan...")
     prompt_text = f"""You are an expert Business Analyst with 15+ years of experience in enterprise software development. 
@@ -1405,12 +2185,33 @@ Note: This is a fallback plan due to API unavailability. For comprehensive analy
         print("AGENT [Planner]: Enhanced plan created successfully.")
         return plan, error
 
-def agent_trd_writer(plan, original_text, lob_info=None):
-    """Enhanced TRD writer with better structure and content, focusing on Non-Functional Requirements instead of LOB"""
-    print("AGENT [TRD Writer]: Creating comprehensive Technical Requirements Document...")
-    
-    # Enhanced Non-Functional Requirements section
-    nfr_section = """
+# Fixed TRD writer instructions, sent as the Gemini system instruction (stable prefix)
+_TRD_SYSTEM_INSTRUCTION = """You are a Senior Technical Writer and Business Analyst with 20+ years of experience in enterprise software documentation.
+
+Create a comprehensive Technical Requirements Document (TRD) based on the following plan and original requirements. Structure it as follows:
+
+# TECHNICAL REQUIREMENTS DOCUMENT
+
+## 1. EXECUTIVE SUMMARY
+- Project Overview
+- Key Objectives
+- Success Criteria
+- Business Value Proposition
+
+## 2. SYSTEM OVERVIEW
+- High-Level Architecture
+- System Components
+- Technology Stack
+- Integration Points
+
+## 3. FUNCTIONAL REQUIREMENTS
+- User Stories and Use Cases
+- Business Rules
+- Data Requirements
+- Workflow Definitions
+- Business Process Mapping
+
+
 ## 4. NON-FUNCTIONAL REQUIREMENTS
 
 ### 4.1 Performance Requirements
@@ -1453,34 +2254,7 @@ def agent_trd_writer(plan, original_text, lob_info=None):
 - Monitoring and alerting systems
 - Performance metrics and dashboards
 - Technical debt management
-"""
-
-    prompt = f"""You are a Senior Technical Writer and Business Analyst with 20+ years of experience in enterprise software documentation.
-
-Create a comprehensive Technical Requirements Document (TRD) based on the following plan and original requirements. Structure it as follows:
-
-# TECHNICAL REQUIREMENTS DOCUMENT
-
-## 1. EXECUTIVE SUMMARY
-- Project Overview
-- Key Objectives
-- Success Criteria
-- Business Value Proposition
-
-## 2. SYSTEM OVERVIEW
-- High-Level Architecture
-- System Components
-- Technology Stack
-- Integration Points
-
-## 3. FUNCTIONAL REQUIREMENTS
-- User Stories and Use Cases
-- Business Rules
-- Data Requirements
-- Workflow Definitions
-- Business Process Mapping
 
-{nfr_section}
 
 ## 5. TECHNICAL SPECIFICATIONS
 - API Specifications (REST/GraphQL)
@@ -1529,138 +2303,67 @@ Make the document:
 - Compliant with industry standards
 - Focus on measurable requirements
 
---- HIGH-LEVEL PLAN ---
+"""
+
+# Per-call TRD writer input; only the plan and the requirements text vary
+_TRD_PROMPT_TMPL = """--- HIGH-LEVEL PLAN ---
 {plan}
 
 --- ORIGINAL REQUIREMENTS TEXT ---
 {original_text}
 """
-    result = call_generative_agent([{"text": prompt}], stage_name="trd_writer")
-    if result is None:
-        return "TRD could not be completed due to API error.", "API call failed"
-    return result, None
-
-def agent_diagrammer(plan, diagram_type):
-    """Generate diagrams in Mermaid; on failure, return a minimal valid diagram."""
-    print(f"AGENT [Diagrammer]: Creating {diagram_type} diagram...")
-    
-    try:
-
-        if diagram_type == "HLD":
-            prompt = f"""You are a Senior Solution Architect specializing in system design diagrams.
-
-Create a High-Level Design (HLD) diagram using Mermaid syntax. The diagram should show:
-
-**System Architecture Components:**
-- User Interface Layer (Web/Mobile/Desktop)
-- Application Layer (API Gateway, Services)
-- Business Logic Layer (Core Services)
-- Data Access Layer (Repositories)
-- External Systems Integration
-- Security Layer (Authentication/Authorization)
-
-**Key Elements:**
-- System boundaries and data flow
-- Integration points with external systems
-- Technology stack components
-- Security layers and authentication
-- Load balancers and caching
-
-Use Mermaid flowchart syntax with:
-- Clear component names in boxes
-- Proper relationships with arrows
-- Color coding for different layers using classDef and class assignments
-- Professional styling and layout with consistent colors for layers
-- AVOID subgraph syntax - use simple flowchart instead
 
-IMPORTANT: 
-- Respond ONLY with the Mermaid diagram code, no additional text or explanations
-- Use simple flowchart syntax, NOT subgraph
-- Use clear, simple node labels
-- Avoid complex syntax that might cause parsing errors
+def _trd_prompt(plan, original_text):
+    """Variable part of the TRD writer prompt, shared by the blocking and streaming paths"""
+    return _TRD_PROMPT_TMPL.format(plan=plan, original_text=original_text)
 
-Use THIS CANONICAL MERMAID STYLE as reference. Reuse its init block, classDefs, and linkStyle conventions; only change node labels and edges for the current system. Keep linkStyle indices contiguous starting at 0.
+def agent_trd_writer(plan, original_text, lob_info=None, on_section=None):
+    """Enhanced TRD writer with better structure and content, focusing on Non-Functional Requirements instead of LOB.
 
-                    ```mermaid
-                    %%{init: {
-                      "theme": "default",
-                      "themeVariables": {
-                        "fontFamily": "Segoe UI, Arial",
-                        "primaryColor": "#f2f2f2",
-                        "edgeLabelBackground":"#f7ffe2"
-                      }
-                    }}%%
-                    flowchart TD
-                        start((Start)):::startStyle
-                        step1["First Step"]:::stepA
-                        dec1{{Decision Point}}:::decision
-                        step2["Second Step"]:::stepB
-                        endcircle(("END")):::endStyle
+    lob_info is accepted for caller compatibility but not used in the prompt.
 
-                        start --> step1
-                        step1 -- Yes --> dec1
-                        step1 -- No --> endcircle
-                        dec1 -- True --> step2
-                        dec1 -- False --> endcircle
-                        step2 --> endcircle
-
-                        %% Node styling
-                        classDef startStyle fill:#6be585,stroke:#247346,stroke-width:3px,color:#fff;
-                        classDef decision fill:#ffd966,stroke:#b29928,stroke-width:3px,color:#593E00;
-                        classDef stepA fill:#bbdefb,stroke:#1976d2,stroke-width:2px;
-                        classDef stepB fill:#c5e1a5,stroke:#558b2f,stroke-width:2px;
-                        classDef endStyle fill:#e57373,stroke:#b71c1c,stroke-width:4px,color:#fff;
-
-                        %% Link styling (by order)
-                        linkStyle 0 stroke:#29a19c,stroke-width:4px;
-                        linkStyle 1 stroke:#fbc02d,stroke-width:3px,stroke-dasharray: 4 2;
-                        linkStyle 2 stroke:#b71c1c,stroke-width:3px,stroke-dasharray: 2 4;
-                        linkStyle 3 stroke:#388e3c,stroke-width:3px;
-                        linkStyle 4 stroke:#b71c1c,stroke-width:3px,stroke-dasharray: 4 2;
-                    ```
-
---- HIGH-LEVEL PLAN ---
-{plan}
-"""
-        else:  # LLD
-            prompt = f"""You are a Senior Software Architect specializing in detailed system design.
-
-Create a Low-Level Design (LLD) diagram using Mermaid syntax. The diagram should show:
-
-**Detailed System Components:**
-- Specific modules, classes, and interfaces
-- Database schema relationships and tables
-- API endpoints and HTTP methods
-- Data flow between components
-- Error handling and validation paths
-- Caching and performance optimizations
-
-**Key Elements:**
-- Detailed component interactions
-- Database tables and relationships
-- API specifications with methods
-- Security implementation details
-- Performance considerations
-- Error handling flows
-
-Use Mermaid flowchart syntax with:
-- Detailed component breakdown
-- Clear data flow with labels
-- Error handling paths
-- Performance indicators
-- Database relationships
-- Color-coded components using classDef and class assignments
-- AVOID subgraph syntax - use simple flowchart instead
-
-IMPORTANT: 
-- Respond ONLY with the Mermaid diagram code, no additional text or explanations
-- Use simple flowchart syntax, NOT subgraph
-- Use clear, simple node labels
-- Avoid complex syntax that might cause parsing errors
-
-Use THIS CANONICAL MERMAID STYLE as reference. Reuse its init block, classDefs, and linkStyle conventions; only change node labels and edges for the current feature. Keep linkStyle indices contiguous starting at 0.
+    When on_section is given the TRD is streamed and on_section(markdown) is called
+    with each section as soon as it is complete.
+    """
+    print("AGENT [TRD Writer]: Creating comprehensive Technical Requirements Document...")
+    prompt_parts = [{"text": _trd_prompt(plan, original_text)}]
+    
+    if on_section is not None:
+        # Streaming doesn't depend on the cache; set_llm_cache(None) only skips the lookup/store
+        cache = llm_cache
+        if cache is not None:
+            key = _llm_cache_key("trd_writer", prompt_parts, False, _TRD_SYSTEM_INSTRUCTION)
+            cached = cache.get(key)
+            if cached is not None:
+                on_section(cached)
+                return cached, None
+        
+        sections = []
+        try:
+            for section in _stream_sections(call_generative_agent_stream(prompt_parts, stage_name="trd_writer", system_instruction=_TRD_SYSTEM_INSTRUCTION)):
+                sections.append(section)
+                on_section(section)
+        except Exception as e:
+            print(f"AGENT [TRD Writer]: Streaming failed: {e}")
+            if sections:
+                return "".join(sections), "Stream interrupted"
+        if sections:
+            result = "".join(sections)
+            if cache is not None:
+                cache.set(key, result)
+            return result, None
+        # Nothing streamed; fall back to the blocking call (with retries)
+    
+    result = call_generative_agent(prompt_parts, stage_name="trd_writer", system_instruction=_TRD_SYSTEM_INSTRUCTION)
+    if result is None:
+        return "TRD could not be completed due to API error.", "API call failed"
+    if on_section is not None:
+        on_section(result)
+    return result, None
 
-                    ```mermaid
+# Canonical Mermaid example embedded in the diagram prompts. Plain (non-f) string, so the
+# %%{init}%% block and the {Decision Point} node reach the model verbatim
+_MERMAID_STYLE_REF = """                    ```mermaid
                     %%{init: {
                       "theme": "default",
                       "themeVariables": {
@@ -1672,7 +2375,7 @@ Use THIS CANONICAL MERMAID STYLE as reference. Reuse its init block, classDefs,
                     flowchart TD
                         start((Start)):::startStyle
                         step1["First Step"]:::stepA
-                        dec1{{Decision Point}}:::decision
+                        dec1{Decision Point}:::decision
                         step2["Second Step"]:::stepB
                         endcircle(("END")):::endStyle
 
@@ -1697,13 +2400,224 @@ Use THIS CANONICAL MERMAID STYLE as reference. Reuse its init block, classDefs,
                         linkStyle 3 stroke:#388e3c,stroke-width:3px;
                         linkStyle 4 stroke:#b71c1c,stroke-width:3px,stroke-dasharray: 4 2;
                     ```
+"""
 
---- HIGH-LEVEL PLAN ---
+# Rules and style reference shared by the HLD and LLD diagrammers, sent as the Gemini
+# system instruction so both diagram calls start with the same cacheable prefix
+_DIAGRAM_SYSTEM_INSTRUCTION = """You are a Senior Architect who produces system design diagrams in Mermaid syntax.
+
+IMPORTANT: 
+- Respond ONLY with the Mermaid diagram code, no additional text or explanations
+- Use simple flowchart syntax, NOT subgraph
+- Use clear, simple node labels
+- Avoid complex syntax that might cause parsing errors
+
+Use THIS CANONICAL MERMAID STYLE as reference. Reuse its init block, classDefs, and linkStyle conventions; only change node labels and edges for the current diagram. Keep linkStyle indices contiguous starting at 0.
+
+""" + _MERMAID_STYLE_REF
+
+# Per-type diagram brief, sent with the plan in the user turn
+_HLD_DIAGRAM_BRIEF = """You are a Senior Solution Architect specializing in system design diagrams.
+
+Create a High-Level Design (HLD) diagram using Mermaid syntax. The diagram should show:
+
+**System Architecture Components:**
+- User Interface Layer (Web/Mobile/Desktop)
+- Application Layer (API Gateway, Services)
+- Business Logic Layer (Core Services)
+- Data Access Layer (Repositories)
+- External Systems Integration
+- Security Layer (Authentication/Authorization)
+
+**Key Elements:**
+- System boundaries and data flow
+- Integration points with external systems
+- Technology stack components
+- Security layers and authentication
+- Load balancers and caching
+
+Use Mermaid flowchart syntax with:
+- Clear component names in boxes
+- Proper relationships with arrows
+- Color coding for different layers using classDef and class assignments
+- Professional styling and layout with consistent colors for layers
+- AVOID subgraph syntax - use simple flowchart instead
+
+"""
+
+_LLD_DIAGRAM_BRIEF = """You are a Senior Software Architect specializing in detailed system design.
+
+Create a Low-Level Design (LLD) diagram using Mermaid syntax. The diagram should show:
+
+**Detailed System Components:**
+- Specific modules, classes, and interfaces
+- Database schema relationships and tables
+- API endpoints and HTTP methods
+- Data flow between components
+- Error handling and validation paths
+- Caching and performance optimizations
+
+**Key Elements:**
+- Detailed component interactions
+- Database tables and relationships
+- API specifications with methods
+- Security implementation details
+- Performance considerations
+- Error handling flows
+
+Use Mermaid flowchart syntax with:
+- Detailed component breakdown
+- Clear data flow with labels
+- Error handling paths
+- Performance indicators
+- Database relationships
+- Color-coded components using classDef and class assignments
+- AVOID subgraph syntax - use simple flowchart instead
+
+"""
+
+_DIAGRAM_PROMPT_TMPL = """{brief}--- HIGH-LEVEL PLAN ---
 {plan}
 """
+
+# A flowchart declaration on any line, possibly indented (an %%{init}%% block may precede it)
+_FLOWCHART_RE = re.compile(r'(?m)^[ \t]*flowchart\s+\w+')
+
+# Mermaid statements checked by validate_mermaid (applied to stripped lines)
+_CLASSDEF_RE = re.compile(r'classDef\s+([\w,-]+)')
+_CLASS_RE = re.compile(r'class\s+[\w,\s-]+?\s+([\w-]+)\s*;?$')
+_INLINE_CLASS_RE = re.compile(r':::([\w-]+)')
+_LINKSTYLE_RE = re.compile(r'linkStyle\s+([\d,\s]+)')
+# One link operator: -->, --->, ---, ==>, ===, -.->, -.-, --o, --x (a "-- label -->" link counts once)
+_LINK_RE = re.compile(r'<?(?:-{2,}>|-{3,}|={2,}>|={3,}|-\.+->|-\.+-|--[ox])')
+# A line ending in a link operator (optionally with a |label|) has no target node
+_DANGLING_EDGE_RE = re.compile(r'(?:-{2,}>|-{3,}|={2,}>|={3,}|-\.+->|-\.+-)\s*(?:\|[^|]*\|)?\s*;?$')
+# Node labels and |edge labels| are blanked before counting links, so '&' or '---' in text is ignored
+_MERMAID_LABEL_RE = re.compile(r'"[^"]*"|\[[^\]]*\]|\([^)]*\)|\{[^}]*\}|\|[^|]*\|')
+_MERMAID_DIRECTIVE_PREFIXES = ('%%', 'classDef ', 'class ', 'linkStyle ', 'style ', 'click ')
+
+def _count_links(statement):
+    """Links drawn by one statement; '&' fans out, so 'A & B --> C' is two links"""
+    groups = _LINK_RE.split(_MERMAID_LABEL_RE.sub('', statement))
+    return sum((left.count('&') + 1) * (right.count('&') + 1) for left, right in zip(groups, groups[1:]))
+
+def _mermaid_lint(lines):
+    """Per-line findings for validate_mermaid/repair_mermaid.
+
+    Returns (classdefs, edge_count, problems, unclosed) where problems maps a line
+    index to a short reason (index None marks whole-diagram problems) and unclosed
+    is the number of subgraphs left open.
+    """
+    classdefs = set()
+    edge_count = 0
+    for line in lines:
+        stripped = line.strip()
+        classdef = _CLASSDEF_RE.match(stripped)
+        if classdef:
+            classdefs.update(classdef.group(1).split(','))
+        elif not stripped.startswith(_MERMAID_DIRECTIVE_PREFIXES):
+            edge_count += _count_links(stripped)
+    
+    problems = {}
+    depth = 0
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if '```' in stripped:
+            problems[index] = "stray code fence"
+        elif stripped.startswith('subgraph'):
+            depth += 1
+        elif stripped == 'end':
+            if depth == 0:
+                problems[index] = "'end' without subgraph"
+            else:
+                depth -= 1
+        elif stripped.startswith('linkStyle '):
+            linkstyle = _LINKSTYLE_RE.match(stripped)
+            indices = [int(i) for i in re.split(r'[,\s]+', linkstyle.group(1)) if i] if linkstyle else []
+            if any(i >= edge_count for i in indices):
+                problems[index] = f"linkStyle index beyond the {edge_count} links"
+        elif stripped.startswith('class '):
+            assignment = _CLASS_RE.match(stripped)
+            if assignment and assignment.group(1) not in classdefs:
+                problems[index] = f"class '{assignment.group(1)}' has no classDef"
+        elif not stripped.startswith(_MERMAID_DIRECTIVE_PREFIXES):
+            if _DANGLING_EDGE_RE.search(stripped):
+                problems[index] = "link without a target node"
+            elif any(name not in classdefs for name in _INLINE_CLASS_RE.findall(stripped)):
+                problems[index] = "inline class has no classDef"
+    if depth:
+        problems[None] = f"{depth} unclosed subgraph(s)"
+    return classdefs, edge_count, problems, depth
+
+def validate_mermaid(code):
+    """Check generated Mermaid for errors that break rendering; returns (ok, errors)"""
+    if not code or not _FLOWCHART_RE.search(code):
+        return False, ["missing flowchart declaration"]
+    lines = code.splitlines()
+    _, _, problems, _ = _mermaid_lint(lines)
+    errors = [reason if index is None else f"line {index + 1}: {reason}" for index, reason in problems.items()]
+    return not errors, errors
+
+def repair_mermaid(code):
+    """Locally fix what validate_mermaid reports: drop offending lines, strip unknown
+    inline classes and close open subgraphs"""
+    lines = code.splitlines()
+    classdefs, _, problems, unclosed = _mermaid_lint(lines)
+    repaired = []
+    for index, line in enumerate(lines):
+        reason = problems.get(index)
+        if reason == "inline class has no classDef":
+            repaired.append(_INLINE_CLASS_RE.sub(lambda m: m.group(0) if m.group(1) in classdefs else "", line))
+        elif reason is None:
+            repaired.append(line)
+    repaired.extend(["end"] * unclosed)
+    return "\n".join(repaired)
+
+# Finished Mermaid output per (plan, diagram type), so unchanged plans skip the LLM call
+# and the Mermaid extraction/validation on iterative re-runs
+DIAGRAM_CACHE_SIZE = 256
+DIAGRAM_CACHE_TTL = 60 * 60  # seconds
+_diagram_cache = OrderedDict()  # key -> (expires_at, mermaid)
+_diagram_cache_lock = threading.Lock()
+
+def _diagram_cache_key(plan, diagram_type):
+    return hashlib.sha256(f"{diagram_type}\0{plan or ''}".encode('utf-8')).digest()
+
+def _get_cached_diagram(key):
+    with _diagram_cache_lock:
+        entry = _diagram_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _diagram_cache[key]
+            return None
+        _diagram_cache.move_to_end(key)
+        return entry[1]
+
+def _store_diagram(key, mermaid):
+    with _diagram_cache_lock:
+        _diagram_cache[key] = (time.monotonic() + DIAGRAM_CACHE_TTL, mermaid)
+        _diagram_cache.move_to_end(key)
+        if len(_diagram_cache) > DIAGRAM_CACHE_SIZE:
+            _diagram_cache.popitem(last=False)
+
+def agent_diagrammer(plan, diagram_type):
+    """Generate diagrams in Mermaid; on failure, return a minimal valid diagram."""
+    print(f"AGENT [Diagrammer]: Creating {diagram_type} diagram...")
+    
+    cache_key = _diagram_cache_key(plan, diagram_type)
+    cached = _get_cached_diagram(cache_key)
+    if cached is not None:
+        print(f"AGENT [Diagrammer]: Reusing cached {diagram_type} diagram for unchanged plan")
+        return cached, None
+    
+    try:
+
+        brief = _HLD_DIAGRAM_BRIEF if diagram_type == "HLD" else _LLD_DIAGRAM_BRIEF
+        prompt = _DIAGRAM_PROMPT_TMPL.format(brief=brief, plan=plan)
         
         print(f"AGENT [Diagrammer]: Sending {diagram_type} diagram request...")
-        result = call_generative_agent([{"text": prompt}], stage_name=f"{diagram_type.lower()}_diagram")
+        result = call_generative_agent([{"text": prompt}], stage_name=f"{diagram_type.lower()}_diagram", system_instruction=_DIAGRAM_SYSTEM_INSTRUCTION)
         
         if result is None:
             print(f"AGENT [Diagrammer]: {diagram_type} diagram generation failed - API returned None")
@@ -1712,19 +2626,23 @@ Use THIS CANONICAL MERMAID STYLE as reference. Reuse its init block, classDefs,
         # Clean the result to extract Mermaid code
         cleaned_result = extract_mermaid_code(result)
 
-        # If the model did not return usable code, provide a minimal fallback
-        import re
-        has_flowchart = False
-        if cleaned_result:
-            # Accept diagrams that include an init block before the flowchart
-            # e.g., starting with `%%{init: ...}%%` followed by `flowchart TD`
-            has_flowchart = bool(re.search(r'(^|\n)flowchart\s+\w+', cleaned_result))
-        if not cleaned_result or not has_flowchart:
+        # Catch output that would fail to render; repair it locally where possible
+        # (cheaper than another model call), else use the minimal fallback
+        is_valid, problems = validate_mermaid(cleaned_result)
+        if not is_valid and cleaned_result and _FLOWCHART_RE.search(cleaned_result):
+            repaired = repair_mermaid(cleaned_result)
+            is_valid, _ = validate_mermaid(repaired)
+            if is_valid:
+                print(f"AGENT [Diagrammer]: Repaired {diagram_type} diagram locally: {'; '.join(problems)}")
+                cleaned_result = repaired
+        if not is_valid:
             print(f"AGENT [Diagrammer]: Falling back to contextual minimal {diagram_type} diagram")
             minimal = build_contextual_minimal_diagram(plan or "", diagram_type)
+            _store_diagram(cache_key, minimal)
             return minimal, None
 
         print(f"AGENT [Diagrammer]: Successfully generated {diagram_type} diagram")
+        _store_diagram(cache_key, cleaned_result)
         return cleaned_result, None
         
     except Exception as e:
@@ -1735,32 +2653,75 @@ Use THIS CANONICAL MERMAID STYLE as reference. Reuse its init block, classDefs,
         minimal = build_contextual_minimal_diagram(plan or "", diagram_type)
         return minimal, None
 
+# Plan keywords (matched as substrings) that switch on each node of the fallback diagrams
+DIAGRAM_FEATURE_KEYWORDS: dict[str, tuple[str, ...]] = {
+    # Common detections
+    "ui": ("ui", "user interface", "frontend", "web"),
+    "api": ("api", "gateway", "endpoint"),
+    "auth": ("auth", "authentication", "oauth", "jwt"),
+    "core": ("core", "service", "business logic", "orchestrator"),
+    "repo": ("repo", "repository", "dao", "data access"),
+    "db": ("db", "database", "table", "schema"),
+    "cache": ("cache", "caching"),
+    "lb": ("load balancer", "load-balancer", "lb"),
+    # External systems
+    "ext_ping": ("ping",),
+    "ext_touchstone": ("touchstone",),
+    "ext_guidewire": ("guidewire",),
+    "ext_imageright": ("imageright",),
+    "ext_genai": ("genai", "gen ai", "llm", "ai platform"),
+    # LLD components
+    "ctrl": ("controller", "resource", "endpoint"),
+    "svc": ("service", "logic"),
+    "rep": ("repository", "repo", "dao"),
+    "dbtbl": ("table", "schema", "entity", "database"),
+    "util_val": ("validate", "validation"),
+    "util_err": ("error", "exception"),
+}
+
+DIAGRAM_ALL_KEYWORDS = frozenset(kw for keywords in DIAGRAM_FEATURE_KEYWORDS.values() for kw in keywords)
+
+# Scan the plan once for every diagram keyword (same approach as the LOB classifier)
+if AHOCORASICK_AVAILABLE:
+    _diagram_automaton = ahocorasick.Automaton()
+    for _term in DIAGRAM_ALL_KEYWORDS:
+        _diagram_automaton.add_word(_term, _term)
+    _diagram_automaton.make_automaton()
+else:
+    _diagram_automaton = None
+
+def _diagram_features(lowered: str) -> dict:
+    """Map each DIAGRAM_FEATURE_KEYWORDS entry to whether any of its keywords occurs"""
+    if _diagram_automaton is not None:
+        hits = {term for _, term in _diagram_automaton.iter(lowered)}
+    else:
+        hits = {term for term in DIAGRAM_ALL_KEYWORDS if term in lowered}
+    return {name: any(kw in hits for kw in keywords) for name, keywords in DIAGRAM_FEATURE_KEYWORDS.items()}
+
+@functools.lru_cache(maxsize=256)
 def build_contextual_minimal_diagram(plan_text: str, diagram_type: str) -> str:
     """Build a small but context-aware Mermaid flowchart using keywords from plan.
 
     Uses descriptive IDs and simple classDefs to keep rendering stable.
     """
-    p = (plan_text or "").lower()
-
-    def has(*keys: str) -> bool:
-        return any(k in p for k in keys)
+    feature = _diagram_features((plan_text or "").lower())
 
     # Common detections
-    ui = has("ui", "user interface", "frontend", "web")
-    api = has("api", "gateway", "endpoint")
-    auth = has("auth", "authentication", "oauth", "jwt")
-    core = has("core", "service", "business logic", "orchestrator")
-    repo = has("repo", "repository", "dao", "data access")
-    db = has("db", "database", "table", "schema")
-    cache = has("cache", "caching")
-    lb = has("load balancer", "load-balancer", "lb")
+    ui = feature["ui"]
+    api = feature["api"]
+    auth = feature["auth"]
+    core = feature["core"]
+    repo = feature["repo"]
+    db = feature["db"]
+    cache = feature["cache"]
+    lb = feature["lb"]
 
     # External systems
-    ext_ping = has("ping")
-    ext_touchstone = has("touchstone")
-    ext_guidewire = has("guidewire")
-    ext_imageright = has("imageright")
-    ext_genai = has("genai", "gen ai", "llm", "ai platform")
+    ext_ping = feature["ext_ping"]
+    ext_touchstone = feature["ext_touchstone"]
+    ext_guidewire = feature["ext_guidewire"]
+    ext_imageright = feature["ext_imageright"]
+    ext_genai = feature["ext_genai"]
 
     lines = ["flowchart TD"]
 
@@ -1848,12 +2809,12 @@ def build_contextual_minimal_diagram(plan_text: str, diagram_type: str) -> str:
 
     else:
         # LLD minimal from plan
-        ctrl = has("controller", "resource", "endpoint")
-        svc = has("service", "logic")
-        rep = has("repository", "repo", "dao")
-        dbtbl = has("table", "schema", "entity", "database")
-        util_val = has("validate", "validation")
-        util_err = has("error", "exception")
+        ctrl = feature["ctrl"]
+        svc = feature["svc"]
+        rep = feature["rep"]
+        dbtbl = feature["dbtbl"]
+        util_val = feature["util_val"]
+        util_err = feature["util_err"]
 
         if ctrl: lines.append("CTRL_Controller[Controller]")
         if svc: lines.append("SVC_Service[Service]")
@@ -1886,6 +2847,55 @@ def build_contextual_minimal_diagram(plan_text: str, diagram_type: str) -> str:
 
     return "\n".join(lines) + "\n"
 
+def agent_diagrammer_pair(plan):
+    """Generate the HLD and LLD diagrams concurrently; returns ((hld, err), (lld, err))"""
+    # The two prompts are independent, so the network round-trips overlap
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        hld_future = pool.submit(agent_diagrammer, plan, "HLD")
+        lld_future = pool.submit(agent_diagrammer, plan, "LLD")
+        return hld_future.result(), lld_future.result()
+
+# Static backlog returned when the backlog model call fails; serialized once at import
+_FALLBACK_BACKLOG_JSON = json.dumps({
+    "backlog": [
+        {
+            "id": "epic-1",
+            "type": "Epic",
+            "title": "System Implementation",
+            "description": "Core system implementation based on requirements analysis",
+            "priority": "High",
+            "effort": "40",
+            "trd_sections": ["SYSTEM OVERVIEW", "FUNCTIONAL REQUIREMENTS"],
+            "requirements_covered": ["System architecture setup", "Core functionality implementation"],
+            "children": [
+                {
+                    "id": "feature-1",
+                    "type": "Feature",
+                    "title": "Basic System Setup",
+                    "description": "Initial system setup and configuration",
+                    "priority": "High",
+                    "effort": "13",
+                    "trd_sections": ["SYSTEM OVERVIEW"],
+                    "requirements_covered": ["System architecture setup"],
+                    "children": [
+                        {
+                            "id": "story-1",
+                            "type": "User Story",
+                            "title": "System Architecture Setup",
+                            "description": "As a developer, I want to set up the system architecture so that the foundation is ready for development",
+                            "priority": "High",
+                            "effort": "5",
+                            "acceptance_criteria": ["Architecture diagram is created", "Technology stack is defined"],
+                            "trd_sections": ["SYSTEM OVERVIEW"],
+                            "requirements_covered": ["System architecture setup"]
+                        }
+                    ]
+                }
+            ]
+        }
+    ]
+})
+
 def agent_backlog_creator(plan, original_text, trd):
     """Enhanced backlog creator with better structure and fallback mechanism"""
     print("AGENT [Backlog Creator]: Creating comprehensive project backlog...")
@@ -1976,47 +2986,8 @@ IMPORTANT: Respond ONLY with valid JSON, no additional text or explanations.
     result = call_generative_agent([{"text": prompt}], is_json=True, stage_name="backlog_creation")
     if result is None:
         print("AGENT [Backlog Creator]: API failed, creating fallback backlog...")
-        # Create a fallback backlog structure with linking information
-        fallback_backlog = {
-            "backlog": [
-                {
-                    "id": "epic-1",
-                    "type": "Epic",
-                    "title": "System Implementation",
-                    "description": "Core system implementation based on requirements analysis",
-                    "priority": "High",
-                    "effort": "40",
-                    "trd_sections": ["SYSTEM OVERVIEW", "FUNCTIONAL REQUIREMENTS"],
-                    "requirements_covered": ["System architecture setup", "Core functionality implementation"],
-                    "children": [
-                        {
-                            "id": "feature-1",
-                            "type": "Feature",
-                            "title": "Basic System Setup",
-                            "description": "Initial system setup and configuration",
-                            "priority": "High",
-                            "effort": "13",
-                            "trd_sections": ["SYSTEM OVERVIEW"],
-                            "requirements_covered": ["System architecture setup"],
-                            "children": [
-                                {
-                                    "id": "story-1",
-                                    "type": "User Story",
-                                    "title": "System Architecture Setup",
-                                    "description": "As a developer, I want to set up the system architecture so that the foundation is ready for development",
-                                    "priority": "High",
-                                    "effort": "5",
-                                    "acceptance_criteria": ["Architecture diagram is created", "Technology stack is defined"],
-                                    "trd_sections": ["SYSTEM OVERVIEW"],
-                                    "requirements_covered": ["System architecture setup"]
-                                }
-                            ]
-                        }
-                    ]
-                }
-            ]
-        }
-        return json.dumps(fallback_backlog), None
+        # Fallback backlog structure with linking information (pre-serialized)
+        return _FALLBACK_BACKLOG_JSON, None
     
     # Debug: Log the AI result
     print(f"AGENT [Backlog Creator]: AI returned result type: {type(result)}")
@@ -2033,69 +3004,90 @@ IMPORTANT: Respond ONLY with valid JSON, no additional text or explanations.
 # --- Helper functions (add_ids_to_backlog, Azure DevOps, etc.) ---
 def add_ids_to_backlog(items):
     if not isinstance(items, list): return []
+    # Already numbered by an earlier pass; keep the IDs stable (idempotent)
+    if items and isinstance(items[0], dict) and str(items[0].get('id') or '').startswith('E-'):
+        return items
     for i, epic in enumerate(items):
         epic['id'] = f"E-{i+1}"
-        for j, feature in enumerate(epic.get('children', []), 1):
+        for j, feature in enumerate(epic.get('children') or (), 1):
             feature['id'] = f"F-{j}"
-            for k, story in enumerate(feature.get('children', []), 1):
+            for k, story in enumerate(feature.get('children') or (), 1):
                 story['id'] = f"US-{k}"
     return items
 
 # --- Enhanced Azure DevOps Integration ---
 
+# Keep-alive session for Azure DevOps; bulk backlog uploads reuse one TLS connection.
+# Throttled (429) requests were not applied by ADO, so even work item creates (POST) are
+# safe to retry; urllib3 waits for the server's Retry-After before each attempt
+ado_http = requests.Session()
+ado_http.mount("https://", requests.adapters.HTTPAdapter(
+    pool_maxsize=10,  # matches ADO_MAX_CONCURRENCY
+    max_retries=Retry(total=3, connect=3, read=0, status=3, status_forcelist=[429],
+                      allowed_methods=None, backoff_factor=1, raise_on_status=False)
+))
+atexit.register(ado_http.close)
+
+@functools.lru_cache(maxsize=1)
+def _ado_authorization():
+    """Basic auth value for the (process-constant) PAT, encoded once"""
+    return f'Basic {_b64(f":{ADO_PAT}".encode())}'
+
 def get_ado_headers():
     """Get Azure DevOps headers with enhanced error handling"""
     if not ADO_PAT:
         raise ValueError("Azure DevOps Personal Access Token not configured")
     return {
-        'Authorization': f'Basic {base64.b64encode(f":{ADO_PAT}".encode()).decode()}',
+        'Authorization': _ado_authorization(),
         'Content-Type': 'application/json-patch+json'
     }
 
-def create_ado_work_item(item_type, title, description="", parent_url=None, tags=None):
-    """Enhanced Azure DevOps work item creation with better error handling"""
+def _ado_work_item_patch(title, description="", parent_url=None, tags=None):
+    """JSON Patch document for a new work item"""
+    # Prepare work item data
+    work_item_data = [
+        {
+            "op": "add",
+            "path": "/fields/System.Title",
+            "value": title
+        },
+        {
+            "op": "add",
+            "path": "/fields/System.Description",
+            "value": description
+        }
+    ]
+    
+    # Add tags if provided
+    if tags:
+        work_item_data.append({
+            "op": "add",
+            "path": "/fields/System.Tags",
+            "value": "; ".join(tags)
+        })
+    
+    # Add parent relationship if provided
+    if parent_url:
+        work_item_data.append({
+            "op": "add",
+            "path": "/relations/-",
+            "value": {
+                "rel": "System.LinkTypes.Hierarchy-Reverse",
+                "url": parent_url
+            }
+        })
+    return work_item_data
+
+def _post_ado_work_item(item_type, work_item_data):
+    """Create one work item from its JSON Patch document; returns the work item or None"""
     try:
         headers = get_ado_headers()
-        
-        # Prepare work item data
-        work_item_data = [
-            {
-                "op": "add",
-                "path": "/fields/System.Title",
-                "value": title
-            },
-            {
-                "op": "add",
-                "path": "/fields/System.Description",
-                "value": description
-            }
-        ]
-        
-        # Add tags if provided
-        if tags:
-            work_item_data.append({
-                "op": "add",
-                "path": "/fields/System.Tags",
-                "value": "; ".join(tags)
-            })
-        
-        # Add parent relationship if provided
-        if parent_url:
-            work_item_data.append({
-                "op": "add",
-                "path": "/relations/-",
-                "value": {
-                    "rel": "System.LinkTypes.Hierarchy-Reverse",
-                    "url": parent_url
-                }
-            })
-        
         url = f"{ADO_ORGANIZATION_URL}{ADO_PROJECT_NAME}/_apis/wit/workitems/${item_type}?api-version=6.0"
         
-        response = requests.post(url, headers=headers, json=work_item_data)
+        response = ado_http.post(url, headers=headers, data=json_dumps_bytes(work_item_data))
         response.raise_for_status()
         
-        result = response.json()
+        result = json_loads(response.content)
         print(f"Successfully created {item_type} work item: {result.get('id')}")
         return result
         
@@ -2108,6 +3100,66 @@ def create_ado_work_item(item_type, title, description="", parent_url=None, tags
         print(f"Unexpected error in Azure DevOps integration: {e}")
         return None
 
+def create_ado_work_item(item_type, title, description="", parent_url=None, tags=None):
+    """Enhanced Azure DevOps work item creation with better error handling"""
+    return _post_ado_work_item(item_type, _ado_work_item_patch(title, description, parent_url, tags))
+
+ADO_BATCH_LIMIT = 200  # work item operations per $batch request (service maximum)
+ADO_MAX_CONCURRENCY = 10  # parallel single-item creates when $batch is unavailable
+
+def _create_ado_work_items(items):
+    """Create (item_type, patch) work items through the $batch endpoint.
+
+    Returns the created work item (or None) for each input, in order. If the batch
+    endpoint itself fails, falls back to one request per item, ADO_MAX_CONCURRENCY at a time.
+    """
+    url = f"{ADO_ORGANIZATION_URL}_apis/wit/$batch?api-version=6.0"
+    headers = {
+        'Authorization': get_ado_headers()['Authorization'],
+        'Content-Type': 'application/json'
+    }
+    project = quote(ADO_PROJECT_NAME)
+    results = []
+    
+    for start in range(0, len(items), ADO_BATCH_LIMIT):
+        chunk = items[start:start + ADO_BATCH_LIMIT]
+        operations = [{
+            "method": "PATCH",
+            "uri": f"/{project}/_apis/wit/workitems/${quote(item_type)}?api-version=6.0",
+            "headers": {"Content-Type": "application/json-patch+json"},
+            "body": work_item_data
+        } for item_type, work_item_data in chunk]
+        
+        try:
+            response = ado_http.post(url, headers=headers, data=json_dumps_bytes(operations))
+            response.raise_for_status()
+            entries = json_loads(response.content).get('value', [])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Azure DevOps batch request failed ({e}); creating {len(chunk)} work items individually")
+            # Items within one level are independent, so their round-trips can overlap
+            with ThreadPoolExecutor(max_workers=min(ADO_MAX_CONCURRENCY, len(chunk))) as pool:
+                results.extend(pool.map(lambda item: _post_ado_work_item(*item), chunk))
+            continue
+        
+        for (item_type, _), entry in itertools.zip_longest(chunk, entries[:len(chunk)], fillvalue=None):
+            # Each batch response carries its own status code and a JSON-encoded body
+            body = (entry or {}).get('body')
+            if isinstance(body, str):
+                body = json_loads(body) if body else None
+            if entry and entry.get('code') == 200 and body:
+                print(f"Successfully created {item_type} work item: {body.get('id')}")
+                results.append(body)
+            else:
+                print(f"Error creating Azure DevOps {item_type} work item: {body}")
+                results.append(None)
+    return results
+
+# Backlog hierarchy: the work item type created for each level's children
+ADO_CHILD_TYPES = {"Epic": "Feature", "Feature": "User Story"}
+ADO_DEFAULT_TITLES = {"Epic": "Untitled Epic", "Feature": "Untitled Feature", "User Story": "Untitled Story"}
+_ADO_DESC_SUFFIX = "\n\nGenerated by BA Agent"
+_ADO_TAGS = ("BA-Agent-Generated",)
+
 def process_backlog_for_ado(backlog):
     """Enhanced backlog processing for Azure DevOps with better structure"""
     if not ADO_PAT or not ADO_ORGANIZATION_URL or not ADO_PROJECT_NAME:
@@ -2115,65 +3167,50 @@ def process_backlog_for_ado(backlog):
         return {"success": False, "message": "Azure DevOps not configured"}
     
     try:
+        # Create one hierarchy level per batch (Epics, then Features, then User Stories) so
+        # every child's patch can link the URL of its already-created parent; children of
+        # items that failed to create are skipped
+        created = {}  # id(backlog node) -> created work item
+        level = [("Epic", epic, None) for epic in backlog]
+        while level:
+            items = []
+            for item_type, node, parent in level:
+                title = node.get('title', ADO_DEFAULT_TITLES[item_type])
+                if parent is None:
+                    description = f"{item_type}: {title}{_ADO_DESC_SUFFIX}"
+                    parent_url = None
+                else:
+                    parent_type, parent_node = parent
+                    description = f"{item_type}: {title}\n\nParent {parent_type}: {parent_node.get('title')}"
+                    parent_url = created[id(parent_node)].get('url')
+                items.append((item_type, _ado_work_item_patch(title, description, parent_url, tags=_ADO_TAGS)))
+            
+            next_level = []
+            for (item_type, node, _), result in zip(level, _create_ado_work_items(items)):
+                if result:
+                    created[id(node)] = result
+                    child_type = ADO_CHILD_TYPES.get(item_type)
+                    if child_type:
+                        next_level.extend((child_type, child, (item_type, node)) for child in node.get('children', []))
+            level = next_level
+        
+        # Report created items in backlog (depth-first) order
         created_items = []
         
-        for epic in backlog:
-            # Create Epic
-            epic_description = f"Epic: {epic.get('title', 'Untitled Epic')}\n\nGenerated by BA Agent"
-            epic_result = create_ado_work_item(
-                "Epic", 
-                epic.get('title', 'Untitled Epic'),
-                epic_description,
-                tags=["BA-Agent-Generated"]
-            )
-            
-            if epic_result:
-                epic_url = epic_result.get('url')
-                created_items.append({
-                    "type": "Epic",
-                    "id": epic_result.get('id'),
-                    "title": epic.get('title'),
-                    "url": epic_url
-                })
-                
-                # Create Features under Epic
-                for feature in epic.get('children', []):
-                    feature_description = f"Feature: {feature.get('title', 'Untitled Feature')}\n\nParent Epic: {epic.get('title')}"
-                    feature_result = create_ado_work_item(
-                        "Feature",
-                        feature.get('title', 'Untitled Feature'),
-                        feature_description,
-                        parent_url=epic_url,
-                        tags=["BA-Agent-Generated"]
-                    )
-                    
-                    if feature_result:
-                        feature_url = feature_result.get('url')
-                        created_items.append({
-                            "type": "Feature",
-                            "id": feature_result.get('id'),
-                            "title": feature.get('title'),
-                            "url": feature_url
-                        })
-                        
-                        # Create User Stories under Feature
-                        for story in feature.get('children', []):
-                            story_description = f"User Story: {story.get('title', 'Untitled Story')}\n\nParent Feature: {feature.get('title')}"
-                            story_result = create_ado_work_item(
-                                "User Story",
-                                story.get('title', 'Untitled Story'),
-                                story_description,
-                                parent_url=feature_url,
-                                tags=["BA-Agent-Generated"]
-                            )
-                            
-                            if story_result:
-                                created_items.append({
-                                    "type": "User Story",
-                                    "id": story_result.get('id'),
-                                    "title": story.get('title'),
-                                    "url": story_result.get('url')
-                                })
+        def collect(item_type, nodes):
+            for node in nodes:
+                result = created.get(id(node))
+                if result:
+                    created_items.append({
+                        "type": item_type,
+                        "id": result.get('id'),
+                        "title": node.get('title'),
+                        "url": result.get('url')
+                    })
+                    if item_type in ADO_CHILD_TYPES:
+                        collect(ADO_CHILD_TYPES[item_type], node.get('children', []))
+        
+        collect("Epic", backlog)
         
         return {
             "success": True,
@@ -2187,28 +3224,36 @@ def process_backlog_for_ado(backlog):
 
 # --- Enhanced Email Notification System ---
 
-def send_email_notification(subject, content, recipient_email=None, attachment_data=None):
-    """Enhanced email notification system with better error handling and attachment support"""
+@functools.lru_cache(maxsize=1)
+def _email_client():
+    """One ACS client per process so sends reuse its pooled HTTPS connection"""
+    return EmailClient.from_connection_string(ACS_CONNECTION_STRING)
+
+def send_email_notification(subject, content, recipient_email=None, attachment_data=None, html=None):
+    """Enhanced email notification system with better error handling and attachment support.
+
+    Notifications are plain text; pass ``html`` only when a caller has real markup to send.
+    """
     try:
         if not ACS_CONNECTION_STRING or not ACS_SENDER_ADDRESS:
-            print("Email service not configured, skipping notification")
+            logger.warning("Email service not configured, skipping notification")
             return {"success": False, "message": "Email service not configured"}
         
         # Use provided recipient or default
         recipient = recipient_email or APPROVAL_RECIPIENT_EMAIL
         if not recipient:
-            print("No recipient email configured")
+            logger.warning("No recipient email configured")
             return {"success": False, "message": "No recipient email configured"}
         
-        # Create email client
-        email_client = EmailClient.from_connection_string(ACS_CONNECTION_STRING)
+        email_client = _email_client()
         
         # Prepare email content
         email_content = {
             "subject": subject,
-            "plainText": content,
-            "html": content.replace('\n', '<br>')
+            "plainText": content
         }
+        if html is not None:
+            email_content["html"] = html
         
         # Create message
         message = {
@@ -2229,23 +3274,20 @@ def send_email_notification(subject, content, recipient_email=None, attachment_d
                 "content": attachment_data["content"]
             }
             message["attachments"] = [attachment]
-            print(f"📎 Attachment added: {attachment_data['name']} ({len(attachment_data['content'])} chars)")
-            
-            # Also try alternative attachment format if the first doesn't work
-            # Some Azure services expect different structure
-            print(f"📎 Attachment structure: {attachment}")
+            # Log only the size: formatting the attachment dict would copy the whole base64 body
+            logger.info("📎 Attachment added: %s (%s KiB base64, %s)", attachment_data['name'], len(attachment_data['content']) // 1024, attachment_data['contentType'])
         
         # Send email
         poller = email_client.begin_send(message)
         result = poller.result()
         
-        print(f"✅ Email notification sent successfully to {recipient}")
+        logger.info("✅ Email notification sent successfully to %s", recipient)
         if attachment_data:
-            print(f"📎 Email included attachment: {attachment_data['name']}")
+            logger.info("📎 Email included attachment: %s", attachment_data['name'])
         return {"success": True, "message": "Email sent successfully"}
         
     except Exception as e:
-        print(f"❌ Error sending email notification: {e}")
+        logger.error("❌ Error sending email notification: %s", e)
         return {"success": False, "message": f"Error: {str(e)}"}
 
 def send_analysis_completion_notification(analysis_id, filename, results_summary):
@@ -2296,67 +3338,109 @@ This analysis includes:
     
     return send_email_notification(subject, content)
 
+_MERMAID_FENCE_RE = re.compile(r"```mermaid\n([\s\S]*?)```")
+# Kroki fallback cleanup: noisy node labels and "/(...)" route suffixes inside labels
+_LABEL_NOISE_RE = re.compile(r'([A-Z])\[([^\]]*?)(?:<br>|\([^)]*\))[^\]]*?\]')
+_SLASH_PAREN_RE = re.compile(r'([A-Z])\[([^\]]*?)\/\([^)]*\)([^\]]*?)\]')
+
 def extract_mermaid_code(text):
     if not text:
         return ""
-    match = re.search(r"```mermaid\n([\s\S]*?)```", text)
+    match = _MERMAID_FENCE_RE.search(text)
     if match:
         return match.group(1).strip()
     # Remove any standalone ```
-    text = re.sub(r"```", "", text)
+    text = text.replace("```", "")
     return text.strip()
 
+def _clean_mermaid_code(code):
+    """Clean problematic sequences conservatively to preserve Mermaid syntax"""
+    if not code:
+        return ""
+
+    cleaned = code
+
+    # Step 1: Replace HTML line breaks that often appear in labels
+    cleaned = cleaned.replace('<br>', ' ')
+    cleaned = cleaned.replace('<br/>', ' ')
+    cleaned = cleaned.replace('<br />', ' ')
+
+    # Step 2: Simplify noisy labels while keeping bracket structure intact
+    cleaned = _LABEL_NOISE_RE.sub(lambda m: m.group(1) + '[' + m.group(2).strip() + ']', cleaned)
+
+    # Step 3: Normalize patterns like Q[/policies (GET)] -> Q[policies]
+    cleaned = _SLASH_PAREN_RE.sub(lambda m: m.group(1) + '[' + (m.group(2) + m.group(3)).strip() + ']', cleaned)
+
+    # Do NOT strip critical characters like '<', '>', '/', '\\' as they are used in arrows and syntax
+    # Preserve whitespace and newlines for Mermaid parser
+    cleaned = cleaned.strip()
+
+    return cleaned
+
+# Keep-alive session for Kroki: every diagram in a run reuses one pooled TLS connection.
+# Rendering is a pure function of the posted source, so transient 429/5xx are retried
+kroki_http = requests.Session()
+kroki_http.mount("https://", requests.adapters.HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=None, raise_on_status=False)
+))
+atexit.register(kroki_http.close)
+
+# Rendered PNGs per Mermaid source: Kroki output is a pure function of the source, so
+# re-rendering an unchanged diagram (re-runs, debug endpoints) skips the network entirely
+KROKI_CACHE_SIZE = 128
+_kroki_cache = OrderedDict()  # sha256(source) -> png bytes
+_kroki_cache_lock = threading.Lock()
+
+def _get_cached_png(key):
+    with _kroki_cache_lock:
+        png = _kroki_cache.get(key)
+        if png is not None:
+            _kroki_cache.move_to_end(key)
+        return png
+
+def _store_png(key, png):
+    with _kroki_cache_lock:
+        _kroki_cache[key] = png
+        _kroki_cache.move_to_end(key)
+        if len(_kroki_cache) > KROKI_CACHE_SIZE:
+            _kroki_cache.popitem(last=False)
+
 def render_mermaid_to_png(mermaid_code: str) -> BytesIO:
     """Render Mermaid code to PNG with error handling and code cleaning"""
     
-    def clean_mermaid_code(code):
-        """Clean problematic sequences conservatively to preserve Mermaid syntax"""
-        if not code:
-            return ""
-
-        cleaned = code
-
-        # Step 1: Replace HTML line breaks that often appear in labels
-        cleaned = cleaned.replace('<br>', ' ')
-        cleaned = cleaned.replace('<br/>', ' ')
-        cleaned = cleaned.replace('<br />', ' ')
-
-        # Step 2: Simplify noisy labels while keeping bracket structure intact
-        import re
-        cleaned = re.sub(r'([A-Z])\[([^\]]*?)(?:<br>|\([^)]*\))[^\]]*?\]',
-                         lambda m: m.group(1) + '[' + m.group(2).strip() + ']', cleaned)
-
-        # Step 3: Normalize patterns like Q[/policies (GET)] -> Q[policies]
-        cleaned = re.sub(r'([A-Z])\[([^\]]*?)\/\([^)]*\)([^\]]*?)\]',
-                         lambda m: m.group(1) + '[' + (m.group(2) + m.group(3)).strip() + ']', cleaned)
-
-        # Do NOT strip critical characters like '<', '>', '/', '\\' as they are used in arrows and syntax
-        # Preserve whitespace and newlines for Mermaid parser
-        cleaned = cleaned.strip()
-
-        return cleaned
+    source = mermaid_code.encode("utf-8")
+    cache_key = hashlib.sha256(source).digest()
+    png = _get_cached_png(cache_key)
+    if png is not None:
+        return BytesIO(png)
     
     # Try original code first
     url = "https://kroki.io/mermaid/png"
     headers = {"Content-Type": "text/plain"}
     
     try:
-        response = requests.post(url, data=mermaid_code.encode("utf-8"), headers=headers, timeout=30)
+        response = kroki_http.post(url, data=source, headers=headers, timeout=30)
         if response.status_code == 200:
+            _store_png(cache_key, response.content)
             return BytesIO(response.content)
     except Exception as e:
-        print(f"Failed to render original Mermaid code: {e}")
+        logger.warning("Failed to render original Mermaid code: %s", e)
     
     # Try with cleaned code as fallback
     try:
-        cleaned_code = clean_mermaid_code(mermaid_code)
+        cleaned_code = _clean_mermaid_code(mermaid_code)
         if cleaned_code and cleaned_code != mermaid_code:
-            print(f"Attempting to render cleaned Mermaid code...")
-            response = requests.post(url, data=cleaned_code.encode("utf-8"), headers=headers, timeout=30)
+            logger.info("Attempting to render cleaned Mermaid code...")
+            response = kroki_http.post(url, data=cleaned_code.encode("utf-8"), headers=headers, timeout=30)
             if response.status_code == 200:
+                # Cached under the original source so a repeat skips the failing first attempt too
+                _store_png(cache_key, response.content)
                 return BytesIO(response.content)
     except Exception as e:
-        print(f"Failed to render cleaned Mermaid code: {e}")
+        logger.error("Failed to render cleaned Mermaid code: %s", e)
     
     # If all else fails, create a placeholder image
     raise ValueError(f"Kroki diagram generation failed for both original and cleaned code")
@@ -2376,8 +3460,9 @@ def test_image_extraction():
 
         print(f"🧪 Testing image extraction from: {file.filename}")
         
-        # Test the extraction function
-        text_content, images, error = agent_extract_content(io.BytesIO(file.read()), file.filename)
+        # Test the extraction function; Werkzeug's spooled upload stream is seekable, so
+        # the extractors read it in place instead of from an in-memory copy
+        text_content, images, error = agent_extract_content(file.stream, file.filename)
         
         if error:
             return jsonify({
@@ -2394,7 +3479,7 @@ def test_image_extraction():
             "images": [
                 {
                     "mime_type": img.get('mime_type', 'unknown'),
-                    "data_length": len(img.get('data', ''))
+                    "data_length": encoded_image_length(img.get('data', ''))
                 } for img in images
             ],
             "text_preview": text_content[:500] + "..." if len(text_content) > 500 else text_content
@@ -2434,7 +3519,7 @@ def test_gemini_api():
         print(f"🔑 Using API key: {GEMINI_API_KEY[:10]}...")
         print(f"🌐 API URL: {GEMINI_API_URL}")
         
-        response = requests.post(GEMINI_API_URL, headers=headers, json=payload, timeout=30)
+        response = gemini_http.post(GEMINI_API_URL, headers=headers, json=payload, timeout=30)
         
         print(f"📡 Response status: {response.status_code}")
         
@@ -2516,11 +3601,8 @@ def debug_diagram_generation():
         
         print("🔍 Debugging diagram generation...")
         
-        # Test HLD
-        hld_result, hld_error = agent_diagrammer(test_plan, "HLD")
-        
-        # Test LLD
-        lld_result, lld_error = agent_diagrammer(test_plan, "LLD")
+        # Test HLD and LLD together
+        (hld_result, hld_error), (lld_result, lld_error) = agent_diagrammer_pair(test_plan)
         
         return jsonify({
             "hld": {
@@ -2550,43 +3632,48 @@ def index():
 
 @app.route("/api/generate", methods=['POST'])
 def orchestrator():
-    print("\n--- ORCHESTRATOR: Enhanced generation task started ---")
+    logger.info("\n--- ORCHESTRATOR: Enhanced generation task started ---")
     if 'file' not in request.files:
-        print("No file part in the request")
+        logger.warning("No file part in the request")
         return jsonify({"error": "No file part in the request"}), 400
 
     file = request.files['file']
     
-    # Read file content once and store it
-    file_content_bytes = file.read()
-    file_size = len(file_content_bytes)
-    print(f"DEBUG: File size: {file_size} bytes")
+    # Stream the upload straight to disk once, then extract from the saved file; the
+    # extractors read lazily from a real file handle, so the document is never held
+    # in memory twice
+    uploads_dir = "uploads"
+    doc_id = str(uuid.uuid4())
+    file_path = f"{uploads_dir}/{doc_id}_{file.filename}"
+    try:
+        # Create uploads directory if it doesn't exist
+        if not os.path.exists(uploads_dir):
+            os.makedirs(uploads_dir)
+            logger.info("📁 Created uploads directory: %s", uploads_dir)
+        file.save(file_path)
+        logger.info("💾 [File] Saved file to disk: %s", file_path)
+    except Exception as e:
+        logger.error("❌ Failed to save upload: %s", e)
+        return jsonify({"error": f"Failed to save uploaded file: {str(e)}"}), 500
+
+    file_size = os.path.getsize(file_path)
+    logger.debug("File size: %s bytes", file_size)
     
     # Extract content from file
-    text_content, images, error = agent_extract_content(io.BytesIO(file_content_bytes), file.filename)
+    with open(file_path, 'rb') as file_stream:
+        text_content, images, error = agent_extract_content(file_stream, file.filename)
     if error:
-        print(f"Extraction error: {error}")
+        logger.error("Extraction error: %s", error)
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
         return jsonify({"error": error}), 500
 
-    print(f"DEBUG: Content extracted successfully, length: {len(text_content)} characters")
+    logger.debug("Content extracted successfully, length: %s characters", len(text_content))
 
-    # Save document to database first
+    # Persist the document while the planner runs instead of ahead of it
     try:
-        # Create uploads directory if it doesn't exist
-        uploads_dir = "uploads"
-        if not os.path.exists(uploads_dir):
-            os.makedirs(uploads_dir)
-            print(f"📁 Created uploads directory: {uploads_dir}")
-        
-        # Create document record
-        doc_id = str(uuid.uuid4())
-        file_path = f"{uploads_dir}/{doc_id}_{file.filename}"
-        
-        # Save file to disk
-        with open(file_path, 'wb') as f:
-            f.write(file_content_bytes)
-        print(f"💾 [File] Saved file to disk: {file_path}")
-        
         # Classify LOB for the document
         lob_info = classify_line_of_business(text_content)
 
@@ -2600,22 +3687,29 @@ def orchestrator():
             "lob": lob_info
         }
         
-        print(f"DEBUG: Document data created with ID: {doc_id}")
-        
+        logger.debug("Document data created with ID: %s", doc_id)
+    except Exception as e:
+        logger.error("❌ Error preparing document record: %s", e)
+        lob_info = None
+        document_data = None
+
+    def _persist_document():
+        if document_data is None:
+            return
         # Save to database
         db = next(get_db())
         try:
-            print(f"💾 [DB] Saving document to database: {file.filename}")
+            logger.info("💾 [DB] Saving document to database: %s", file.filename)
             saved_doc = save_document_to_db(db, user_email="guest", file_name=file.filename, file_type=document_data["fileType"], file_path=file_path, file_content=text_content, meta=document_data, status="uploaded")
             
             if saved_doc is None:
-                print("⚠️ Warning: Failed to save document to database, but continuing with analysis")
+                logger.warning("⚠️ Warning: Failed to save document to database, but continuing with analysis")
             else:
-                print(f"✅ [DB] Document stored with ID: {doc_id}")
+                logger.info("✅ [DB] Document stored with ID: %s", doc_id)
 
-                # Add to vector database
-                print(f"📡 [VectorDB] Adding to vector DB...")
-                add_to_vector_db(
+                # Add to vector database in the background; analysis does not wait on indexing
+                logger.info("📡 [VectorDB] Queueing vector DB insert...")
+                embedding_batcher.submit(
                     content=text_content,
                     meta={
                         "id": doc_id,
@@ -2626,48 +3720,31 @@ def orchestrator():
                     },
                     collection_name="documents"
                 )
-                print(f"✅ [VectorDB] Added to vector DB")
 
         except Exception as db_error:
-            print(f"❌ [DB] Failed to save document: {db_error}")
+            logger.error("❌ [DB] Failed to save document: %s", db_error)
             # Continue with analysis even if document save fails
         finally:
             try:
                 db.close()
             except Exception:
                 pass
-                
-    except Exception as e:
-        print(f"❌ Error saving document: {e}")
-        # Continue with analysis even if document save fails
+
+    persist_future = background_executor.submit(_persist_document)
+
+    # The TRD and backlog prompts take a condensed summary instead of the full text;
+    # produce it while the planner runs
+    summary_future = background_executor.submit(agent_summarizer, text_content)
 
     # 1. Enhanced Planning Agent
     plan, error = agent_planner(text_content, images)
     if error:
-        print(f"Planning Agent failed: {error}")
+        logger.error("Planning Agent failed: %s", error)
         return jsonify({"error": f"Planning Agent failed: {error}"}), 500
 
     # 2. Specialist Agents (Enhanced with better error handling)
-    print("AGENT [Orchestrator]: Starting specialist agents...")
+    logger.info("AGENT [Orchestrator]: Starting specialist agents...")
     
-    # Pass LOB context into TRD to enforce P&C US/EU focus when available
-    try:
-        # Try to infer LOB from the latest uploaded document in DB for context
-        inferred_lob = None
-        try:
-            db = next(get_db())
-            docs = get_all_documents_from_db(db)
-            if docs:
-                # Most recent uploaded document carries 'meta' with lob if via upload flow
-                inferred_lob = (docs[0].get('meta') or {}).get('lob')
-        finally:
-            try:
-                db.close()
-            except Exception:
-                pass
-    except Exception:
-        inferred_lob = None
-
     # Initialize enhanced document generator with LLM engine
     class LLMWrapper:
         def __init__(self):
@@ -2678,52 +3755,66 @@ def orchestrator():
     
     enhanced_doc_generator.llm_engine = LLMWrapper()
     
-    # Generate TRD using existing agent (keep for now)
-    trd, err_trd = agent_trd_writer(plan, text_content, lob_info=inferred_lob)
-    print(f"AGENT [Orchestrator]: TRD generation {'✅ Success' if not err_trd else f'❌ Failed: {err_trd}'}")
+    # The specialist agents form two independent chains (TRD -> backlog, HLD -> LLD);
+    # each stage is network-bound, so run the chains concurrently
+    def _trd_and_backlog():
+        # Generate TRD using existing agent (keep for now); it focuses on NFRs, not the LOB
+        source_summary = summary_future.result()
+        trd, err_trd = agent_trd_writer(plan, source_summary)
+        logger.info("AGENT [Orchestrator]: TRD generation %s", '✅ Success' if not err_trd else f'❌ Failed: {err_trd}')
+        
+        # Generate backlog using enhanced generator
+        backlog_json, err_backlog = enhanced_doc_generator.generate_high_quality_backlog(plan, source_summary, trd if not err_trd else "")
+        logger.info("AGENT [Orchestrator]: Enhanced backlog generation %s", '✅ Success' if not err_backlog else f'❌ Failed: {err_backlog}')
+        return trd, err_trd, backlog_json, err_backlog
     
-    # Generate HLD using enhanced generator
-    hld, err_hld = enhanced_doc_generator.generate_high_quality_hld(plan, text_content)
-    print(f"AGENT [Orchestrator]: Enhanced HLD generation {'✅ Success' if not err_hld else f'❌ Failed: {err_hld}'}")
+    def _hld_and_lld():
+        # Generate HLD using enhanced generator
+        hld, err_hld = enhanced_doc_generator.generate_high_quality_hld(plan, text_content)
+        logger.info("AGENT [Orchestrator]: Enhanced HLD generation %s", '✅ Success' if not err_hld else f'❌ Failed: {err_hld}')
+        
+        # Generate LLD using enhanced generator
+        lld, err_lld = enhanced_doc_generator.generate_high_quality_lld(plan, text_content, hld if not err_hld else "")
+        logger.info("AGENT [Orchestrator]: Enhanced LLD generation %s", '✅ Success' if not err_lld else f'❌ Failed: {err_lld}')
+        return hld, err_hld, lld, err_lld
     
-    # Generate LLD using enhanced generator
-    lld, err_lld = enhanced_doc_generator.generate_high_quality_lld(plan, text_content, hld if not err_hld else "")
-    print(f"AGENT [Orchestrator]: Enhanced LLD generation {'✅ Success' if not err_lld else f'❌ Failed: {err_lld}'}")
-    
-    # Generate backlog using enhanced generator
-    backlog_json, err_backlog = enhanced_doc_generator.generate_high_quality_backlog(plan, text_content, trd if not err_trd else "")
-    print(f"AGENT [Orchestrator]: Enhanced backlog generation {'✅ Success' if not err_backlog else f'❌ Failed: {err_backlog}'}")
+    with ThreadPoolExecutor(max_workers=2) as stage_pool:
+        documents_future = stage_pool.submit(_trd_and_backlog)
+        design_future = stage_pool.submit(_hld_and_lld)
+        trd, err_trd, backlog_json, err_backlog = documents_future.result()
+        hld, err_hld, lld, err_lld = design_future.result()
     
     # Debug: Log what we received from the backlog creator
-    print(f"AGENT [Orchestrator]: Backlog creator returned:")
-    print(f"  Type: {type(backlog_json)}")
-    print(f"  Error: {err_backlog}")
-    if isinstance(backlog_json, dict):
-        print(f"  Keys: {list(backlog_json.keys())}")
-        if 'backlog' in backlog_json:
-            print(f"  Backlog length: {len(backlog_json['backlog'])}")
-    elif isinstance(backlog_json, str):
-        print(f"  String length: {len(backlog_json)}")
-        print(f"  First 200 chars: {backlog_json[:200]}...")
-
-    print(f"AGENT [Orchestrator]: Agent results:")
-    print(f"  TRD: {'✅ Success' if not err_trd else f'❌ Failed: {err_trd}'}")
-    print(f"  HLD: {'✅ Success' if not err_hld else f'❌ Failed: {err_hld}'}")
-    print(f"  LLD: {'✅ Success' if not err_lld else f'❌ Failed: {err_lld}'}")
-    print(f"  Backlog: {'✅ Success' if not err_backlog else f'❌ Failed: {err_backlog}'}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("AGENT [Orchestrator]: Backlog creator returned:")
+        logger.debug("  Type: %s", type(backlog_json))
+        logger.debug("  Error: %s", err_backlog)
+        if isinstance(backlog_json, dict):
+            logger.debug("  Keys: %s", list(backlog_json.keys()))
+            if 'backlog' in backlog_json:
+                logger.debug("  Backlog length: %s", len(backlog_json['backlog']))
+        elif isinstance(backlog_json, str):
+            logger.debug("  String length: %s", len(backlog_json))
+            logger.debug("  First 200 chars: %s...", backlog_json[:200])
+
+    logger.info("AGENT [Orchestrator]: Agent results:")
+    logger.info("  TRD: %s", '✅ Success' if not err_trd else f'❌ Failed: {err_trd}')
+    logger.info("  HLD: %s", '✅ Success' if not err_hld else f'❌ Failed: {err_hld}')
+    logger.info("  LLD: %s", '✅ Success' if not err_lld else f'❌ Failed: {err_lld}')
+    logger.info("  Backlog: %s", '✅ Success' if not err_backlog else f'❌ Failed: {err_backlog}')
 
     # Count successful and failed agents
     successful_agents = sum([1 for err in [err_trd, err_hld, err_lld, err_backlog] if not err])
     total_agents = 4
     
-    print(f"AGENT [Orchestrator]: {successful_agents}/{total_agents} agents completed successfully")
+    logger.info("AGENT [Orchestrator]: %s/%s agents completed successfully", successful_agents, total_agents)
     
     # Continue with partial results if at least some agents succeeded
     if successful_agents == 0:
-        print("AGENT [Orchestrator]: All specialist agents failed")
+        logger.error("AGENT [Orchestrator]: All specialist agents failed")
         return jsonify({"error": "All specialist agents failed. Please try again."}), 500
     elif successful_agents < total_agents:
-        print(f"AGENT [Orchestrator]: Partial success - {successful_agents}/{total_agents} agents completed")
+        logger.info("AGENT [Orchestrator]: Partial success - %s/%s agents completed", successful_agents, total_agents)
     
     # 3. Final Assembly with Enhanced Results
     try:
@@ -2734,24 +3825,24 @@ def orchestrator():
                 # Enhanced generator returns dictionary directly
                 if isinstance(backlog_json, dict):
                     actual_backlog_list = backlog_json.get('backlog', [])
-                    print("AGENT [Orchestrator]: Enhanced backlog generator returned dictionary, extracted backlog list")
+                    logger.info("AGENT [Orchestrator]: Enhanced backlog generator returned dictionary, extracted backlog list")
                 else:
                     # Fallback: try to parse as JSON string
-                    backlog_data = json.loads(backlog_json)
+                    backlog_data = json_loads(backlog_json)
                     actual_backlog_list = backlog_data.get('backlog', [])
-                    print("AGENT [Orchestrator]: Parsed backlog from JSON string (fallback)")
+                    logger.info("AGENT [Orchestrator]: Parsed backlog from JSON string (fallback)")
                 
                 if not isinstance(actual_backlog_list, list):
-                    print("Warning: Backlog is not a list, correcting.")
+                    logger.warning("Warning: Backlog is not a list, correcting.")
                     actual_backlog_list = []
                     
-                print(f"AGENT [Orchestrator]: Backlog contains {len(actual_backlog_list)} epics")
+                logger.info("AGENT [Orchestrator]: Backlog contains %s epics", len(actual_backlog_list))
                 
             except Exception as e:
-                print(f"Backlog processing error: {e}")
+                logger.error("Backlog processing error: %s", e)
                 actual_backlog_list = []
         else:
-            print("Backlog creation failed, using empty backlog")
+            logger.warning("Backlog creation failed, using empty backlog")
         
         # Process enhanced document results
         hld_clean = ""
@@ -2760,22 +3851,22 @@ def orchestrator():
         if not err_hld and hld:
             # Enhanced generator returns Mermaid diagrams, extract the code
             hld_clean = extract_mermaid_code(hld)
-            print(f"AGENT [Orchestrator]: Enhanced HLD result: {'✅ Available' if hld_clean else '❌ Empty'}")
+            logger.info("AGENT [Orchestrator]: Enhanced HLD result: %s", '✅ Available' if hld_clean else '❌ Empty')
         else:
-            print(f"AGENT [Orchestrator]: Enhanced HLD failed or empty: {err_hld}")
+            logger.warning("AGENT [Orchestrator]: Enhanced HLD failed or empty: %s", err_hld)
             
         if not err_lld and lld:
             # Enhanced generator returns Mermaid diagrams, extract the code
             lld_clean = extract_mermaid_code(lld)
-            print(f"AGENT [Orchestrator]: Enhanced LLD result: {'✅ Available' if lld_clean else '❌ Empty'}")
+            logger.info("AGENT [Orchestrator]: Enhanced LLD result: %s", '✅ Available' if lld_clean else '❌ Empty')
         else:
-            print(f"AGENT [Orchestrator]: Enhanced LLD failed or empty: {err_lld}")
+            logger.warning("AGENT [Orchestrator]: Enhanced LLD failed or empty: %s", err_lld)
         
-        print(f"AGENT [Orchestrator]: Final assembly:")
-        print(f"  TRD: {'✅ Available' if trd else '❌ Not available'}")
-        print(f"  HLD: {'✅ Available' if hld_clean else '❌ Not available'}")
-        print(f"  LLD: {'✅ Available' if lld_clean else '❌ Not available'}")
-        print(f"  Backlog: {'✅ Available' if actual_backlog_list else '❌ Not available'}")
+        logger.info("AGENT [Orchestrator]: Final assembly:")
+        logger.info("  TRD: %s", '✅ Available' if trd else '❌ Not available')
+        logger.info("  HLD: %s", '✅ Available' if hld_clean else '❌ Not available')
+        logger.info("  LLD: %s", '✅ Available' if lld_clean else '❌ Not available')
+        logger.info("  Backlog: %s", '✅ Available' if actual_backlog_list else '❌ Not available')
 
         # Generate a TRD document number for this analysis
         trd_document_number = f"TRD-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
@@ -2784,7 +3875,10 @@ def orchestrator():
             "trd": trd or "Technical Requirements Document could not be generated due to API error.",
             "hld": hld_clean or "High-Level Design document could not be generated due to API error.",
             "lld": lld_clean or "Low-Level Design document could not be generated due to API error.",
-            "images": images,
+            "images": [
+                {"mime_type": img["mime_type"], "data": encode_image_data(img["data"])}
+                for img in images
+            ],
             "backlog": add_ids_to_backlog(actual_backlog_list),
             "enhanced_plan": plan or "",
             "partial_success": successful_agents < total_agents,
@@ -2805,49 +3899,56 @@ def orchestrator():
             }
         }
         
-        # Debug: Print the final backlog structure
-        print(f"AGENT [Orchestrator]: Final backlog structure:")
-        print(f"  Type: {type(final_response['backlog'])}")
-        print(f"  Length: {len(final_response['backlog']) if isinstance(final_response['backlog'], list) else 'Not a list'}")
-        if final_response['backlog']:
-            print(f"  First item type: {type(final_response['backlog'][0])}")
-            print(f"  First item keys: {list(final_response['backlog'][0].keys()) if isinstance(final_response['backlog'][0], dict) else 'Not a dict'}")
+        # Debug: Print the final backlog structure; the JSON sample is only serialized when enabled
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("AGENT [Orchestrator]: Final backlog structure:")
+            logger.debug("  Type: %s", type(final_response['backlog']))
+            logger.debug("  Length: %s", len(final_response['backlog']) if isinstance(final_response['backlog'], list) else 'Not a list')
+            if final_response['backlog']:
+                logger.debug("  First item type: %s", type(final_response['backlog'][0]))
+                logger.debug("  First item keys: %s", list(final_response['backlog'][0].keys()) if isinstance(final_response['backlog'][0], dict) else 'Not a dict')
         
-        # Debug: Print a sample of the backlog JSON
-        try:
-            backlog_json_sample = json.dumps(final_response['backlog'][:1], indent=2) if final_response['backlog'] else "[]"
-            print(f"AGENT [Orchestrator]: Sample backlog JSON (first item):")
-            print(backlog_json_sample[:500] + "..." if len(backlog_json_sample) > 500 else backlog_json_sample)
-        except Exception as e:
-            print(f"AGENT [Orchestrator]: Error serializing backlog sample: {e}")
+            # Debug: Print a sample of the backlog JSON
+            try:
+                backlog_json_sample = json.dumps(final_response['backlog'][:1], separators=(',', ':'), default=str) if final_response['backlog'] else "[]"
+                logger.debug("AGENT [Orchestrator]: Sample backlog JSON (first item):")
+                logger.debug("%s", backlog_json_sample[:500] + "..." if len(backlog_json_sample) > 500 else backlog_json_sample)
+            except Exception as e:
+                logger.debug("AGENT [Orchestrator]: Error serializing backlog sample: %s", e)
     except Exception as e:
         import traceback
-        print(f"Error during final assembly: {e}")
+        logger.error("Error during final assembly: %s", e)
         traceback.print_exc()
         return jsonify({"error": f"Error during final assembly: {e}"}), 500
 
-    print("--- ORCHESTRATOR: All enhanced agents completed. Task finished. ---\n")
+    logger.info("--- ORCHESTRATOR: All enhanced agents completed. Task finished. ---\n")
+    
+    # The analysis record references the document row, so let its insert finish first
+    try:
+        persist_future.result()
+    except Exception as e:
+        logger.error("❌ Error saving document: %s", e)
     
     # Save analysis results first
     try:
         analysis_id = save_analysis_results(final_response, text_content, file.filename if file else "requirements.txt", document_id=doc_id if 'doc_id' in locals() else None)
         final_response["analysis_id"] = analysis_id
-        print(f"AGENT [Orchestrator]: Analysis saved with ID: {analysis_id}")
+        logger.info("AGENT [Orchestrator]: Analysis saved with ID: %s", analysis_id)
     except Exception as e:
-        print(f"AGENT [Orchestrator]: Warning - Failed to save analysis results: {e}")
+        logger.warning("AGENT [Orchestrator]: Warning - Failed to save analysis results: %s", e)
         analysis_id = "unknown"
         final_response["analysis_id"] = analysis_id
     
     # Log total token consumption for this analysis
     try:
-        total_tokens = sum(log['tokens_used'] for log in token_consumption_logs)
+        total_tokens = _total_tokens
         log_token_consumption("analysis_complete", total_tokens, "gemini-1.5-pro", {
             "total_stages": len(token_consumption_logs),
             "analysis_id": analysis_id,
             "filename": file.filename if file else "requirements.txt"
         })
     except Exception as e:
-        print(f"AGENT [Orchestrator]: Warning - Failed to log token consumption: {e}")
+        logger.warning("AGENT [Orchestrator]: Warning - Failed to log token consumption: %s", e)
     
     # Send completion notification (optional - don't fail if this fails)
     try:
@@ -2863,22 +3964,57 @@ TRD Document Number: {final_response.get('trd_document_number','N/A')}
 Analysis ID: {analysis_id}
 """
         
-        email_result = send_analysis_completion_notification(
-            analysis_id, 
-            file.filename if file else "requirements.txt",
-            results_summary
-        )
+        completed_filename = file.filename if file else "requirements.txt"
         
-        if email_result["success"]:
-            print("Email notification sent successfully")
-        else:
-            print(f"Email notification failed: {email_result['message']}")
+        # The client gets the analysis without waiting on the ACS send poller
+        def _send_completion_email():
+            email_result = send_analysis_completion_notification(
+                analysis_id, 
+                completed_filename,
+                results_summary
+            )
+            
+            if email_result["success"]:
+                logger.info("Email notification sent successfully")
+            else:
+                logger.warning("Email notification failed: %s", email_result['message'])
+        
+        background_executor.submit(_send_completion_email)
     except Exception as e:
-        print(f"AGENT [Orchestrator]: Warning - Failed to send email notification: {e}")
+        logger.warning("AGENT [Orchestrator]: Warning - Failed to send email notification: %s", e)
     
-    print("AGENT [Orchestrator]: Returning successful response to client")
+    logger.info("AGENT [Orchestrator]: Returning successful response to client")
     return jsonify(final_response)
 
+@app.route("/api/generate_trd_stream", methods=['POST'])
+def generate_trd_stream():
+    """Stream TRD sections to the client as server-sent events while Gemini writes them"""
+    data = request.get_json(silent=True) or {}
+    plan = data.get('plan')
+    original_text = data.get('original_text', '')
+    if not plan:
+        return jsonify({"error": "plan is required"}), 400
+    
+    def generate():
+        sections = queue.Queue()
+        outcome = {}
+        
+        def write():
+            try:
+                outcome['trd'], outcome['error'] = agent_trd_writer(plan, agent_summarizer(original_text), on_section=sections.put)
+            except Exception as e:
+                outcome['error'] = str(e)
+            finally:
+                sections.put(None)  # end-of-stream marker
+        
+        threading.Thread(target=write, daemon=True).start()
+        while (section := sections.get()) is not None:
+            yield f"event: section\ndata: {json.dumps({'markdown': section})}\n\n"
+        yield f"event: done\ndata: {json.dumps({'error': outcome.get('error')})}\n\n"
+    
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route("/api/render_mermaid", methods=["POST"])
 def render_mermaid():
     data = request.get_json()
@@ -2942,15 +4078,16 @@ def send_for_approval():
             return jsonify({"error": "Missing analysis_id or results"}), 400
         
         # Generate unique approval ID
-        approval_id = str(uuid.uuid4())
+        approval_id = uuid.uuid4().hex
+        now_iso = datetime.now().isoformat()
         
         # Create approval record with enhanced status tracking
         approval_record = {
             "id": approval_id,
             "analysis_id": analysis_id,
             "status": "pending",
-            "created_date": datetime.now().isoformat(),  # Changed from created_at
-            "updated_date": datetime.now().isoformat(),  # Changed from updated_at
+            "created_date": now_iso,  # Changed from created_at
+            "updated_date": now_iso,  # Changed from updated_at
             "approver_email": APPROVAL_RECIPIENT_EMAIL,
             "results_summary": {
                 "has_trd": bool(results.get('trd')),
@@ -2987,12 +4124,16 @@ def send_for_approval():
                 print(f"⚠️ No TRD content found in results")
                 print(f"📄 Available keys in results: {list(results.keys())}")
             
-            email_result = send_approval_notification(analysis_id, "Analysis Results", approval_url, trd_content=trd_content, trd_document_number=trd_document_number)
+            # Delivered in the background; the approval record and URL don't depend on it
+            def _send_approval_request_email():
+                email_result = send_approval_notification(analysis_id, "Analysis Results", approval_url, trd_content=trd_content, trd_document_number=trd_document_number)
+                
+                if email_result["success"]:
+                    print(f"✅ Approval notification sent successfully for approval ID: {approval_id}")
+                else:
+                    print(f"⚠️ Approval notification failed: {email_result['message']} - continuing with approval workflow")
             
-            if email_result["success"]:
-                print(f"✅ Approval notification sent successfully for approval ID: {approval_id}")
-            else:
-                print(f"⚠️ Approval notification failed: {email_result['message']} - continuing with approval workflow")
+            background_executor.submit(_send_approval_request_email)
         except Exception as e:
             print(f"⚠️ Email notification error (continuing): {e}")
         
@@ -3063,7 +4204,7 @@ def test_trd_attachment():
             
             # Create attachment data
             docx_content = docx_bytes.getvalue()
-            base64_content = base64.b64encode(docx_content).decode('utf-8')
+            base64_content = _b64(docx_content)
             
             attachment_data = {
                 "name": f"Test_TRD_{analysis_id}.docx",
@@ -3309,12 +4450,16 @@ You can view the full results in the BA Agent application.
                     content += f"\n\nADO Work Items: Failed to create"
                     content += f"\nADO Error: {ado_result.get('message')}"
             
-            email_result = send_email_notification(subject, content)
+            # The ACS send waits on a long-running poller and its outcome is only logged,
+            # so deliver it in the background instead of holding the response
+            def _send_approval_email():
+                email_result = send_email_notification(subject, content)
+                if email_result["success"]:
+                    print(f"✅ Approval {action} notification sent successfully")
+                else:
+                    print(f"❌ Approval {action} notification failed: {email_result['message']}")
             
-            if email_result["success"]:
-                print(f"✅ Approval {action} notification sent successfully")
-            else:
-                print(f"❌ Approval {action} notification failed: {email_result['message']}")
+            background_executor.submit(_send_approval_email)
             
             return jsonify({
                 "success": True,
@@ -3502,43 +4647,18 @@ def delete_point(collection_name, point_id):
 
 # --- Enhanced Image Processing ---
 def setup_enhanced_image_processing():
-    """Setup enhanced image processing with multiple libraries"""
+    """Report which image processing libraries were found at startup"""
     print("🔧 Setting up enhanced image processing...")
     
     available_libraries = {
-        'PIL/Pillow': False,
-        'ImageMagick (Wand)': False,
-        'OpenCV': False,
-        'pdf2image': False
+        'PIL/Pillow': PIL_AVAILABLE,
+        'ImageMagick (Wand)': WAND_AVAILABLE,
+        'OpenCV': OPENCV_AVAILABLE,
+        'pdf2image': PDF2IMAGE_AVAILABLE
     }
     
-    try:
-        from PIL import Image, ImageDraw
-        available_libraries['PIL/Pillow'] = True
-        print("✅ PIL/Pillow available")
-    except ImportError:
-        print("❌ PIL/Pillow not available")
-    
-    try:
-        from wand.image import Image as WandImage
-        available_libraries['ImageMagick (Wand)'] = True
-        print("✅ ImageMagick (Wand) available")
-    except ImportError:
-        print("❌ ImageMagick (Wand) not available")
-    
-    try:
-        import cv2
-        available_libraries['OpenCV'] = True
-        print("✅ OpenCV available")
-    except ImportError:
-        print("❌ OpenCV not available")
-    
-    try:
-        from pdf2image import convert_from_bytes
-        available_libraries['pdf2image'] = True
-        print("✅ pdf2image available")
-    except ImportError:
-        print("❌ pdf2image not available")
+    for name, available in available_libraries.items():
+        print(f"✅ {name} available" if available else f"❌ {name} not available")
     
     print(f"📊 Available libraries: {sum(available_libraries.values())}/{len(available_libraries)}")
     return available_libraries
@@ -3549,7 +4669,15 @@ def process_images_with_multiple_methods(images):
     
     for img in images:
         mime_type = img.get('mime_type', '')
-        image_data = base64.b64decode(img.get('data', ''))
+        if mime_type.lower() in GEMINI_SUPPORTED_IMAGE_TYPES:
+            # Accepted natively (and already downsampled at extraction); re-encoding
+            # would only turn JPEG/WebP into larger PNGs
+            processed_images.append(img)
+            continue
+
+        image_data = img.get('data', b'')
+        if isinstance(image_data, str):
+            image_data = base64.b64decode(image_data)
         
         # Method 1: Try PIL
         processed_img = convert_with_pil(image_data, mime_type)
@@ -3592,10 +4720,10 @@ def convert_with_pil(image_data, mime_type):
         
         return {
             'mime_type': 'image/png',
-            'data': base64.b64encode(converted_data).decode('utf-8')
+            'data': converted_data
         }
     except Exception as e:
-        print(f"DEBUG: PIL conversion failed for {mime_type}: {e}")
+        logger.debug("PIL conversion failed for %s: %s", mime_type, e)
         return None
 
 def convert_with_wand(image_data, mime_type):
@@ -3609,13 +4737,13 @@ def convert_with_wand(image_data, mime_type):
             
             return {
                 'mime_type': 'image/png',
-                'data': base64.b64encode(converted_data).decode('utf-8')
+                'data': converted_data
             }
     except ImportError:
-        print("DEBUG: ImageMagick (wand) not available")
+        logger.debug("ImageMagick (wand) not available")
         return None
     except Exception as e:
-        print(f"DEBUG: ImageMagick conversion failed for {mime_type}: {e}")
+        logger.debug("ImageMagick conversion failed for %s: %s", mime_type, e)
         return None
 
 def convert_with_opencv(image_data, mime_type):
@@ -3637,13 +4765,13 @@ def convert_with_opencv(image_data, mime_type):
             converted_data = buffer.tobytes()
             return {
                 'mime_type': 'image/png',
-                'data': base64.b64encode(converted_data).decode('utf-8')
+                'data': converted_data
             }
     except ImportError:
-        print("DEBUG: OpenCV not available")
+        logger.debug("OpenCV not available")
         return None
     except Exception as e:
-        print(f"DEBUG: OpenCV conversion failed for {mime_type}: {e}")
+        logger.debug("OpenCV conversion failed for %s: %s", mime_type, e)
         return None
 
 def create_placeholder(mime_type):
@@ -3664,10 +4792,10 @@ def create_placeholder(mime_type):
         
         return {
             'mime_type': 'image/png',
-            'data': base64.b64encode(converted_data).decode('utf-8')
+            'data': converted_data
         }
     except Exception as e:
-        print(f"DEBUG: Failed to create placeholder: {e}")
+        logger.debug("Failed to create placeholder: %s", e)
         return None
 
 # Initialize enhanced image processing
@@ -3705,7 +4833,7 @@ def check_ado_status():
         try:
             headers = get_ado_headers()
             test_url = f"{ADO_ORGANIZATION_URL}{ADO_PROJECT_NAME}/_apis/project?api-version=6.0"
-            response = requests.get(test_url, headers=headers)
+            response = ado_http.get(test_url, headers=headers)
             
             if response.status_code == 200:
                 project_info = response.json()
@@ -23,6 +23,29 @@ const SendIcon = GlobalIcons.SendIcon;
 // API Configuration - use relative URL for production, localhost for development
 const API_BASE_URL = process.env.REACT_APP_API_URL || (process.env.NODE_ENV === 'production' ? '' : 'http://127.0.0.1:5000');
 
+// /api/documents is paginated (max 200 per page); walk every page so lists are never truncated.
+// Returns null when the endpoint is unavailable.
+const DOCUMENTS_PAGE_SIZE = 200;
+const fetchAllDocuments = async () => {
+  const documents = [];
+  for (let offset = 0; ; offset += DOCUMENTS_PAGE_SIZE) {
+    const response = await fetch(`${API_BASE_URL}/api/documents?limit=${DOCUMENTS_PAGE_SIZE}&offset=${offset}`);
+    if (!response.ok) {
+      return offset === 0 ? null : documents;
+    }
+    const data = await response.json();
+    // Handle both old format (array) and paginated format (object with items array)
+    if (Array.isArray(data)) {
+      return data;
+    }
+    const items = data.items || data.documents || [];
+    documents.push(...items);
+    if (items.length < DOCUMENTS_PAGE_SIZE || documents.length >= (data.total ?? 0)) {
+      return documents;
+    }
+  }
+};
+
 // React Error Boundary to catch DOM manipulation errors
 class ErrorBoundary extends React.Component {
   constructor(props) {
@@ -2149,8 +2172,13 @@ const DocumentsSection = ({ documents, selectedDocument, setSelectedDocument, se
       
       if (response.ok) {
         const newDoc = await response.json();
-        setDocuments(prev => [...prev, newDoc]);
-        setNotification({ message: 'Document uploaded successfully!', type: 'success' });
+        if (newDoc.duplicate_content) {
+          // Same bytes are already stored under another record; it is already in the list
+          setNotification({ message: `Same content already stored as ${newDoc.name}`, type: 'info' });
+        } else {
+          setDocuments(prev => [...prev, newDoc]);
+          setNotification({ message: 'Document uploaded successfully!', type: 'success' });
+        }
       } else {
         throw new Error('Upload failed');
       }
@@ -2742,16 +2770,14 @@ function MainApp() {
     
     const loadData = async () => {
       try {
-        const [docsResponse, analysesResponse] = await Promise.all([
-          fetch(`${API_BASE_URL}/api/documents`),
+        const [docsList, analysesResponse] = await Promise.all([
+          fetchAllDocuments(),
           fetch(`${API_BASE_URL}/api/analyses`)
         ]);
         
         if (isMounted) {
-          if (docsResponse.ok) {
-            const docsData = await docsResponse.json();
-            // Handle both old format (array) and new format (object with documents array)
-            setDocuments(Array.isArray(docsData) ? docsData : (docsData.documents || []));
+          if (docsList) {
+            setDocuments(docsList);
           } else {
             console.log('Documents endpoint not available yet');
             setDocuments([]);
@@ -2855,14 +2881,13 @@ function MainApp() {
         setNotifications(prev => [...prev, `New analysis completed for ${file.name}`]);
         
         // Reload data
-        const [docsResponse, analysesResponse] = await Promise.all([
-          fetch(`${API_BASE_URL}/api/documents`),
+        const [docsList, analysesResponse] = await Promise.all([
+          fetchAllDocuments(),
           fetch(`${API_BASE_URL}/api/analyses`)
         ]);
         
-        if (docsResponse.ok) {
-          const docsData = await docsResponse.json();
-          setDocuments(docsData);
+        if (docsList) {
+          setDocuments(docsList);
         }
         
         if (analysesResponse.ok) {